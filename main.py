@@ -5,12 +5,23 @@
 2. 命令行参数模式（从Web界面调用）
 """
 import asyncio
+import os
 import sys
 import json
 import argparse
 from src.scraper import scrape_xianyu
 from src.utils import log_time
-from src.config import TASKS_FILE, get_notification_config
+from src.config import TASKS_FILE, JSONL_OUTPUT_DIR, get_notification_config
+from src.alert_rules import AlertEngine, compile_rules, set_current_alert_engine
+from src.notify_dispatcher import NotificationDispatcher
+from src.notify_outbox import NotifyOutbox, OutboxWorker, set_current_outbox
+from src.detail_fetcher import set_detail_concurrency
+from src.detail_gate import DetailFetchGate, set_current_gate
+from src.price_history import PriceHistory, set_current_price_history
+from src.result_segments import set_current_record_hook
+from src.route_filter import create_route_filter, set_current_route_filter
+from src.seen_store import SeenStore
+from src.task_store import TaskStore, task_db_path
 
 
 def print_banner():
@@ -28,19 +39,21 @@ def print_banner():
 
 
 def load_task_by_id(task_id):
-    """根据任务ID加载任务配置"""
+    """根据任务ID加载任务配置（与Web服务共用任务数据库）"""
     try:
-        with open(TASKS_FILE, 'r', encoding='utf-8') as f:
-            tasks = json.load(f)
+        store = TaskStore(task_db_path(TASKS_FILE), TASKS_FILE)
+        try:
+            task = store.get(task_id)
+        finally:
+            store.close()
 
-        for task in tasks:
-            if task['id'] == task_id:
-                return task
+        if task is not None:
+            return task
 
         print(f"错误: 未找到任务ID为 {task_id} 的任务")
         return None
     except Exception as e:
-        print(f"错误: 加载任务文件失败 - {e}")
+        print(f"错误: 加载任务数据失败 - {e}")
         return None
 
 
@@ -109,6 +122,8 @@ async def run_task_with_args(args):
         min_price = task_config.get('min_price')
         max_price = task_config.get('max_price')
         task_name = task_config.get('task_name', 'Unnamed Task')
+        detail_concurrency = task_config.get('detail_concurrency')
+        alert_rules = task_config.get('alert_rules') or []
 
         # 获取通知配置
         notify_config = get_notification_config()
@@ -123,6 +138,8 @@ async def run_task_with_args(args):
         min_price = args.min_price
         max_price = args.max_price
         task_name = args.task_name or f"Task_{keyword}"
+        detail_concurrency = args.detail_concurrency
+        alert_rules = []
 
         # 获取通知配置
         notify_config = get_notification_config()
@@ -136,17 +153,81 @@ async def run_task_with_args(args):
     print(f"  只看个人闲置: {'是' if personal_only else '否'}")
     if min_price or max_price:
         print(f"  价格范围: {min_price or '不限'} - {max_price or '不限'}")
+    if detail_concurrency and detail_concurrency > 1:
+        print(f"  详情并发数: {detail_concurrency}")
+    if alert_rules:
+        print(f"  提醒规则: {len(alert_rules)} 条")
 
     print("="*60 + "\n")
 
+    # 爬虫通过 get_detail_concurrency() 读取
+    set_detail_concurrency(detail_concurrency)
+
     # 执行爬取
-    await execute_scrape(keyword, max_pages, personal_only, min_price, max_price, args.debug, notify_config)
+    await execute_scrape(keyword, max_pages, personal_only, min_price, max_price, args.debug, notify_config,
+                         alert_rules)
+
+
+async def run_task_by_id(task_id, debug_limit=0):
+    """按任务ID执行一次爬取（供 Web 服务进程内执行模式调用）"""
+    args = argparse.Namespace(task_id=task_id, debug=debug_limit)
+    await run_task_with_args(args)
 
 
-async def execute_scrape(keyword, max_pages, personal_only, min_price, max_price, debug_limit, notify_config=None):
+def create_alert_engine(alert_rules, outbox, worker, channels):
+    """按任务的提醒规则创建规则引擎，没有规则、规则无效或没有通知渠道时返回 None"""
+    if not alert_rules or not channels:
+        return None
+    try:
+        rules = compile_rules(alert_rules)
+    except ValueError as e:
+        log_time(f"提醒规则无效，本次不启用: {e}")
+        return None
+
+    async def notify(record, rule_names):
+        # 写入发件箱即返回，由后台发送（渠道慢或宕机不拖慢爬取）
+        await asyncio.to_thread(outbox.enqueue, [record], f"命中提醒规则: {'、'.join(rule_names)}", channels)
+        worker.wake()
+
+    return AlertEngine(rules, notify)
+
+
+async def execute_scrape(keyword, max_pages, personal_only, min_price, max_price, debug_limit, notify_config=None,
+                         alert_rules=None):
     """执行爬取任务的核心函数"""
     log_time("开始爬取任务...")
 
+    # 推送先写入发件箱（由爬虫通过 get_current_outbox() 使用），运行期间在后台发送，失败的留给下次重试
+    channels = NotificationDispatcher.configured_channels(notify_config)
+    outbox = worker = dispatcher = None
+    if channels:
+        outbox = NotifyOutbox.for_results_dir(JSONL_OUTPUT_DIR)
+        dispatcher = NotificationDispatcher()
+        send_config = notify_config
+        worker = OutboxWorker(outbox, dispatcher, lambda: send_config)
+        worker.start()
+    set_current_outbox(outbox)
+
+    # 配置了提醒规则时，爬虫每保存一条记录（ResultWriter 的记录回调）就求值并推送命中的商品。
+    # 规则生效时推送只按规则进行，不再把 notify_config 交给爬虫做 auto_push，避免同一商品推送两次
+    alert_engine = create_alert_engine(alert_rules, outbox, worker, channels)
+    set_current_alert_engine(alert_engine)
+    set_current_record_hook(alert_engine.submit if alert_engine is not None else None)
+    scraper_notify_config = None if alert_engine is not None else notify_config
+
+    # 列表数据未变化的已见商品跳过详情页（由爬虫通过 get_current_gate() 使用）
+    seen_store = SeenStore.for_results_dir(JSONL_OUTPUT_DIR)
+    gate = DetailFetchGate(seen_store)
+    set_current_gate(gate)
+
+    # 记录搜索结果中每个商品的价格，已见商品改价时写入降价记录（由爬虫通过 get_current_price_history() 使用）
+    price_history = PriceHistory.for_results_dir(JSONL_OUTPUT_DIR)
+    set_current_price_history(price_history)
+
+    # 拦截图片/视频/字体/统计脚本（BLOCK_RESOURCES=false 时不启用）
+    route_filter = create_route_filter()
+    set_current_route_filter(route_filter)
+
     try:
         processed_count = await scrape_xianyu(
             keyword=keyword,
@@ -155,10 +236,16 @@ async def execute_scrape(keyword, max_pages, personal_only, min_price, max_price
             min_price=min_price,
             max_price=max_price,
             debug_limit=debug_limit,
-            notify_config=notify_config
+            notify_config=scraper_notify_config
         )
 
         log_time(f"爬取任务完成！共处理 {processed_count} 个新商品。")
+        if gate.fetched or gate.counters['skipped']:
+            log_time(gate.summary())
+        if price_history.counters['observed']:
+            log_time(price_history.summary())
+        if route_filter is not None and (route_filter.blocked or route_filter.page_loads):
+            log_time(route_filter.summary())
         print(f"\n数据已保存到: jsonl/{keyword}_full_data.jsonl")
         return processed_count
 
@@ -167,13 +254,29 @@ async def execute_scrape(keyword, max_pages, personal_only, min_price, max_price
         import traceback
         traceback.print_exc()
         return 0
+    finally:
+        # 爬取出错时也把已命中的商品写入发件箱
+        if alert_engine is not None:
+            await alert_engine.drain()
+            log_time(alert_engine.summary())
+        if worker is not None:
+            # 最多再等待 NOTIFY_FLUSH_SECONDS 秒发送到期的推送，其余由 Web 服务或下次运行继续发送
+            await worker.stop()
+            sent = await worker.flush(float(os.getenv('NOTIFY_FLUSH_SECONDS', '15')))
+            status = outbox.status()
+            log_time(f"通知发件箱: 本次结束前发送 {sent} 条，待发送 {status['queued'] + status['sending']} 条，"
+                     f"已放弃 {status['failed']} 条")
+            dispatcher.close()
+            outbox.close()
+        seen_store.close()
+        price_history.close()
 
 
 async def main():
     """主函数"""
     # 解析命令行参数
     parser = argparse.ArgumentParser(description='闲鱼爬虫程序')
-    parser.add_argument('--task-id', type=str, help='从tasks.json加载指定ID的任务')
+    parser.add_argument('--task-id', type=str, help='从任务数据库加载指定ID的任务')
     parser.add_argument('--keyword', type=str, help='搜索关键词')
     parser.add_argument('--pages', type=int, default=1, help='爬取页数')
     parser.add_argument('--personal-only', action='store_true', help='只看个人闲置')
@@ -181,6 +284,7 @@ async def main():
     parser.add_argument('--max-price', type=str, help='最高价格')
     parser.add_argument('--debug', type=int, default=0, help='调试模式限制数量')
     parser.add_argument('--task-name', type=str, help='任务名称')
+    parser.add_argument('--detail-concurrency', type=int, help='同时抓取详情的页面数（默认读取 DETAIL_CONCURRENCY）')
 
     # 尝试解析参数
     try:
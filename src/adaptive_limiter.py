@@ -0,0 +1,295 @@
+"""
+自适应限速模块
+所有正在运行的任务（无论是独立进程还是进程内协程）共用一个令牌桶，状态保存在本地
+JSON 文件中，读写时加文件锁。请求速率按 "加性增、乘性减" 调整：
+- 遇到滑块/验证码/RGV587 等风控信号：速率减半，并暂停一段冷却时间（连续触发时加倍）
+- 请求成功：速率缓慢回升，直到上限
+同时按分钟记录请求数、错误数和风控次数，便于在吞吐量和封禁率之间调参。
+
+令牌桶状态很小，每次取令牌都要跨进程同步；按分钟统计先在进程内累计，每隔
+STATS_FLUSH_SECONDS 秒合并写入单独的统计文件（同时清理过期的分钟），
+取令牌时不会重写 24 小时的统计数据。读取统计不写文件。
+
+爬虫中的用法（同一进程内共用 get_shared_limiter() 返回的实例）:
+    limiter = get_shared_limiter()
+    await limiter.acquire()
+    ...                                # 发起请求
+    limiter.record_success()           # 或 record_risk('RGV587') / record_error()
+"""
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+if sys.platform == 'win32':
+    import msvcrt
+else:
+    import fcntl
+
+# 按分钟统计保留的时长（分钟）
+STATS_RETENTION_MINUTES = 24 * 60
+# 进程内累计的统计合并写入统计文件的间隔（秒）
+STATS_FLUSH_SECONDS = 30
+
+# 项目根目录：相对路径的状态文件以此为基准，不受启动时工作目录影响
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def default_state_file():
+    """共享状态文件路径：RATE_LIMIT_STATE_FILE（相对路径按项目根目录解析），默认 <项目>/logs/rate_limiter.json"""
+    path = os.getenv('RATE_LIMIT_STATE_FILE') or os.path.join('logs', 'rate_limiter.json')
+    return os.path.join(PROJECT_DIR, path)
+
+
+class _FileLock:
+    """跨进程文件锁（非阻塞尝试，获取失败时由调用方等待后重试）"""
+
+    def __init__(self, path):
+        self.path = path
+        self._handle = None
+
+    def try_acquire(self):
+        handle = open(self.path, 'a+')
+        try:
+            if sys.platform == 'win32':
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        self._handle = handle
+        return True
+
+    def release(self):
+        if self._handle is None:
+            return
+        try:
+            if sys.platform == 'win32':
+                self._handle.seek(0)
+                msvcrt.locking(self._handle.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(self._handle.fileno(), fcntl.LOCK_UN)
+        finally:
+            self._handle.close()
+            self._handle = None
+
+
+class AdaptiveRateLimiter:
+    """跨进程共享的自适应令牌桶"""
+
+    def __init__(self, state_file=None, max_rate=None, min_rate=0.05, increase_step=0.02,
+                 decrease_factor=0.5, cooldown_seconds=60, max_cooldown_seconds=900):
+        """
+        参数:
+        - state_file: 共享状态文件，默认见 default_state_file()；按分钟统计保存在同目录的 *_stats.json
+        - max_rate: 速率上限（次/秒），默认读取 DETAIL_RATE_PER_SECOND（0.5）
+        - min_rate: 速率下限
+        - increase_step: 每次成功后速率增加量
+        - decrease_factor: 触发风控后速率乘以该系数
+        - cooldown_seconds / max_cooldown_seconds: 触发风控后的暂停时长，连续触发时加倍直到上限
+        """
+        if max_rate is None:
+            max_rate = float(os.getenv('DETAIL_RATE_PER_SECOND', '0.5'))
+        self.state_file = state_file or default_state_file()
+        self.stats_file = os.path.splitext(self.state_file)[0] + '_stats.json'
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.cooldown_seconds = cooldown_seconds
+        self.max_cooldown_seconds = max_cooldown_seconds
+        self._lock = _FileLock(self.state_file + '.lock')
+        # 尚未写入统计文件的按分钟计数 {分钟: {计数项: 次数}}
+        self._pending = {}
+        # 保护 _pending：进程内多个任务的线程同时计数，get_stats 读取时不持有文件锁
+        self._pending_lock = threading.Lock()
+        self._flushed_at = time.time()
+
+    # ==================== 状态读写 ====================
+    def _default_state(self):
+        return {
+            'rate': self.max_rate,
+            'tokens': 1.0,
+            'updated': time.time(),
+            'cooldown_until': 0,
+            'consecutive_risk': 0,
+        }
+
+    @staticmethod
+    def _read_json(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _write_json(path, data):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _load(self):
+        state = self._read_json(self.state_file)
+        if state is None:
+            return self._default_state()
+        # 旧版本把按分钟统计和令牌桶存在同一个文件里，读到时移入待合并的统计
+        legacy = state.pop('minutes', None)
+        if legacy:
+            with self._pending_lock:
+                self._merge(self._pending, legacy)
+        # 上限调低后立即生效
+        state['rate'] = min(state.get('rate', self.max_rate), self.max_rate)
+        return state
+
+    def _locked(self, update):
+        """在文件锁内读取、修改并保存状态（阻塞重试，持锁时间极短），到间隔时顺带写入统计"""
+        os.makedirs(os.path.dirname(os.path.abspath(self.state_file)), exist_ok=True)
+        while not self._lock.try_acquire():
+            time.sleep(0.01)
+        try:
+            state = self._load()
+            result = update(state)
+            self._write_json(self.state_file, state)
+            if self._pending and time.time() - self._flushed_at >= STATS_FLUSH_SECONDS:
+                self._flush_locked()
+            return result
+        finally:
+            self._lock.release()
+
+    # ==================== 按分钟统计 ====================
+    @staticmethod
+    def _merge(minutes, extra):
+        for minute, counts in extra.items():
+            bucket = minutes.setdefault(minute, {'requests': 0, 'success': 0, 'errors': 0, 'risk': 0})
+            for key, value in counts.items():
+                bucket[key] = bucket.get(key, 0) + value
+        return minutes
+
+    def _count(self, state, key):
+        """在进程内累计一次计数，由 _locked / flush_stats 合并写入统计文件"""
+        minute = datetime.now().strftime('%Y-%m-%dT%H:%M')
+        with self._pending_lock:
+            self._merge(self._pending, {minute: {key: 1}})
+
+    def _pending_snapshot(self):
+        """进程内尚未写入的计数的副本"""
+        with self._pending_lock:
+            return {minute: dict(counts) for minute, counts in self._pending.items()}
+
+    def _flush_locked(self):
+        """把进程内累计的计数合并进统计文件并清理过期分钟（调用方持有文件锁）"""
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        try:
+            minutes = self._merge(self._read_json(self.stats_file) or {}, pending)
+            if len(minutes) > STATS_RETENTION_MINUTES:
+                for old in sorted(minutes)[:len(minutes) - STATS_RETENTION_MINUTES]:
+                    del minutes[old]
+            self._write_json(self.stats_file, minutes)
+        except Exception:
+            # 写入失败时放回，下次再合并
+            with self._pending_lock:
+                self._merge(self._pending, pending)
+            raise
+        self._flushed_at = time.time()
+
+    def flush_stats(self):
+        """立即写入进程内累计的统计（爬取结束时调用，避免丢失最后一段计数）"""
+        if not self._pending:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.state_file)), exist_ok=True)
+        while not self._lock.try_acquire():
+            time.sleep(0.01)
+        try:
+            self._flush_locked()
+        finally:
+            self._lock.release()
+
+    # ==================== 令牌 ====================
+    def _try_take(self, state):
+        """尝试取一个令牌，成功返回 0，否则返回需要等待的秒数"""
+        now = time.time()
+        if now < state['cooldown_until']:
+            return state['cooldown_until'] - now
+        rate = max(state['rate'], self.min_rate)
+        state['tokens'] = min(1.0, state['tokens'] + (now - state['updated']) * rate)
+        state['updated'] = now
+        if state['tokens'] >= 1:
+            state['tokens'] -= 1
+            self._count(state, 'requests')
+            return 0
+        return (1 - state['tokens']) / rate
+
+    async def acquire(self):
+        """等待直到允许发起下一个请求"""
+        while True:
+            wait = await asyncio.to_thread(self._locked, self._try_take)
+            if wait <= 0:
+                return
+            await asyncio.sleep(min(wait, 5))
+
+    # ==================== 反馈 ====================
+    def record_success(self):
+        def update(state):
+            state['consecutive_risk'] = 0
+            state['rate'] = min(self.max_rate, state['rate'] + self.increase_step)
+            self._count(state, 'success')
+        self._locked(update)
+
+    def record_error(self):
+        """普通错误（网络超时等）只计数，不调整速率"""
+        self._locked(lambda state: self._count(state, 'errors'))
+
+    def record_risk(self, reason=''):
+        """触发风控：降速并暂停"""
+        def update(state):
+            state['consecutive_risk'] += 1
+            state['rate'] = max(self.min_rate, state['rate'] * self.decrease_factor)
+            cooldown = min(self.cooldown_seconds * 2 ** (state['consecutive_risk'] - 1), self.max_cooldown_seconds)
+            state['cooldown_until'] = time.time() + cooldown
+            state['tokens'] = 0
+            self._count(state, 'risk')
+            return state['rate'], cooldown
+        rate, cooldown = self._locked(update)
+        print(f"[限速] 触发风控{f'（{reason}）' if reason else ''}，速率降至 {rate:.3f} 次/秒，暂停 {cooldown} 秒")
+
+    # ==================== 统计 ====================
+    def get_stats(self, minutes=60):
+        """
+        返回当前速率和最近 N 分钟的按分钟统计
+
+        只读文件，不加锁也不写入（状态文件通过 os.replace 原子替换，不会读到半个文件）；
+        其他进程尚未写入的最近计数最多延迟 STATS_FLUSH_SECONDS 秒。
+        """
+        state = self._read_json(self.state_file) or self._default_state()
+        state = {**self._default_state(), **state}
+        state['rate'] = min(state['rate'], self.max_rate)
+        per_minute = self._merge(self._read_json(self.stats_file) or {}, state.get('minutes') or {})
+        per_minute = self._merge(per_minute, self._pending_snapshot())
+        recent = sorted(per_minute.items())[-minutes:]
+        return {
+            'rate_per_second': round(state['rate'], 4),
+            'max_rate_per_second': self.max_rate,
+            'cooldown_remaining_seconds': max(int(state['cooldown_until'] - time.time()), 0),
+            'consecutive_risk': state['consecutive_risk'],
+            'per_minute': [{'minute': minute, **counts} for minute, counts in recent],
+        }
+
+
+# 进程内共用的限速器（首次使用时创建），进程内执行的多个任务和统计接口共享同一份进程内计数
+_shared_limiter = None
+
+
+def get_shared_limiter():
+    """返回进程内共用的 AdaptiveRateLimiter"""
+    global _shared_limiter
+    if _shared_limiter is None:
+        _shared_limiter = AdaptiveRateLimiter()
+    return _shared_limiter
@@ -0,0 +1,213 @@
+"""
+提醒规则引擎
+每个任务可以配置一组提醒规则（任务的 alert_rules 字段），爬虫每保存一条记录就立即判断，
+命中的商品在几秒内推送，而不是等整个任务结束或手动推送。
+规则之间为 "或"，同一条规则内的条件为 "与"；规则在任务开始时编译一次（正则只编译一次）。
+
+规则示例:
+    {
+        "name": "低价个人卖家",
+        "max_price": 12000,               # 价格上限 / min_price 价格下限
+        "min_registration_days": 365,     # 卖家注册天数下限
+        "title_include": "A7M4|a7m4",     # 标题须匹配的正则
+        "title_exclude": "坏|配件|求购",   # 标题不能匹配的正则
+        "personal_only": true             # 只要个人卖家
+    }
+
+爬虫通过 ResultWriter 保存记录时由记录回调自动提交（main.py 把 engine.submit 设为
+result_segments 的当前记录回调），也可以直接调用:
+    engine = get_current_alert_engine()
+    if engine:
+        engine.submit(record)          # 后台推送，不阻塞爬取
+"""
+import asyncio
+import contextvars
+import re
+
+from src.result_store import parse_price
+
+# 当前这次爬取使用的规则引擎（由 main.py 按任务的 alert_rules 设置）
+_current_engine = contextvars.ContextVar('alert_engine', default=None)
+
+RULE_FIELDS = {'name', 'min_price', 'max_price', 'min_registration_days', 'title_include', 'title_exclude',
+               'personal_only'}
+
+# 卖家注册时长文本（utils.format_registration_days 的输出，如 "3年2个月"、"125天"）中的单位
+_DURATION_UNITS = {'年': 365, '个月': 30, '月': 30, '天': 1}
+_DURATION_PATTERN = re.compile(r'(\d+(?:\.\d+)?)\s*(年|个月|月|天)')
+
+
+def get_current_alert_engine():
+    """返回当前爬取使用的规则引擎，任务没有配置规则时返回 None"""
+    return _current_engine.get()
+
+
+def set_current_alert_engine(engine):
+    _current_engine.set(engine)
+
+
+def registration_days(record):
+    """
+    卖家注册天数，无法确定时返回 None
+
+    优先使用数值字段，否则把 format_registration_days 生成的文本还原为天数。
+    """
+    seller_info = record.get('卖家信息') or {}
+    for key in ('卖家注册天数', '注册天数'):
+        if isinstance(seller_info.get(key), (int, float)):
+            return int(seller_info[key])
+    text = seller_info.get('卖家注册时长') or seller_info.get('注册时长')
+    if not text:
+        return None
+    matches = _DURATION_PATTERN.findall(str(text))
+    if not matches:
+        return None
+    return int(sum(float(value) * _DURATION_UNITS[unit] for value, unit in matches))
+
+
+def is_personal_seller(record):
+    """是否个人卖家（记录中没有相关字段时返回 None）"""
+    product_info = record.get('商品信息') or {}
+    seller_info = record.get('卖家信息') or {}
+    for value in (seller_info.get('卖家类型'), product_info.get('卖家类型')):
+        if value:
+            return '个人' in str(value)
+    for value in (seller_info.get('是否个人卖家'), product_info.get('是否个人闲置')):
+        if value is not None:
+            return bool(value)
+    return None
+
+
+class AlertRule:
+    """编译后的单条规则"""
+
+    def __init__(self, spec, index=0):
+        unknown = set(spec) - RULE_FIELDS
+        if unknown:
+            raise ValueError(f"规则包含未知字段: {', '.join(sorted(unknown))}")
+        self.name = spec.get('name') or f"规则{index + 1}"
+        self.min_price = self._number(spec, 'min_price')
+        self.max_price = self._number(spec, 'max_price')
+        self.min_registration_days = self._number(spec, 'min_registration_days')
+        self.include = self._regex(spec, 'title_include')
+        self.exclude = self._regex(spec, 'title_exclude')
+        self.personal_only = bool(spec.get('personal_only'))
+
+    def _number(self, spec, key):
+        value = spec.get(key)
+        if value in (None, ''):
+            return None
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{self.name}: {key} 必须是数字")
+
+    def _regex(self, spec, key):
+        pattern = spec.get(key)
+        if not pattern:
+            return None
+        try:
+            return re.compile(pattern, re.IGNORECASE)
+        except re.error as e:
+            raise ValueError(f"{self.name}: {key} 不是有效的正则表达式（{e}）")
+
+    def match(self, record):
+        product_info = record.get('商品信息') or {}
+        title = product_info.get('商品标题') or ''
+        if self.include and not self.include.search(title):
+            return False
+        if self.exclude and self.exclude.search(title):
+            return False
+
+        if self.min_price is not None or self.max_price is not None:
+            price = parse_price(product_info.get('当前售价'))
+            if price is None:
+                return False
+            if self.min_price is not None and price < self.min_price:
+                return False
+            if self.max_price is not None and price > self.max_price:
+                return False
+
+        if self.min_registration_days is not None:
+            days = registration_days(record)
+            if days is None or days < self.min_registration_days:
+                return False
+
+        if self.personal_only and not is_personal_seller(record):
+            return False
+        return True
+
+
+def compile_rules(specs):
+    """编译规则列表，规则无效时抛出 ValueError"""
+    if not isinstance(specs, list):
+        raise ValueError("alert_rules 必须是规则列表")
+    return [AlertRule(spec, i) for i, spec in enumerate(specs)]
+
+
+class AlertEngine:
+    """对爬取中产生的每条记录求值，命中后在后台推送"""
+
+    def __init__(self, rules, notify):
+        """
+        参数:
+        - rules: compile_rules 的结果
+        - notify: async notify(record, rule_names)，负责实际推送
+        """
+        self.rules = rules
+        self.notify = notify
+        # 创建引擎的事件循环：记录在其他线程中写入时，推送仍在该循环中执行
+        try:
+            self._loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._loop = None
+        self._alerted = set()
+        self._pending = set()
+        self.counters = {'evaluated': 0, 'matched': 0, 'sent': 0, 'failed': 0}
+
+    def evaluate(self, record):
+        """返回命中的规则名称列表"""
+        self.counters['evaluated'] += 1
+        return [rule.name for rule in self.rules if rule.match(record)]
+
+    def submit(self, record):
+        """求值并在命中时后台推送（同一商品本次运行只推送一次），返回命中的规则名称列表"""
+        matched = self.evaluate(record)
+        product_id = str((record.get('商品信息') or {}).get('商品ID') or '')
+        if not matched or product_id in self._alerted:
+            return matched
+        self._alerted.add(product_id)
+        self.counters['matched'] += 1
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is not None and (self._loop is None or running is self._loop):
+            self._start_send(record, matched)
+        else:
+            self._loop.call_soon_threadsafe(self._start_send, record, matched)
+        return matched
+
+    def _start_send(self, record, matched):
+        task = asyncio.get_running_loop().create_task(self._send(record, matched))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _send(self, record, matched):
+        try:
+            await self.notify(record, matched)
+            self.counters['sent'] += 1
+        except Exception as e:
+            self.counters['failed'] += 1
+            print(f"   [提醒] 推送商品 {(record.get('商品信息') or {}).get('商品ID')} 失败: {e}")
+
+    async def drain(self):
+        """等待所有已提交的推送完成（任务结束前调用）"""
+        # 让其他线程通过 call_soon_threadsafe 提交的推送先开始
+        await asyncio.sleep(0)
+        if self._pending:
+            await asyncio.gather(*list(self._pending), return_exceptions=True)
+
+    def summary(self):
+        c = self.counters
+        return f"提醒规则检查 {c['evaluated']} 个商品，命中 {c['matched']} 个（已加入推送队列 {c['sent']}，失败 {c['failed']}）"
@@ -0,0 +1,257 @@
+"""
+浏览器池模块
+保持 N 个常驻的 Chromium/Edge 实例，每个任务从池中借用一个独立的 BrowserContext
+（加载 STATE_FILE 登录状态），用完即关闭，避免每次运行都启动一个新浏览器。
+
+浏览器累计打开的页面数或内存占用超过阈值后会被标记为待回收：不再分配新的上下文，
+现有上下文全部归还后关闭并启动一个新的实例替换。
+"""
+import asyncio
+import contextvars
+import os
+import time
+from contextlib import asynccontextmanager
+
+from src.route_filter import get_current_route_filter
+
+try:
+    import psutil
+except ImportError:  # 内存统计为可选功能
+    psutil = None
+
+# 当前任务可用的共享浏览器池（进程内执行模式下由 Web 服务设置）
+_current_pool = contextvars.ContextVar('browser_pool', default=None)
+
+
+def get_current_pool():
+    """返回当前可用的共享浏览器池，没有时返回 None（此时爬虫应自行启动浏览器）"""
+    return _current_pool.get()
+
+
+def set_current_pool(pool):
+    _current_pool.set(pool)
+
+
+class _PooledBrowser:
+    """池中的一个浏览器实例及其统计信息"""
+
+    def __init__(self, browser_id, browser, pids):
+        self.browser_id = browser_id
+        self.browser = browser
+        self.pids = pids
+        self.launched_at = time.time()
+        self.active_contexts = 0
+        self.pages_opened = 0
+        self.retiring = False
+
+    def memory_mb(self):
+        """浏览器进程树的内存占用（需要 psutil），无法统计时返回 None"""
+        if psutil is None or not self.pids:
+            return None
+        total = 0
+        seen = set()
+        for pid in self.pids:
+            try:
+                root = psutil.Process(pid)
+                for proc in [root] + root.children(recursive=True):
+                    if proc.pid not in seen:
+                        seen.add(proc.pid)
+                        total += proc.memory_info().rss
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+        return round(total / 1024 / 1024, 1)
+
+
+class BrowserPool:
+    """共享浏览器池"""
+
+    def __init__(self, size=2, headless=True, use_edge=False, state_file=None,
+                 max_contexts_per_browser=4, recycle_after_pages=200, recycle_memory_mb=None):
+        """
+        参数:
+        - size: 常驻浏览器数量
+        - headless / use_edge: 与 RUN_HEADLESS / LOGIN_IS_EDGE 含义相同
+        - state_file: 登录状态文件，存在时每个上下文都会加载
+        - max_contexts_per_browser: 每个浏览器同时分配的上下文上限，满了之后借用方排队
+        - recycle_after_pages: 浏览器累计打开页面数达到该值后回收
+        - recycle_memory_mb: 浏览器进程树内存超过该值后回收（需要 psutil）
+        """
+        self.size = size
+        self.headless = headless
+        self.use_edge = use_edge
+        self.state_file = state_file
+        self.max_contexts_per_browser = max_contexts_per_browser
+        self.recycle_after_pages = recycle_after_pages
+        self.recycle_memory_mb = recycle_memory_mb
+
+        self._playwright = None
+        self._browsers = []
+        self._next_id = 1
+        self._condition = None
+        self._stats = {'acquired': 0, 'waited': 0, 'recycled': 0, 'launch_failures': 0}
+
+    # ==================== 生命周期 ====================
+    async def start(self):
+        from playwright.async_api import async_playwright
+
+        self._condition = asyncio.Condition()
+        self._playwright = await async_playwright().start()
+        for _ in range(self.size):
+            await self._add_browser()
+        print(f"[浏览器池] 已启动 {len(self._browsers)} 个浏览器")
+
+    async def stop(self):
+        for pooled in list(self._browsers):
+            await self._close_browser(pooled)
+        self._browsers = []
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+        print("[浏览器池] 已关闭")
+
+    def _child_pids(self):
+        if psutil is None:
+            return set()
+        try:
+            return {p.pid for p in psutil.Process().children(recursive=True)}
+        except psutil.Error:
+            return set()
+
+    async def _add_browser(self):
+        before = self._child_pids()
+        try:
+            launch_options = {'headless': self.headless}
+            if self.use_edge:
+                launch_options['channel'] = 'msedge'
+            browser = await self._playwright.chromium.launch(**launch_options)
+        except Exception as e:
+            self._stats['launch_failures'] += 1
+            print(f"[浏览器池] 启动浏览器失败: {e}")
+            return None
+
+        # 启动前后新增的子进程即为该浏览器的进程
+        pooled = _PooledBrowser(self._next_id, browser, self._child_pids() - before)
+        self._next_id += 1
+        self._browsers.append(pooled)
+        return pooled
+
+    async def _close_browser(self, pooled):
+        try:
+            await pooled.browser.close()
+        except Exception as e:
+            print(f"[浏览器池] 关闭浏览器 #{pooled.browser_id} 失败: {e}")
+
+    # ==================== 借用 / 归还 ====================
+    def _pick(self):
+        candidates = [
+            b for b in self._browsers
+            if not b.retiring and b.browser.is_connected() and b.active_contexts < self.max_contexts_per_browser
+        ]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda b: b.active_contexts)
+
+    async def _acquire(self):
+        async with self._condition:
+            waited = False
+            while True:
+                await self._heal()
+                pooled = self._pick()
+                if pooled is not None:
+                    break
+                if not self._browsers:
+                    raise RuntimeError("浏览器池中没有可用的浏览器")
+                if not waited:
+                    self._stats['waited'] += 1
+                    waited = True
+                await self._condition.wait()
+            pooled.active_contexts += 1
+            self._stats['acquired'] += 1
+            return pooled
+
+    async def _heal(self):
+        """替换已断开且空闲的浏览器，并补足启动失败的实例"""
+        for pooled in list(self._browsers):
+            if not pooled.browser.is_connected() and pooled.active_contexts == 0:
+                self._browsers.remove(pooled)
+        while len(self._browsers) < self.size:
+            if await self._add_browser() is None:
+                break
+
+    def _should_recycle(self, pooled):
+        if self.recycle_after_pages and pooled.pages_opened >= self.recycle_after_pages:
+            return True
+        if self.recycle_memory_mb:
+            memory = pooled.memory_mb()
+            if memory is not None and memory >= self.recycle_memory_mb:
+                return True
+        return False
+
+    async def _release(self, pooled):
+        async with self._condition:
+            pooled.active_contexts -= 1
+            if not pooled.retiring and self._should_recycle(pooled):
+                pooled.retiring = True
+                print(f"[浏览器池] 浏览器 #{pooled.browser_id} 已打开 {pooled.pages_opened} 个页面，等待回收")
+            if pooled.retiring and pooled.active_contexts == 0:
+                self._browsers.remove(pooled)
+                await self._close_browser(pooled)
+                self._stats['recycled'] += 1
+                await self._add_browser()
+            self._condition.notify_all()
+
+    @asynccontextmanager
+    async def context(self, **context_options):
+        """
+        借用一个独立的浏览器上下文，用法:
+
+            async with pool.context() as context:
+                page = await context.new_page()
+        """
+        pooled = await self._acquire()
+        context = None
+        try:
+            if self.state_file and os.path.exists(self.state_file):
+                context_options.setdefault('storage_state', self.state_file)
+            context = await pooled.browser.new_context(**context_options)
+            # 借用方所在任务启用了请求过滤时，在借出的上下文上安装
+            route_filter = get_current_route_filter()
+            if route_filter is not None:
+                await route_filter.install(context)
+
+            def on_page(_page):
+                pooled.pages_opened += 1
+            context.on('page', on_page)
+
+            yield context
+        finally:
+            if context is not None:
+                try:
+                    await context.close()
+                except Exception:
+                    pass
+            await self._release(pooled)
+
+    # ==================== 统计 ====================
+    def get_metrics(self):
+        capacity = len(self._browsers) * self.max_contexts_per_browser
+        active = sum(b.active_contexts for b in self._browsers)
+        return {
+            'size': self.size,
+            'capacity': capacity,
+            'active_contexts': active,
+            'utilization': round(active / capacity, 3) if capacity else 0,
+            'browsers': [
+                {
+                    'id': b.browser_id,
+                    'connected': b.browser.is_connected(),
+                    'active_contexts': b.active_contexts,
+                    'pages_opened': b.pages_opened,
+                    'uptime_seconds': int(time.time() - b.launched_at),
+                    'memory_mb': b.memory_mb(),
+                    'retiring': b.retiring,
+                }
+                for b in self._browsers
+            ],
+            **self._stats,
+        }
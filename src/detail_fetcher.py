@@ -0,0 +1,117 @@
+"""
+并发详情抓取模块
+在同一个浏览器上下文中打开 K 个页面并发抓取商品详情，所有页面共用一个限速器
+控制整体请求频率（避免触发风控），抓取结果按商品在搜索结果中的原始顺序依次交给
+on_result 写入 JSONL，输出顺序与串行抓取完全一致。
+
+爬虫中的用法:
+    async def fetch_one(page, item):
+        ...                            # 用 page 打开详情页并返回完整记录，失败返回 None
+
+    def save(item, record):
+        ...                            # 追加写入 JSONL
+
+    await fetch_details(context, items, fetch_one, save,
+                        concurrency=get_detail_concurrency())
+"""
+import asyncio
+import contextvars
+import os
+
+from src.adaptive_limiter import get_shared_limiter
+from src.mtop_client import RiskControlError
+
+# 当前这次爬取的详情并发数（由 main.py 按任务的 detail_concurrency 设置）
+_detail_concurrency = contextvars.ContextVar('detail_concurrency', default=None)
+
+
+def get_detail_concurrency():
+    """返回当前爬取的详情并发数，未设置时读取 DETAIL_CONCURRENCY（默认1=串行）"""
+    value = _detail_concurrency.get()
+    if value is None:
+        value = int(os.getenv('DETAIL_CONCURRENCY', '1'))
+    return max(int(value), 1)
+
+
+def set_detail_concurrency(value):
+    _detail_concurrency.set(value)
+
+
+class _OrderedEmitter:
+    """重排缓冲：结果可以乱序到达，按原始序号依次输出"""
+
+    def __init__(self, items, on_result):
+        self.items = items
+        self.on_result = on_result
+        self._pending = {}
+        self._next = 0
+
+    async def put(self, index, result):
+        self._pending[index] = result
+        while self._next in self._pending:
+            result = self._pending.pop(self._next)
+            if result is not None:
+                outcome = self.on_result(self.items[self._next], result)
+                if asyncio.iscoroutine(outcome):
+                    await outcome
+            self._next += 1
+
+
+async def fetch_details(context, items, fetch_one, on_result, concurrency=1, limiter=None):
+    """
+    并发抓取一组商品的详情
+
+    参数:
+    - context: 浏览器上下文，每个并发槽位在其中打开一个页面并重复使用
+    - items: 待抓取的商品（按搜索结果顺序）
+    - fetch_one: async fetch_one(page, item)，返回记录，None 表示跳过
+    - on_result: on_result(item, record)，按 items 顺序调用（可以是 async 函数）
+    - concurrency: 同时打开的页面数
+    - limiter: 共用的限速器，不指定时使用 get_shared_limiter() 返回的进程内共用实例（令牌桶跨进程共享）；
+      fetch_one 抛出 RiskControlError 时限速器会降速
+    返回成功抓取的数量
+    """
+    items = list(items)
+    if not items:
+        return 0
+    limiter = limiter or get_shared_limiter()
+    emitter = _OrderedEmitter(items, on_result)
+    queue = asyncio.Queue()
+    for index in range(len(items)):
+        queue.put_nowait(index)
+    succeeded = 0
+
+    async def worker():
+        nonlocal succeeded
+        page = await context.new_page()
+        try:
+            while True:
+                try:
+                    index = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                await limiter.acquire()
+                try:
+                    result = await fetch_one(page, items[index])
+                except RiskControlError as e:
+                    await asyncio.to_thread(limiter.record_risk, ','.join(e.ret))
+                    print(f"   [详情抓取] 第 {index + 1} 个商品触发风控: {e}")
+                    result = None
+                except Exception as e:
+                    await asyncio.to_thread(limiter.record_error)
+                    print(f"   [详情抓取] 第 {index + 1} 个商品抓取失败: {e}")
+                    result = None
+                else:
+                    await asyncio.to_thread(limiter.record_success)
+                if result is not None:
+                    succeeded += 1
+                await emitter.put(index, result)
+        finally:
+            await page.close()
+
+    workers = min(max(int(concurrency), 1), len(items))
+    try:
+        await asyncio.gather(*[worker() for _ in range(workers)])
+    finally:
+        await asyncio.to_thread(limiter.flush_stats)
+    return succeeded
@@ -0,0 +1,137 @@
+"""
+详情抓取判定模块
+根据搜索接口（API_URL_PATTERN）返回的列表数据为每个商品计算指纹
+（价格、标题、图片数、想要人数），只有以下情况才打开详情页（DETAIL_API_URL_PATTERN）：
+- 从未抓取过详情的新商品
+- 指纹发生变化（改价、改标题、换图、想要人数变化）
+- 距离上次抓取详情超过 TTL（DETAIL_REFETCH_TTL_HOURS，默认72小时，0=不按时间重新抓取）
+
+已见商品库中有记录但没有指纹的商品（seed 从结果文件导入、升级前抓取的）详情已在结果中，
+视为已抓取：本次跳过并记下当前指纹，以后按指纹正常判断。
+
+爬虫中的用法:
+    gate = get_current_gate()
+    fingerprint = fingerprint_from_search_item(item)
+    if gate and not gate.should_fetch(item_id, fingerprint):
+        continue                       # 列表数据未变化，跳过详情页
+    ...                                # 抓取详情并保存
+    if gate:
+        gate.record_fetched(item_id, fingerprint, price=price, keyword=keyword)
+"""
+import contextvars
+import hashlib
+import os
+import time
+
+# 当前这次爬取使用的判定器（由 main.py 在开始爬取前设置）
+_current_gate = contextvars.ContextVar('detail_gate', default=None)
+
+
+def get_current_gate():
+    """返回当前爬取使用的详情抓取判定器，没有时返回 None（此时每个商品都抓取详情）"""
+    return _current_gate.get()
+
+
+def set_current_gate(gate):
+    _current_gate.set(gate)
+
+
+def make_fingerprint(price, title, image_count, want_count):
+    """由列表数据中的关键字段计算指纹"""
+    text = '\x1f'.join(str(v if v is not None else '') for v in (price, title, image_count, want_count))
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=8).hexdigest()
+
+
+def _price_text(price):
+    """搜索接口的价格可能是字符串，也可能是 [{'text': '¥'}, {'text': '4500'}] 形式的片段列表"""
+    if isinstance(price, list):
+        return ''.join(str(part.get('text', '')) if isinstance(part, dict) else str(part) for part in price)
+    return price
+
+
+def _search_item_main(item):
+    main = ((item.get('data') or {}).get('item') or {}).get('main') or {}
+    content = main.get('exContent') or {}
+    args = (main.get('clickParam') or {}).get('args') or {}
+    detail = content.get('detailParams') or {}
+    return content, args, detail
+
+
+def search_item_price(item):
+    """搜索接口 resultList 中一项的价格文本（用于记录价格历史）"""
+    content, args, detail = _search_item_main(item)
+    return _price_text(content.get('price')) or args.get('price') or detail.get('soldPrice')
+
+
+def fingerprint_from_search_item(item):
+    """
+    从搜索接口 resultList 中的一项计算指纹
+
+    字段缺失时按空值处理，只要同一商品两次返回的字段一致，指纹就保持不变。
+    """
+    content, args, detail = _search_item_main(item)
+    price = search_item_price(item)
+    title = content.get('title') or detail.get('title')
+    images = content.get('picUrls') or content.get('imageUrls') or detail.get('picUrls')
+    image_count = len(images) if isinstance(images, list) else content.get('picCount')
+    want_count = args.get('wantNum') or content.get('wantNum') or detail.get('wantNum')
+    return make_fingerprint(price, title, image_count, want_count)
+
+
+class DetailFetchGate:
+    """基于已见商品库判断是否需要抓取详情，并统计跳过/抓取数量"""
+
+    def __init__(self, seen_store, ttl_hours=None):
+        """
+        参数:
+        - seen_store: SeenStore 实例
+        - ttl_hours: 详情数据的有效期（小时），默认读取 DETAIL_REFETCH_TTL_HOURS，0 表示不过期
+        """
+        if ttl_hours is None:
+            ttl_hours = float(os.getenv('DETAIL_REFETCH_TTL_HOURS', '72'))
+        self.store = seen_store
+        self.ttl_seconds = ttl_hours * 3600
+        self.counters = {'fetched_new': 0, 'fetched_changed': 0, 'fetched_expired': 0, 'skipped': 0, 'adopted': 0}
+
+    def check(self, product_id, fingerprint):
+        """返回 (是否抓取详情, 原因)，原因为 new / changed / expired / unchanged / adopted（已见但没有指纹）"""
+        if not self.store.is_seen(product_id):
+            return True, 'new'
+        record = self.store.get(product_id)
+        if record is None:
+            return True, 'new'
+        if record['detail_fetched_at'] is None:
+            return False, 'adopted'
+        if record['fingerprint'] != fingerprint:
+            return True, 'changed'
+        if self.ttl_seconds and time.time() - record['detail_fetched_at'] >= self.ttl_seconds:
+            return True, 'expired'
+        return False, 'unchanged'
+
+    def should_fetch(self, product_id, fingerprint):
+        """判断是否需要抓取详情并计数；跳过的商品同时刷新最近发现时间"""
+        fetch, reason = self.check(product_id, fingerprint)
+        if fetch:
+            self.counters[f'fetched_{reason}'] += 1
+        elif reason == 'adopted':
+            self.counters['skipped'] += 1
+            self.counters['adopted'] += 1
+            self.store.adopt_fingerprint(product_id, fingerprint)
+        else:
+            self.counters['skipped'] += 1
+            self.store.mark_seen(product_id)
+        return fetch
+
+    def record_fetched(self, product_id, fingerprint, price=None, keyword=None):
+        """详情抓取成功后记录指纹"""
+        self.store.record_detail(product_id, fingerprint, price=price, keyword=keyword)
+
+    @property
+    def fetched(self):
+        return self.counters['fetched_new'] + self.counters['fetched_changed'] + self.counters['fetched_expired']
+
+    def summary(self):
+        c = self.counters
+        return (f"详情抓取 {self.fetched} 个（新商品 {c['fetched_new']}，列表数据变化 {c['fetched_changed']}，"
+                f"超过有效期 {c['fetched_expired']}），未变化跳过 {c['skipped']} 个"
+                + (f"（其中首次记录指纹 {c['adopted']} 个）" if c['adopted'] else ''))
@@ -0,0 +1,160 @@
+"""
+实时事件推送模块
+由一个后台轮询协程统一监视任务状态和日志文件，把新增日志行和状态变化
+广播给所有订阅者；打开多少个页面都只有一个监视器在读文件。
+"""
+import asyncio
+import os
+
+
+class LiveEventHub:
+    """任务状态 / 日志的事件广播中心"""
+
+    def __init__(self, load_tasks, log_dir, log_reader, interval=1.0, queue_size=500):
+        """
+        参数:
+        - load_tasks: 返回任务列表的函数
+        - log_dir: 日志目录
+        - log_reader: LogReader 实例（复用编码缓存）
+        - interval: 轮询间隔（秒）
+        """
+        self.load_tasks = load_tasks
+        self.log_dir = log_dir
+        self.log_reader = log_reader
+        self.interval = interval
+        self.queue_size = queue_size
+        self._subscribers = set()
+        self._watcher = None
+        self._statuses = {}
+        self._log_offsets = {}
+
+    # ==================== 订阅 ====================
+    def subscribe(self):
+        """新增一个订阅者，返回其事件队列；首个事件为当前任务快照"""
+        if self._watcher is None or self._watcher.done():
+            # 已有日志从当前大小开始监视，历史内容由客户端按快照中的偏移自行拉取
+            tasks = self.load_tasks()
+            self._statuses = {t['id']: self._task_state(t) for t in tasks}
+            self._log_offsets = {
+                t['log_file']: self._log_size(t['log_file']) for t in tasks if t.get('log_file')
+            }
+            self._watcher = asyncio.create_task(self._watch())
+
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        queue.put_nowait({'type': 'snapshot', 'tasks': self._snapshot()})
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self._subscribers.discard(queue)
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    def publish(self, event):
+        """向所有订阅者广播事件；跟不上的订阅者会收到 resync 事件，需要重新拉取"""
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait({'type': 'resync'})
+
+    # ==================== 监视 ====================
+    def _snapshot(self):
+        snapshot = []
+        for task in self.load_tasks():
+            log_file = task.get('log_file')
+            snapshot.append({
+                'task_id': task['id'],
+                'status': task.get('status'),
+                'log_file': log_file,
+                # 与监视器的进度保持一致，之后推送的日志正好从这里接上
+                'next_offset': self._log_offsets.get(log_file, self._log_size(log_file)),
+            })
+        return snapshot
+
+    def _log_size(self, log_file):
+        if not log_file:
+            return 0
+        try:
+            return os.path.getsize(os.path.join(self.log_dir, log_file))
+        except OSError:
+            return 0
+
+    @staticmethod
+    def _task_state(task):
+        return (task.get('status'), task.get('log_file'), task.get('pid'))
+
+    def _poll(self, statuses, log_offsets):
+        """
+        执行一次轮询（在线程中运行，不修改共享状态）
+
+        返回 (事件列表, 新的状态表, 新的日志偏移表)
+        """
+        events = []
+        tasks = self.load_tasks()
+
+        current = {}
+        for task in tasks:
+            state = self._task_state(task)
+            current[task['id']] = state
+            previous = statuses.get(task['id'])
+            if previous is not None and previous != state:
+                events.append({
+                    'type': 'status',
+                    'task_id': task['id'],
+                    'status': state[0],
+                    'previous_status': previous[0],
+                    'log_file': state[1],
+                    'pid': state[2],
+                })
+        for task_id in set(statuses) - set(current):
+            events.append({'type': 'status', 'task_id': task_id, 'status': 'deleted'})
+
+        offsets = {}
+        for task in tasks:
+            log_file = task.get('log_file')
+            if not log_file:
+                continue
+            path = os.path.join(self.log_dir, log_file)
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                continue
+
+            # 监视开始后才出现的日志（新一次运行）从头推送
+            offset = log_offsets.get(log_file, 0)
+            if size == offset:
+                offsets[log_file] = offset
+                continue
+
+            result = self.log_reader.read_since(path, offset)
+            offsets[log_file] = result['next_offset']
+            if result['content']:
+                events.append({
+                    'type': 'log',
+                    'task_id': task['id'],
+                    'log_file': log_file,
+                    'content': result['content'],
+                    'next_offset': result['next_offset'],
+                    'reset': result['reset'],
+                })
+
+        return events, current, offsets
+
+    async def _watch(self):
+        await asyncio.sleep(self.interval)
+        while self._subscribers:
+            try:
+                events, self._statuses, self._log_offsets = await asyncio.to_thread(
+                    self._poll, dict(self._statuses), dict(self._log_offsets)
+                )
+                for event in events:
+                    self.publish(event)
+            except Exception as e:
+                print(f"[实时推送] 轮询失败: {e}")
+            await asyncio.sleep(self.interval)
+        self._watcher = None
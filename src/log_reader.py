@@ -0,0 +1,125 @@
+"""
+任务日志读取模块
+按字节偏移增量读取日志、从文件末尾读取最后 N 行，编码只在首次读取时检测一次
+"""
+import codecs
+import os
+import threading
+
+# 按顺序尝试的日志编码（Windows 下子进程输出可能是 GBK）
+LOG_ENCODINGS = ['utf-8', 'gbk', 'gb2312', 'latin-1']
+
+# 编码检测时读取的样本大小
+_SAMPLE_SIZE = 64 * 1024
+_MAX_CACHED_FILES = 256
+
+
+class LogReader:
+    """带编码缓存的日志读取器"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._encodings = {}
+
+    def detect_encoding(self, path):
+        """检测日志文件编码，结果按文件路径缓存"""
+        with self._lock:
+            encoding = self._encodings.get(path)
+        if encoding:
+            return encoding
+
+        with open(path, 'rb') as f:
+            sample = f.read(_SAMPLE_SIZE)
+
+        encoding = LOG_ENCODINGS[-1]
+        for candidate in LOG_ENCODINGS:
+            try:
+                # 增量解码器允许样本末尾是被截断的多字节字符
+                codecs.getincrementaldecoder(candidate)().decode(sample, final=False)
+                encoding = candidate
+                break
+            except UnicodeDecodeError:
+                continue
+
+        # 文件内容太少时先不缓存，避免把空文件误判的结果固定下来
+        if sample:
+            with self._lock:
+                if len(self._encodings) >= _MAX_CACHED_FILES:
+                    self._encodings.pop(next(iter(self._encodings)))
+                self._encodings[path] = encoding
+        return encoding
+
+    def read_since(self, path, offset=0, max_bytes=1024 * 1024):
+        """
+        读取 offset 之后新增的内容
+
+        返回字典:
+        - content: 新增文本（最多 max_bytes 字节）
+        - next_offset: 下次请求使用的偏移（不会落在多字节字符中间）
+        - size: 当前文件大小
+        - reset: 日志被截断/重写时为 True，此时从头读取
+        """
+        size = os.path.getsize(path)
+        reset = False
+        if offset < 0 or offset > size:
+            offset = 0
+            reset = True
+
+        encoding = self.detect_encoding(path)
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = f.read(min(size - offset, max_bytes))
+
+        decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+        content = decoder.decode(data, final=False)
+        pending = decoder.getstate()[0]
+
+        return {
+            'content': content,
+            'next_offset': offset + len(data) - len(pending),
+            'size': size,
+            'reset': reset,
+            'encoding': encoding,
+        }
+
+    def read_tail(self, path, lines=200):
+        """从文件末尾向前读取最后 lines 行"""
+        size = os.path.getsize(path)
+        encoding = self.detect_encoding(path)
+
+        position = size
+        data = b''
+        with open(path, 'rb') as f:
+            # 多读一个换行符才能确定第一行的起点
+            while position > 0 and data.count(b'\n') <= lines:
+                chunk = min(64 * 1024, position)
+                position -= chunk
+                f.seek(position)
+                data = f.read(chunk) + data
+
+        body = data[:-1] if data.endswith(b'\n') else data
+        parts = body.split(b'\n')
+        if position > 0 or len(parts) > lines:
+            parts = parts[-lines:] if lines else []
+        text = b'\n'.join(parts) + (b'\n' if data.endswith(b'\n') and parts else b'')
+
+        return {
+            'content': text.decode(encoding, errors='replace'),
+            'next_offset': size,
+            'size': size,
+            'reset': False,
+            'encoding': encoding,
+        }
+
+    def read_all(self, path):
+        """读取整个日志文件（只解码一次）"""
+        encoding = self.detect_encoding(path)
+        with open(path, 'rb') as f:
+            data = f.read()
+        return {
+            'content': data.decode(encoding, errors='replace'),
+            'next_offset': len(data),
+            'size': len(data),
+            'reset': False,
+            'encoding': encoding,
+        }
@@ -0,0 +1,225 @@
+"""
+mtop 接口直连客户端
+登录 Cookie 有效时，不启动浏览器，直接用 HTTP 请求调用闲鱼的搜索和详情接口
+（与页面中被 API_URL_PATTERN / DETAIL_API_URL_PATTERN 拦截的是同一组接口），
+每页只需一次 HTTP 请求，CPU 和内存开销远低于驱动完整浏览器。
+
+签名规则与网页端一致: sign = md5(token & t & appKey & data)，token 取自 _m_h5_tk Cookie。
+令牌过期时服务端会下发新的 _m_h5_tk，客户端自动更新后重试一次；
+遇到滑块验证/RGV587 等风控响应时抛出 RiskControlError，由调用方回退到浏览器抓取。
+
+通过 SCRAPER_ENGINE=http 启用（默认 browser），爬虫中的用法:
+    client = MtopClient.from_login_state(STATE_FILE)
+    data = await with_browser_fallback(
+        lambda: client.search(keyword, page_number),
+        lambda: scrape_search_page_with_browser(...),
+    )
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+from http.cookies import SimpleCookie
+
+import requests
+from requests.adapters import HTTPAdapter
+
+MTOP_BASE_URL = os.getenv('MTOP_BASE_URL', 'https://h5api.m.goofish.com/h5')
+MTOP_APP_KEY = '34839810'
+SEARCH_API = 'mtop.taobao.idlemtopsearch.pc.search'
+DETAIL_API = 'mtop.taobao.idle.pc.detail'
+
+# 返回码中出现这些标记时视为触发风控，需要回退到浏览器（可能需要人工过滑块）
+RISK_CONTROL_MARKERS = ('RGV587', 'FAIL_SYS_USER_VALIDATE', 'FAIL_SYS_ILLEGAL_ACCESS', '哎哟喂,被挤爆啦')
+# 令牌为空/过期，服务端会通过 Set-Cookie 下发新令牌
+TOKEN_EXPIRED_MARKERS = ('FAIL_SYS_TOKEN_EXOIRED', 'FAIL_SYS_TOKEN_EXPIRED', 'FAIL_SYS_TOKEN_EMPTY')
+
+
+def get_scraper_engine():
+    """返回爬虫引擎: browser（默认）或 http"""
+    engine = os.getenv('SCRAPER_ENGINE', 'browser').strip().lower()
+    return engine if engine in ('browser', 'http') else 'browser'
+
+
+class MtopError(Exception):
+    """mtop 接口调用失败"""
+
+    def __init__(self, message, ret=None):
+        super().__init__(message)
+        self.ret = ret or []
+
+
+class RiskControlError(MtopError):
+    """触发风控（滑块验证/RGV587），应回退到浏览器抓取"""
+
+
+def sign_request(token, timestamp, app_key, data):
+    """计算 mtop 请求签名"""
+    text = f"{token}&{timestamp}&{app_key}&{data}"
+    return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+
+def parse_cookie_header(cookie_header):
+    """解析 'a=1; b=2' 形式的 Cookie 字符串（XIANYU_COOKIE）"""
+    cookie = SimpleCookie()
+    cookie.load(cookie_header or '')
+    return {key: morsel.value for key, morsel in cookie.items()}
+
+
+def load_login_cookies(state_file=None, cookie_header=None):
+    """从 Playwright 登录状态文件或 Cookie 字符串中读取闲鱼/淘宝域名下的 Cookie"""
+    cookies = {}
+    if state_file and os.path.exists(state_file):
+        with open(state_file, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        for item in state.get('cookies', []):
+            domain = item.get('domain', '')
+            if 'goofish' in domain or 'taobao' in domain:
+                cookies[item['name']] = item['value']
+    cookies.update(parse_cookie_header(cookie_header))
+    return cookies
+
+
+class MtopClient:
+    """mtop 接口客户端（连接池复用 TCP/TLS 连接，阻塞请求在线程池中执行）"""
+
+    def __init__(self, cookies, base_url=None, app_key=MTOP_APP_KEY, pool_size=10, timeout=15, limiter=None):
+        """limiter: 可选的 AdaptiveRateLimiter，请求前取令牌，并按结果反馈成功/风控"""
+        self.limiter = limiter
+        self.base_url = (base_url or MTOP_BASE_URL).rstrip('/')
+        self.app_key = app_key
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            'User-Agent': ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+                           '(KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36'),
+            'Referer': 'https://www.goofish.com/',
+            'Origin': 'https://www.goofish.com',
+        })
+        self.session.cookies.update(cookies)
+        self.stats = {'requests': 0, 'token_refreshes': 0, 'risk_control': 0, 'errors': 0}
+
+    @classmethod
+    def from_login_state(cls, state_file=None, cookie_header=None, **kwargs):
+        if cookie_header is None:
+            cookie_header = os.getenv('XIANYU_COOKIE', '')
+        return cls(load_login_cookies(state_file, cookie_header), **kwargs)
+
+    @property
+    def token(self):
+        for cookie in self.session.cookies:
+            if cookie.name == '_m_h5_tk':
+                return cookie.value.split('_')[0]
+        return ''
+
+    def _replace_cookie(self, name, value):
+        """替换同名 Cookie（服务端下发的新令牌带域名，不能与登录时导入的旧令牌并存）"""
+        for cookie in [c for c in self.session.cookies if c.name == name]:
+            self.session.cookies.clear(cookie.domain, cookie.path, cookie.name)
+        self.session.cookies.set(name, value)
+
+    def close(self):
+        self.session.close()
+
+    # ==================== 请求 ====================
+    def _request(self, api, data, version):
+        data_text = json.dumps(data, separators=(',', ':'), ensure_ascii=False)
+        timestamp = str(int(time.time() * 1000))
+        params = {
+            'jsv': '2.7.2',
+            'appKey': self.app_key,
+            't': timestamp,
+            'sign': sign_request(self.token, timestamp, self.app_key, data_text),
+            'v': version,
+            'type': 'originaljson',
+            'accountSite': 'xianyu',
+            'dataType': 'json',
+            'timeout': '20000',
+            'api': api,
+            'sessionOption': 'AutoLoginOnly',
+        }
+        self.stats['requests'] += 1
+        response = self.session.post(
+            f"{self.base_url}/{api}/{version}/", params=params, data={'data': data_text}, timeout=self.timeout
+        )
+        response.raise_for_status()
+        for name in ('_m_h5_tk', '_m_h5_tk_enc'):
+            if name in response.cookies:
+                self._replace_cookie(name, response.cookies[name])
+        return response.json()
+
+    def call_sync(self, api, data, version='1.0'):
+        """调用接口并返回 data 部分；令牌过期时自动重试一次"""
+        try:
+            body = self._request(api, data, version)
+            ret = body.get('ret') or []
+            if any(marker in r for r in ret for marker in TOKEN_EXPIRED_MARKERS):
+                # 响应的 Set-Cookie 已更新 _m_h5_tk，使用新令牌重新签名
+                self.stats['token_refreshes'] += 1
+                body = self._request(api, data, version)
+                ret = body.get('ret') or []
+        except (requests.RequestException, ValueError) as e:
+            self.stats['errors'] += 1
+            raise MtopError(f"请求 {api} 失败: {e}") from e
+
+        if any(marker in r for r in ret for marker in RISK_CONTROL_MARKERS):
+            self.stats['risk_control'] += 1
+            raise RiskControlError(f"{api} 触发风控: {ret}", ret)
+        if not any(r.startswith('SUCCESS') for r in ret):
+            self.stats['errors'] += 1
+            raise MtopError(f"{api} 返回失败: {ret}", ret)
+        return body.get('data') or {}
+
+    async def call(self, api, data, version='1.0'):
+        if self.limiter is None:
+            return await asyncio.to_thread(self.call_sync, api, data, version)
+
+        await self.limiter.acquire()
+        try:
+            result = await asyncio.to_thread(self.call_sync, api, data, version)
+        except RiskControlError as e:
+            await asyncio.to_thread(self.limiter.record_risk, ','.join(e.ret))
+            raise
+        except MtopError:
+            await asyncio.to_thread(self.limiter.record_error)
+            raise
+        await asyncio.to_thread(self.limiter.record_success)
+        return result
+
+    # ==================== 业务接口 ====================
+    async def search(self, keyword, page_number=1, rows_per_page=30, extra=None):
+        """搜索商品，返回与浏览器拦截到的搜索响应相同结构的 data（包含 resultList）"""
+        data = {
+            'pageNumber': page_number,
+            'keyword': keyword,
+            'fromFilter': False,
+            'rowsPerPage': rows_per_page,
+            'sortValue': '',
+            'sortField': '',
+            'customDistance': '',
+            'gps': '',
+            'propValueStr': {},
+            'customGps': '',
+            'searchReqFromPage': 'pcSearch',
+            'extraFilterValue': '{}',
+            'userPositionJson': '{}',
+        }
+        data.update(extra or {})
+        return await self.call(SEARCH_API, data)
+
+    async def detail(self, item_id):
+        """获取商品详情，返回与详情页拦截到的响应相同结构的 data"""
+        return await self.call(DETAIL_API, {'itemId': str(item_id)})
+
+
+async def with_browser_fallback(http_call, browser_call):
+    """先走 HTTP 直连，失败或触发风控时回退到浏览器抓取"""
+    try:
+        return await http_call()
+    except MtopError as e:
+        print(f"   [直连] {e}，回退到浏览器")
+    return await browser_call()
@@ -0,0 +1,119 @@
+"""
+mtop 接口本地模拟服务
+用录制的接口响应模拟 h5api.m.goofish.com，校验请求签名，供测试 MtopClient 使用，
+无需登录和访问真实服务器。
+
+录制目录中每个接口一个文件 <api>.json，内容为完整响应体
+（可以是列表，按调用顺序依次返回，最后一个重复使用）。
+
+命令行用法:
+    python -m src.mtop_stub --dir recorded/ --port 8765
+    MTOP_BASE_URL=http://127.0.0.1:8765/h5 SCRAPER_ENGINE=http python main.py ...
+"""
+import argparse
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from src.mtop_client import MTOP_APP_KEY, sign_request
+
+STUB_TOKEN = 'stubtoken'
+
+
+class MtopStubServer:
+    """录制响应回放服务（在后台线程中运行）"""
+
+    def __init__(self, responses=None, record_dir=None, host='127.0.0.1', port=0):
+        """
+        参数:
+        - responses: {api: 响应体 或 响应体列表}
+        - record_dir: 录制目录，目录中的 <api>.json 会被加载
+        - port: 0 表示自动分配端口
+        """
+        self.responses = dict(responses or {})
+        if record_dir:
+            for filename in os.listdir(record_dir):
+                if filename.endswith('.json'):
+                    with open(os.path.join(record_dir, filename), 'r', encoding='utf-8') as f:
+                        self.responses[filename[:-5]] = json.load(f)
+        self.calls = []
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/h5"
+
+    def _next_response(self, api):
+        recorded = self.responses.get(api)
+        if isinstance(recorded, list):
+            return recorded.pop(0) if len(recorded) > 1 else recorded[0]
+        return recorded
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                url = urlparse(self.path)
+                params = {k: v[0] for k, v in parse_qs(url.query).items()}
+                length = int(self.headers.get('Content-Length') or 0)
+                form = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode('utf-8')).items()}
+                api = params.get('api', '')
+                data = form.get('data', '')
+                stub.calls.append({'api': api, 'data': data})
+
+                cookies = dict(
+                    part.strip().split('=', 1) for part in (self.headers.get('Cookie') or '').split(';') if '=' in part
+                )
+                token = cookies.get('_m_h5_tk', '').split('_')[0]
+                headers = {}
+                if token != STUB_TOKEN:
+                    # 与真实接口一致：令牌无效时下发新令牌
+                    body = {'api': api, 'ret': ['FAIL_SYS_TOKEN_EXOIRED::令牌过期'], 'data': {}}
+                    headers['Set-Cookie'] = f"_m_h5_tk={STUB_TOKEN}_0; Path=/"
+                elif params.get('sign') != sign_request(token, params.get('t'), MTOP_APP_KEY, data):
+                    body = {'api': api, 'ret': ['FAIL_SYS_ILLEGAL_SIGN::非法签名'], 'data': {}}
+                else:
+                    body = stub._next_response(api) or {'api': api, 'ret': ['FAIL_SYS_API_NOT_FOUNDED::未录制'], 'data': {}}
+
+                payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json;charset=UTF-8')
+                self.send_header('Content-Length', str(len(payload)))
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='mtop 接口模拟服务')
+    parser.add_argument('--dir', type=str, required=True, help='录制响应目录（<api>.json）')
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    stub = MtopStubServer(record_dir=args.dir, port=args.port)
+    print(f"模拟服务已启动: {stub.base_url}")
+    stub._server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,316 @@
+"""
+通知分发模块
+替代逐个商品、逐个渠道串行调用 send_notification 的方式:
+- 所有渠道共用一个带连接池的 HTTP 会话（复用 TCP/TLS 连接）
+- 每个渠道有独立的限速器（如企业微信机器人每分钟 20 条），超出时排队等待而不是被服务端拒绝
+- 各渠道并发发送，互不阻塞
+- 支持的渠道把多个商品合并成一条消息（企业微信图文卡片、钉钉/飞书/Telegram markdown 等）
+
+用法:
+    dispatcher = NotificationDispatcher()
+    result = await dispatcher.send(records, "批量推送商品", get_notification_config())
+    dispatcher.close()
+
+各渠道每分钟消息数上限可以用 NOTIFY_RATE_LIMITS 覆盖（如 "wx=20,feishu=50"）。
+"""
+import asyncio
+import html
+import json
+import os
+import threading
+import time
+from collections import deque
+from urllib.parse import quote
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# 渠道 -> 每分钟消息数上限（按各平台机器人的官方限制取值）
+DEFAULT_RATE_LIMITS = {
+    'wx': 20,
+    'dingtalk': 20,
+    'feishu': 100,
+    'telegram': 20,
+    'ntfy': 60,
+    'gotify': 60,
+    'bark': 60,
+    'webhook': 60,
+}
+
+# 渠道 -> 一条消息最多合并的商品数（企业微信图文消息最多 8 条）
+MAX_BATCH = {
+    'wx': 8,
+    'dingtalk': 10,
+    'feishu': 10,
+    'telegram': 10,
+    'ntfy': 5,
+    'gotify': 10,
+    'bark': 5,
+    'webhook': 20,
+}
+
+
+def rate_limits_from_env():
+    """读取 NOTIFY_RATE_LIMITS（"渠道=每分钟条数,..."），与默认值合并"""
+    limits = dict(DEFAULT_RATE_LIMITS)
+    for part in os.getenv('NOTIFY_RATE_LIMITS', '').split(','):
+        if '=' not in part:
+            continue
+        name, value = part.split('=', 1)
+        try:
+            limits[name.strip()] = max(1, int(value))
+        except ValueError:
+            print(f"[通知] 忽略无效的限速配置: {part}")
+    return limits
+
+
+def mobile_link(url):
+    """把 PC 端商品链接转换为手机端可直接打开的分享链接"""
+    if not url or 'id=' not in url:
+        return url
+    item_id = url.split('id=', 1)[1].split('&', 1)[0]
+    bfp = quote(json.dumps({'id': item_id}, separators=(',', ':')))
+    return (f"https://pages.goofish.com/sharexy?loadingVisible=false&bft=item&bfs=idlepc.item"
+            f"&spm=a21ybx.item.0.0&bfp={bfp}")
+
+
+def flatten_product(record):
+    """把结果记录（或已扁平化、字段不全的商品数据）转换为通知使用的扁平化商品数据"""
+    product_info = (record.get('商品信息') or {}) if '商品信息' in record else record
+    seller_info = record.get('卖家信息') or {}
+    return {
+        '商品标题': product_info.get('商品标题', '未知商品'),
+        '当前售价': product_info.get('当前售价', 'N/A'),
+        '商品链接': product_info.get('商品链接', '#'),
+        '商品主图链接': product_info.get('商品主图链接', ''),
+        '商品图片列表': product_info.get('商品图片列表', []),
+        '商品ID': product_info.get('商品ID', ''),
+        '卖家昵称': product_info.get('卖家昵称', seller_info.get('卖家昵称', '未知')),
+    }
+
+
+def _short_title(product, limit=50):
+    title = str(product['商品标题'])
+    return title[:limit] + '...' if len(title) > limit else title
+
+
+def _image(product):
+    images = product.get('商品图片列表') or []
+    return product.get('商品主图链接') or (images[0] if images else '')
+
+
+class ChannelLimiter:
+    """单个渠道的限速器：任意 60 秒内最多发送 per_minute 条（按发送时间滑动窗口计数）"""
+
+    def __init__(self, per_minute, window=60.0):
+        self.per_minute = per_minute
+        self.window = window
+        self._sent = deque()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                while self._sent and now - self._sent[0] >= self.window:
+                    self._sent.popleft()
+                if len(self._sent) < self.per_minute:
+                    self._sent.append(now)
+                    return
+                await asyncio.sleep(self.window - (now - self._sent[0]))
+
+
+class NotificationDispatcher:
+    """多渠道通知分发器（连接池 + 渠道限速 + 并发发送 + 合并消息）"""
+
+    def __init__(self, pool_size=10, timeout=10, rate_limits=None, max_batch=None):
+        """
+        参数:
+        - pool_size: 连接池大小
+        - timeout: 单次请求超时（秒）
+        - rate_limits: {渠道: 每分钟消息数}，默认读取 NOTIFY_RATE_LIMITS
+        - max_batch: {渠道: 每条消息最多合并的商品数}，覆盖 MAX_BATCH
+        """
+        self.timeout = timeout
+        self.rate_limits = rate_limits or rate_limits_from_env()
+        self.max_batch = dict(MAX_BATCH, **(max_batch or {}))
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        # 限速器绑定在创建它的事件循环上，按 (循环, 渠道) 分别保存
+        self._limiters = {}
+        self._limiters_lock = threading.Lock()
+        self.stats = {'messages': 0, 'failed_messages': 0}
+
+    def close(self):
+        self.session.close()
+
+    def _limiter(self, channel):
+        key = (id(asyncio.get_running_loop()), channel)
+        with self._limiters_lock:
+            limiter = self._limiters.get(key)
+            if limiter is None:
+                limiter = ChannelLimiter(self.rate_limits.get(channel, 60))
+                self._limiters[key] = limiter
+            return limiter
+
+    # ==================== 渠道 ====================
+    @staticmethod
+    def configured_channels(config):
+        """返回已配置的渠道名称列表"""
+        config = config or {}
+        checks = {
+            'wx': config.get('wx_bot_url'),
+            'dingtalk': config.get('dingtalk_bot_url'),
+            'feishu': config.get('feishu_bot_url'),
+            'telegram': config.get('telegram_bot_token') and config.get('telegram_chat_id'),
+            'ntfy': config.get('ntfy_topic_url'),
+            'gotify': config.get('gotify_url') and config.get('gotify_token'),
+            'bark': config.get('bark_url'),
+            'webhook': config.get('webhook_url'),
+        }
+        return [name for name, value in checks.items() if value]
+
+    @staticmethod
+    def _link(product, config):
+        link = product['商品链接']
+        if str(config.get('pcurl_to_mobile', 'true')).lower() in ('true', '1', 'yes'):
+            return mobile_link(link)
+        return link
+
+    def _build(self, channel, products, reason, config):
+        """构建一条消息的请求参数 (method, url, kwargs)"""
+        links = [self._link(p, config) for p in products]
+        lines = [f"{i + 1}. {_short_title(p)}\n价格: {p['当前售价']} | 卖家: {p['卖家昵称']}"
+                 for i, p in enumerate(products)]
+
+        if channel == 'wx':
+            articles = [{
+                'title': f"{p['当前售价']} {_short_title(p)}",
+                'description': f"{reason}\n卖家: {p['卖家昵称']}",
+                'url': link,
+                'picurl': _image(p),
+            } for p, link in zip(products, links)]
+            return 'POST', config['wx_bot_url'], {'json': {'msgtype': 'news', 'news': {'articles': articles}}}
+
+        if channel == 'dingtalk':
+            text = f"### {reason}\n\n" + '\n\n'.join(
+                f"{i + 1}. [{_short_title(p)}]({link})  \n价格: **{p['当前售价']}** | 卖家: {p['卖家昵称']}"
+                for i, (p, link) in enumerate(zip(products, links)))
+            return 'POST', config['dingtalk_bot_url'], {
+                'json': {'msgtype': 'markdown', 'markdown': {'title': reason, 'text': text}}}
+
+        if channel == 'feishu':
+            elements = [{'tag': 'div', 'text': {'tag': 'lark_md', 'content': (
+                f"**{i + 1}. [{_short_title(p)}]({link})**\n价格: {p['当前售价']} | 卖家: {p['卖家昵称']}")}}
+                for i, (p, link) in enumerate(zip(products, links))]
+            card = {'header': {'title': {'tag': 'plain_text', 'content': reason}, 'template': 'orange'},
+                    'elements': elements}
+            return 'POST', config['feishu_bot_url'], {'json': {'msg_type': 'interactive', 'card': card}}
+
+        if channel == 'telegram':
+            text = f"<b>{html.escape(reason)}</b>\n\n" + '\n\n'.join(
+                f"{i + 1}. <a href=\"{html.escape(link)}\">{html.escape(_short_title(p))}</a>\n"
+                f"价格: {html.escape(str(p['当前售价']))} | 卖家: {html.escape(str(p['卖家昵称']))}"
+                for i, (p, link) in enumerate(zip(products, links)))
+            api = (config.get('telegram_api_url') or 'https://api.telegram.org').rstrip('/')
+            url = f"{api}/bot{config['telegram_bot_token']}/sendMessage"
+            return 'POST', url, {'json': {'chat_id': config['telegram_chat_id'], 'text': text,
+                                          'parse_mode': 'HTML', 'disable_web_page_preview': len(products) > 1}}
+
+        if channel == 'ntfy':
+            # 使用 JSON 发布方式（标题放在请求头时不支持中文）
+            base, topic = config['ntfy_topic_url'].rstrip('/').rsplit('/', 1)
+            message = '\n\n'.join(f"{line}\n{link}" for line, link in zip(lines, links))
+            body = {'topic': topic, 'title': reason, 'message': message}
+            if len(products) == 1:
+                body['click'] = links[0]
+            return 'POST', base, {'json': body}
+
+        if channel == 'gotify':
+            message = '\n\n'.join(f"{i + 1}. [{_short_title(p)}]({link})  \n价格: {p['当前售价']} | 卖家: {p['卖家昵称']}"
+                                  for i, (p, link) in enumerate(zip(products, links)))
+            url = f"{config['gotify_url'].rstrip('/')}/message"
+            return 'POST', url, {'params': {'token': config['gotify_token']}, 'json': {
+                'title': reason, 'message': message, 'priority': 5,
+                'extras': {'client::display': {'contentType': 'text/markdown'}}}}
+
+        if channel == 'bark':
+            body = {'title': reason, 'body': '\n'.join(lines), 'group': 'xianyu'}
+            if len(products) == 1:
+                body['url'] = links[0]
+                body['icon'] = _image(products[0])
+            return 'POST', config['bark_url'].rstrip('/'), {'json': body}
+
+        # 通用 Webhook
+        payload = {
+            'title': reason,
+            'content': '\n\n'.join(f"{line}\n链接: {link}" for line, link in zip(lines, links)),
+            'products': [dict(p, 商品链接=link) for p, link in zip(products, links)],
+        }
+        method = (config.get('webhook_method') or 'POST').upper()
+        if method == 'GET':
+            return 'GET', config['webhook_url'], {'params': {'title': payload['title'], 'content': payload['content']}}
+        if (config.get('webhook_content_type') or 'JSON').upper() == 'FORM':
+            return method, config['webhook_url'], {'data': {'title': payload['title'], 'content': payload['content']}}
+        return method, config['webhook_url'], {'json': payload}
+
+    def _post(self, channel, method, url, kwargs):
+        """发送一条消息（在线程池中执行），失败时抛出异常"""
+        response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+        response.raise_for_status()
+        if channel in ('wx', 'dingtalk', 'feishu', 'telegram'):
+            # 这些机器人接口出错时仍返回 200，需要检查响应体
+            body = response.json()
+            if channel in ('wx', 'dingtalk') and body.get('errcode', 0) != 0:
+                raise RuntimeError(f"errcode={body.get('errcode')} {body.get('errmsg')}")
+            if channel == 'feishu' and body.get('code', body.get('StatusCode', 0)) != 0:
+                raise RuntimeError(f"code={body.get('code')} {body.get('msg')}")
+            if channel == 'telegram' and not body.get('ok'):
+                raise RuntimeError(body.get('description') or 'ok=false')
+
+    async def _send_channel(self, channel, products, reason, config):
+        result = {'messages': 0, 'sent': [], 'failed': [], 'errors': []}
+        size = max(1, self.max_batch.get(channel, 1))
+        limiter = self._limiter(channel)
+        for start in range(0, len(products), size):
+            batch = products[start:start + size]
+            ids = [p['商品ID'] for p in batch]
+            await limiter.acquire()
+            try:
+                method, url, kwargs = self._build(channel, batch, reason, config)
+                await asyncio.to_thread(self._post, channel, method, url, kwargs)
+                result['messages'] += 1
+                result['sent'].extend(ids)
+                self.stats['messages'] += 1
+            except Exception as e:
+                result['failed'].extend(ids)
+                result['errors'].append(str(e))
+                self.stats['failed_messages'] += 1
+                print(f"[通知] {channel} 发送失败（{len(batch)} 个商品）: {e}")
+        return result
+
+    async def send(self, records, reason, config, channels=None):
+        """
+        把商品推送到所有已配置的渠道
+
+        参数:
+        - records: 结果记录列表（或已扁平化的商品数据）
+        - reason: 推送原因，作为消息标题
+        - config: get_notification_config() 的结果
+        - channels: 只推送到这些渠道（默认全部已配置渠道）
+
+        返回: {'channels': {渠道: {'messages', 'sent', 'failed', 'errors'}}, 'delivered': [至少一个渠道送达的商品ID]}
+        """
+        products = [flatten_product(r) for r in records]
+        names = [c for c in self.configured_channels(config) if channels is None or c in channels]
+        results = await asyncio.gather(*(self._send_channel(c, products, reason, config) for c in names))
+        by_channel = dict(zip(names, results))
+        delivered = set()
+        for result in results:
+            delivered.update(result['sent'])
+        return {
+            'channels': by_channel,
+            'delivered': [p['商品ID'] for p in products if p['商品ID'] in delivered],
+        }
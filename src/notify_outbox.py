@@ -0,0 +1,491 @@
+"""
+通知发件箱
+推送不再由爬虫或接口直接发送：先按 (商品ID, 渠道) 写入本地 SQLite 发件箱，
+再由后台 OutboxWorker 取出、合并后通过 NotificationDispatcher 发送。
+- 渠道慢或宕机不会拖慢爬取，失败的推送按指数退避重试，服务重启后继续发送
+- 同一商品在同一渠道只推送一次（重复写入被忽略，除非显式要求重新推送）
+- 记录每条推送的入队/送达时间，供状态接口统计送达延迟
+
+发件箱文件与其他结果库一样保存在结果目录下，Web 服务和任务子进程共用；
+取件时按租约标记为 sending，多个进程同时取件不会重复发送，进程中途退出时租约过期后自动重新取件。
+
+爬虫中的用法（代替直接调用 send_notification）:
+    outbox = get_current_outbox()
+    if outbox:
+        outbox.enqueue([record], "发现新商品", channels)
+
+命令行用法:
+    python -m src.notify_outbox status
+    python -m src.notify_outbox retry-failed
+    python -m src.notify_outbox drain --timeout 60
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from src.notify_dispatcher import NotificationDispatcher, flatten_product
+
+# 数据库文件名（保存在结果目录下，与价格历史相同）
+OUTBOX_FILENAME = '.notify_outbox.db'
+
+# 当前这次爬取使用的发件箱（由 main.py 在开始爬取前设置）
+_current_outbox = contextvars.ContextVar('notify_outbox', default=None)
+
+
+def get_current_outbox():
+    """返回当前爬取使用的发件箱，没有时返回 None"""
+    return _current_outbox.get()
+
+
+def set_current_outbox(outbox):
+    _current_outbox.set(outbox)
+
+
+def retry_settings():
+    """读取重试配置"""
+    return {
+        'max_attempts': max(1, int(os.getenv('NOTIFY_MAX_ATTEMPTS', '8'))),
+        'base_delay': float(os.getenv('NOTIFY_RETRY_BASE_SECONDS', '10')),
+        'max_delay': float(os.getenv('NOTIFY_RETRY_MAX_SECONDS', '1800')),
+    }
+
+
+def backoff_delay(attempts, base_delay, max_delay):
+    """第 attempts 次失败后的等待时间（指数退避，带 ±20% 抖动）"""
+    return min(max_delay, base_delay * 2 ** max(attempts - 1, 0)) * random.uniform(0.8, 1.2)
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q / 100))]
+
+
+class NotifyOutbox:
+    """基于 SQLite 的通知发件箱"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = None
+
+    @classmethod
+    def for_results_dir(cls, jsonl_dir):
+        return cls(os.path.join(jsonl_dir, OUTBOX_FILENAME))
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+            # 手动控制事务：取件时的查询和标记需要在同一个写事务中完成
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS outbox ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " product_id TEXT NOT NULL,"
+                " channel TEXT NOT NULL,"
+                " reason TEXT NOT NULL,"
+                " payload TEXT NOT NULL,"
+                " status TEXT NOT NULL,"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " next_attempt REAL NOT NULL,"
+                " lease_until REAL,"
+                " created_at REAL NOT NULL,"
+                " sent_at REAL,"
+                " last_error TEXT,"
+                " UNIQUE (product_id, channel))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(status, next_attempt)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_sent ON outbox(sent_at)")
+            self._conn = conn
+        return self._conn
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    # ==================== 写入 ====================
+    def enqueue(self, records, reason, channels, force=False):
+        """
+        把商品推送写入发件箱（每个商品、每个渠道一条）
+
+        参数:
+        - records: 结果记录或扁平化商品数据列表
+        - reason: 推送原因（消息标题）
+        - channels: 渠道名称列表（NotificationDispatcher.configured_channels 的结果）
+        - force: 已推送过的商品也重新推送（正在发送中的除外）
+
+        返回: {'queued': 新入队数, 'duplicates': 已存在而被忽略的数量, 'products': 至少一个渠道入队的商品数}
+        """
+        now = time.time()
+        queued = duplicates = products = 0
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for record in records:
+                    product = flatten_product(record)
+                    product_id = str(product.get('商品ID') or '')
+                    if not product_id:
+                        continue
+                    payload = json.dumps(product, ensure_ascii=False)
+                    before = queued
+                    for channel in channels:
+                        cursor = conn.execute(
+                            "INSERT OR IGNORE INTO outbox (product_id, channel, reason, payload, status, next_attempt,"
+                            " created_at) VALUES (?, ?, ?, ?, 'queued', ?, ?)",
+                            (product_id, channel, reason, payload, now, now)
+                        )
+                        if cursor.rowcount:
+                            queued += 1
+                            continue
+                        if force:
+                            cursor = conn.execute(
+                                "UPDATE outbox SET reason = ?, payload = ?, status = 'queued', attempts = 0,"
+                                " next_attempt = ?, lease_until = NULL, created_at = ?, sent_at = NULL,"
+                                " last_error = NULL WHERE product_id = ? AND channel = ? AND status != 'sending'",
+                                (reason, payload, now, now, product_id, channel)
+                            )
+                            if cursor.rowcount:
+                                queued += 1
+                                continue
+                        duplicates += 1
+                    products += queued > before
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return {'queued': queued, 'duplicates': duplicates, 'products': products}
+
+    # ==================== 取件 ====================
+    def claim(self, limit=50, lease_seconds=300):
+        """取出到期的推送并标记为发送中，返回 [{id, product_id, channel, reason, product, attempts}]"""
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = conn.execute(
+                    "SELECT id, product_id, channel, reason, payload, attempts FROM outbox"
+                    " WHERE (status = 'queued' AND next_attempt <= ?) OR (status = 'sending' AND lease_until < ?)"
+                    " ORDER BY next_attempt LIMIT ?",
+                    (now, now, limit)
+                ).fetchall()
+                conn.executemany(
+                    "UPDATE outbox SET status = 'sending', lease_until = ? WHERE id = ?",
+                    [(now + lease_seconds, row[0]) for row in rows]
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return [
+            {'id': row[0], 'product_id': row[1], 'channel': row[2], 'reason': row[3],
+             'product': json.loads(row[4]), 'attempts': row[5]}
+            for row in rows
+        ]
+
+    def release(self, ids):
+        """归还尚未发送完的推送（停止或出错时），不计入重试次数，立即可被再次取出"""
+        with self._lock:
+            self._connect().executemany(
+                "UPDATE outbox SET status = 'queued', lease_until = NULL WHERE id = ? AND status = 'sending'",
+                [(i,) for i in ids]
+            )
+
+    def mark_sent(self, ids):
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.executemany(
+                "UPDATE outbox SET status = 'sent', sent_at = ?, attempts = attempts + 1, lease_until = NULL,"
+                " last_error = NULL WHERE id = ?",
+                [(now, i) for i in ids]
+            )
+
+    def mark_failed(self, ids, error, settings=None, permanent=False):
+        """记录发送失败：未达到重试上限时按指数退避重新排队，否则标记为 failed"""
+        settings = settings or retry_settings()
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for i in ids:
+                    row = conn.execute("SELECT attempts FROM outbox WHERE id = ?", (i,)).fetchone()
+                    if row is None:
+                        continue
+                    attempts = row[0] + 1
+                    if permanent or attempts >= settings['max_attempts']:
+                        conn.execute(
+                            "UPDATE outbox SET status = 'failed', attempts = ?, lease_until = NULL, last_error = ?"
+                            " WHERE id = ?",
+                            (attempts, error, i)
+                        )
+                    else:
+                        delay = backoff_delay(attempts, settings['base_delay'], settings['max_delay'])
+                        conn.execute(
+                            "UPDATE outbox SET status = 'queued', attempts = ?, next_attempt = ?,"
+                            " lease_until = NULL, last_error = ? WHERE id = ?",
+                            (attempts, now + delay, error, i)
+                        )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def retry_failed(self, channel=None):
+        """把已放弃的推送重新排队，返回数量"""
+        sql = ("UPDATE outbox SET status = 'queued', attempts = 0, next_attempt = ?, last_error = NULL"
+               " WHERE status = 'failed'")
+        params = [time.time()]
+        if channel:
+            sql += " AND channel = ?"
+            params.append(channel)
+        with self._lock:
+            return self._connect().execute(sql, params).rowcount
+
+    def purge(self, days):
+        """删除 days 天前已送达的记录（同时失去这些商品的去重），返回删除数量"""
+        with self._lock:
+            return self._connect().execute(
+                "DELETE FROM outbox WHERE status = 'sent' AND sent_at < ?", (time.time() - days * 86400,)
+            ).rowcount
+
+    def next_due(self):
+        """最早一条待发送推送的到期时间，没有时返回 None"""
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT MIN(next_attempt) FROM outbox WHERE status = 'queued'"
+            ).fetchone()
+        return row[0]
+
+    # ==================== 统计 ====================
+    def status(self, window_hours=24):
+        """各状态数量（总计和按渠道）、最近 window_hours 小时的送达延迟和最近的失败"""
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            counts = conn.execute("SELECT channel, status, COUNT(*) FROM outbox GROUP BY channel, status").fetchall()
+            latencies = conn.execute(
+                "SELECT channel, sent_at - created_at FROM outbox WHERE status = 'sent' AND sent_at >= ?",
+                (now - window_hours * 3600,)
+            ).fetchall()
+            oldest = conn.execute("SELECT MIN(created_at) FROM outbox WHERE status IN ('queued', 'sending')").fetchone()
+            failures = conn.execute(
+                "SELECT product_id, channel, attempts, last_error FROM outbox"
+                " WHERE last_error IS NOT NULL ORDER BY next_attempt DESC LIMIT 10"
+            ).fetchall()
+
+        empty = {'queued': 0, 'sending': 0, 'sent': 0, 'failed': 0}
+        totals = dict(empty)
+        channels = {}
+        for channel, state, count in counts:
+            totals[state] = totals.get(state, 0) + count
+            channels.setdefault(channel, dict(empty))[state] = count
+
+        def summarize(values):
+            values = sorted(values)
+            if not values:
+                return None
+            return {
+                'count': len(values),
+                'avg_seconds': round(sum(values) / len(values), 2),
+                'p50_seconds': round(_percentile(values, 50), 2),
+                'p95_seconds': round(_percentile(values, 95), 2),
+                'max_seconds': round(values[-1], 2),
+            }
+
+        by_channel = {}
+        for channel, latency in latencies:
+            by_channel.setdefault(channel, []).append(latency)
+        for channel, values in by_channel.items():
+            channels.setdefault(channel, dict(empty))['latency'] = summarize(values)
+
+        return {
+            **totals,
+            'latency': summarize([latency for _, latency in latencies]),
+            'oldest_pending_seconds': round(now - oldest[0], 1) if oldest[0] else None,
+            'channels': channels,
+            'recent_errors': [
+                {'product_id': row[0], 'channel': row[1], 'attempts': row[2], 'error': row[3]} for row in failures
+            ],
+        }
+
+
+class OutboxWorker:
+    """后台取件并发送的工作协程"""
+
+    def __init__(self, outbox, dispatcher, get_config, interval=2.0, batch_size=50, settings=None,
+                 retention_days=None):
+        """
+        参数:
+        - outbox: NotifyOutbox
+        - dispatcher: NotificationDispatcher
+        - get_config: 返回当前通知配置的函数（每轮重新读取，修改配置后无需重启）
+        - interval: 没有到期推送时的轮询间隔（秒）
+        - batch_size: 每轮最多取出的推送数
+        - settings: 重试配置，默认读取 retry_settings()
+        - retention_days: 已送达记录保留天数，默认读取 NOTIFY_OUTBOX_RETENTION_DAYS（30）
+        """
+        self.outbox = outbox
+        self.dispatcher = dispatcher
+        self.get_config = get_config
+        self.interval = interval
+        self.batch_size = batch_size
+        self.settings = settings or retry_settings()
+        if retention_days is None:
+            retention_days = float(os.getenv('NOTIFY_OUTBOX_RETENTION_DAYS', '30'))
+        self.retention_days = retention_days
+        self._worker = None
+        self._wake = None
+        self._stopping = False
+        self._last_purge = 0
+
+    def wake(self):
+        """有新推送入队时调用，立即开始下一轮"""
+        if self._wake is not None:
+            self._wake.set()
+
+    async def _send_group(self, channel, reason, rows, config, pending):
+        """发送同一渠道、同一原因的一组推送；已有结果的推送从 pending 中移除"""
+        if channel not in self.dispatcher.configured_channels(config):
+            pending.difference_update(r['id'] for r in rows)
+            await asyncio.to_thread(self.outbox.mark_failed, [r['id'] for r in rows], "渠道未配置",
+                                    self.settings, True)
+            return
+        result = await self.dispatcher.send([r['product'] for r in rows], reason, config, channels=[channel])
+        channel_result = result['channels'].get(channel) or {'sent': [], 'errors': []}
+        sent = set(channel_result['sent'])
+        sent_ids = [r['id'] for r in rows if str(r['product'].get('商品ID')) in sent]
+        failed_ids = [r['id'] for r in rows if r['id'] not in set(sent_ids)]
+        # 先移出 pending：即使随后被取消，已在线程中执行的标记也会完成，不能再归还
+        pending.difference_update(r['id'] for r in rows)
+        if sent_ids:
+            await asyncio.to_thread(self.outbox.mark_sent, sent_ids)
+        if failed_ids:
+            error = '; '.join(channel_result['errors'])[:500] or '发送失败'
+            await asyncio.to_thread(self.outbox.mark_failed, failed_ids, error, self.settings)
+
+    async def process_once(self):
+        """
+        取出一批到期推送并发送，返回处理的数量
+
+        被取消（停止、flush 超时）或出错时，还没有结果的推送立即归还租约，
+        不必等租约过期，下一次 process_once / flush 就能再次取出。
+        """
+        rows = await asyncio.to_thread(self.outbox.claim, self.batch_size)
+        if not rows:
+            return 0
+        pending = {row['id'] for row in rows}
+        try:
+            config = self.get_config() or {}
+            groups = {}
+            for row in rows:
+                groups.setdefault((row['channel'], row['reason']), []).append(row)
+            await asyncio.gather(*(self._send_group(channel, reason, group, config, pending)
+                                   for (channel, reason), group in groups.items()))
+        finally:
+            if pending:
+                # 可能处于取消过程中，直接同步归还（单条 UPDATE，耗时很短）
+                self.outbox.release(list(pending))
+        return len(rows)
+
+    async def flush(self, timeout):
+        """发送当前所有已到期的推送，最多等待 timeout 秒（退避中的推送留给下次），返回处理的数量"""
+        processed = 0
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                count = await asyncio.wait_for(self.process_once(), deadline - time.monotonic())
+            except asyncio.TimeoutError:
+                break
+            if not count:
+                break
+            processed += count
+        return processed
+
+    def start(self):
+        if self._worker is None or self._worker.done():
+            self._wake = asyncio.Event()
+            self._stopping = False
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self, timeout=10):
+        """停止后台发送：等待正在发送的这一批完成（最多 timeout 秒），超时则取消并归还未发完的推送"""
+        if self._worker is None:
+            return
+        worker, self._worker = self._worker, None
+        self._stopping = True
+        self.wake()
+        try:
+            await asyncio.wait_for(asyncio.shield(worker), timeout)
+        except asyncio.TimeoutError:
+            worker.cancel()
+            try:
+                await worker
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        while not self._stopping:
+            processed = 0
+            try:
+                processed = await self.process_once()
+                if self.retention_days > 0 and time.time() - self._last_purge > 3600:
+                    self._last_purge = time.time()
+                    await asyncio.to_thread(self.outbox.purge, self.retention_days)
+            except Exception as e:
+                print(f"[通知] 发件箱处理失败: {e}")
+            if processed or self._stopping:
+                continue
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='通知发件箱')
+    parser.add_argument('command', choices=['status', 'retry-failed', 'drain'],
+                        help='status=查看状态, retry-failed=重试已放弃的推送, drain=立即发送到期的推送')
+    parser.add_argument('--dir', type=str, help='结果目录（默认使用配置中的 JSONL_OUTPUT_DIR）')
+    parser.add_argument('--channel', type=str, default=None, help='只重试该渠道（retry-failed）')
+    parser.add_argument('--timeout', type=float, default=60, help='最多发送多少秒（drain）')
+    args = parser.parse_args()
+
+    jsonl_dir = args.dir
+    if not jsonl_dir:
+        from src.config import JSONL_OUTPUT_DIR
+        jsonl_dir = JSONL_OUTPUT_DIR
+
+    outbox = NotifyOutbox.for_results_dir(jsonl_dir)
+    try:
+        if args.command == 'status':
+            print(json.dumps(outbox.status(), ensure_ascii=False, indent=2))
+        elif args.command == 'retry-failed':
+            print(f"已重新排队 {outbox.retry_failed(args.channel)} 条推送")
+        else:
+            from src.config import get_notification_config
+            dispatcher = NotificationDispatcher()
+            try:
+                worker = OutboxWorker(outbox, dispatcher, get_notification_config)
+                print(f"已发送 {asyncio.run(worker.flush(args.timeout))} 条推送")
+            finally:
+                dispatcher.close()
+    finally:
+        outbox.close()
+
+
+if __name__ == '__main__':
+    main()
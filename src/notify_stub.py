@@ -0,0 +1,117 @@
+"""
+通知 Webhook 本地模拟服务
+记录收到的每条推送并返回各平台的成功响应（errcode=0 / code=0 / ok=true），
+供测试 NotificationDispatcher 使用，无需真实的机器人地址。
+
+可以指定某个路径返回失败（fail_paths），或为每个请求增加延迟（delay），
+用于模拟渠道故障和慢响应。
+
+命令行用法:
+    python -m src.notify_stub --port 8766
+    WX_BOT_URL=http://127.0.0.1:8766/wx DINGTALK_BOT_URL=http://127.0.0.1:8766/dingtalk python web_server.py
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class WebhookStubServer:
+    """推送接收模拟服务（在后台线程中运行）"""
+
+    def __init__(self, host='127.0.0.1', port=0, fail_paths=None, delay=0):
+        """
+        参数:
+        - port: 0 表示自动分配端口
+        - fail_paths: 这些路径返回 HTTP 500
+        - delay: 每个请求的处理延迟（秒）
+        """
+        self.fail_paths = set(fail_paths or [])
+        self.delay = delay
+        self.calls = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def calls_to(self, path):
+        """返回发往某个路径的请求（按到达顺序）"""
+        with self._lock:
+            return [call for call in self.calls if call['path'] == path]
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _handle(self):
+                url = urlparse(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                raw = self.rfile.read(length).decode('utf-8') if length else ''
+                try:
+                    body = json.loads(raw) if raw else None
+                except ValueError:
+                    body = {k: v[0] for k, v in parse_qs(raw).items()}
+                with stub._lock:
+                    stub.calls.append({
+                        'method': self.command,
+                        'path': url.path,
+                        'params': {k: v[0] for k, v in parse_qs(url.query).items()},
+                        'body': body,
+                        'time': time.time(),
+                    })
+                if stub.delay:
+                    time.sleep(stub.delay)
+
+                status = 500 if url.path in stub.fail_paths else 200
+                payload = json.dumps({'errcode': 0, 'errmsg': 'ok', 'code': 0, 'ok': True}).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json;charset=UTF-8')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = _handle
+            do_POST = _handle
+            do_PUT = _handle
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='通知 Webhook 模拟服务')
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--delay', type=float, default=0, help='每个请求的处理延迟（秒）')
+    args = parser.parse_args()
+
+    stub = WebhookStubServer(port=args.port, delay=args.delay)
+    print(f"模拟服务已启动: {stub.base_url}")
+    try:
+        while True:
+            before = len(stub.calls)
+            stub._server.handle_request()
+            for call in stub.calls[before:]:
+                print(f"[{call['method']}] {call['path']} {json.dumps(call['body'], ensure_ascii=False)[:200]}")
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,336 @@
+"""
+商品价格历史
+同一关键词定时重复运行时，已见过的商品不会再写入结果文件，改价也就无从得知。
+爬虫每次在搜索结果中看到商品时记录一次价格，这里按商品ID保存只追加的价格序列，
+并在价格下降时写入降价记录，供降价提醒使用（每次运行只处理本次看到的商品，无需回扫历史）。
+
+价格序列只在价格变化时追加一个点，以 (时间差, 价格差) 的 zigzag varint 差分编码
+追加到 BLOB 末尾，每个点通常只占 4~6 字节。
+
+爬虫中的用法:
+    history = get_current_price_history()
+    if history:
+        history.record(item_id, search_item_price(item), keyword=keyword, title=title)
+
+命令行用法:
+    python -m src.price_history seed                  # 用现有结果文件初始化价格历史
+    python -m src.price_history drops --min-pct 10    # 查看最近24小时降价超过10%的商品
+"""
+import argparse
+import contextvars
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+from src.product_index import RESULT_FILE_SUFFIX, extract_product_id
+from src.result_segments import open_source, source_paths
+from src.result_store import list_result_files, parse_price
+
+# 数据库文件名（保存在结果目录下，与已见商品库相同）
+PRICE_HISTORY_FILENAME = '.price_history.db'
+
+# 当前这次爬取使用的价格历史（由 main.py 在开始爬取前设置）
+_current_history = contextvars.ContextVar('price_history', default=None)
+
+
+def get_current_price_history():
+    """返回当前爬取使用的价格历史，没有时返回 None"""
+    return _current_history.get()
+
+
+def set_current_price_history(history):
+    _current_history.set(history)
+
+
+# ==================== 差分编码 ====================
+def _zigzag(n):
+    return n * 2 if n >= 0 else -n * 2 - 1
+
+
+def _unzigzag(n):
+    return n // 2 if n % 2 == 0 else -(n + 1) // 2
+
+
+def encode_deltas(values):
+    """把整数序列编码为 zigzag varint 字节串"""
+    out = bytearray()
+    for value in values:
+        n = _zigzag(value)
+        while n >= 0x80:
+            out.append((n & 0x7F) | 0x80)
+            n >>= 7
+        out.append(n)
+    return bytes(out)
+
+
+def decode_deltas(data):
+    """encode_deltas 的逆操作"""
+    values = []
+    n = shift = 0
+    for byte in data:
+        n |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        values.append(_unzigzag(n))
+        n = shift = 0
+    return values
+
+
+def _to_cents(price):
+    value = parse_price(price)
+    return None if value is None else int(round(value * 100))
+
+
+class PriceHistory:
+    """基于 SQLite 的商品价格历史和降价记录"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = None
+        self.counters = {'observed': 0, 'new': 0, 'changed': 0, 'dropped': 0}
+
+    @classmethod
+    def for_results_dir(cls, jsonl_dir):
+        return cls(os.path.join(jsonl_dir, PRICE_HISTORY_FILENAME))
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+            # 手动控制事务：读取上次价格和追加新点需要在同一个写事务中完成
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS price_series ("
+                " product_id TEXT PRIMARY KEY,"
+                " keyword TEXT,"
+                " title TEXT,"
+                " first_time INTEGER NOT NULL,"
+                " first_price INTEGER NOT NULL,"
+                " last_time INTEGER NOT NULL,"
+                " last_price INTEGER NOT NULL,"
+                " last_seen INTEGER NOT NULL,"
+                " points INTEGER NOT NULL,"
+                " deltas BLOB NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS price_drops ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " product_id TEXT NOT NULL,"
+                " keyword TEXT,"
+                " title TEXT,"
+                " old_price INTEGER NOT NULL,"
+                " new_price INTEGER NOT NULL,"
+                " drop_pct REAL NOT NULL,"
+                " detected_at INTEGER NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_price_drops_time ON price_drops(detected_at)")
+            self._conn = conn
+        return self._conn
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    # ==================== 写入 ====================
+    def _record(self, conn, product_id, cents, keyword, title, observed_at):
+        row = conn.execute(
+            "SELECT last_time, last_price, deltas, keyword, title FROM price_series WHERE product_id = ?",
+            (product_id,)
+        ).fetchone()
+        if row is None:
+            conn.execute(
+                "INSERT INTO price_series VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1, ?)",
+                (product_id, keyword, title, observed_at, cents, observed_at, cents, observed_at, b'')
+            )
+            self.counters['new'] += 1
+            return None
+
+        last_time, last_price, deltas, stored_keyword, stored_title = row
+        keyword = keyword or stored_keyword
+        title = title or stored_title
+        if observed_at < last_time:
+            # 比最后一个点更早的观测（如导入旧数据）不追加，避免时间倒序
+            return None
+        if cents == last_price:
+            conn.execute(
+                "UPDATE price_series SET last_seen = MAX(last_seen, ?), title = ? WHERE product_id = ?",
+                (observed_at, title, product_id)
+            )
+            return None
+
+        conn.execute(
+            "UPDATE price_series SET deltas = ?, last_time = ?, last_price = ?,"
+            " last_seen = MAX(last_seen, ?), points = points + 1, title = ?, keyword = ? WHERE product_id = ?",
+            (deltas + encode_deltas([observed_at - last_time, cents - last_price]), observed_at, cents,
+             observed_at, title, keyword, product_id)
+        )
+        self.counters['changed'] += 1
+        change = {'product_id': product_id, 'old_price': last_price / 100, 'new_price': cents / 100}
+        if cents < last_price and last_price > 0:
+            drop_pct = round((last_price - cents) * 100 / last_price, 2)
+            conn.execute(
+                "INSERT INTO price_drops (product_id, keyword, title, old_price, new_price, drop_pct, detected_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (product_id, keyword, title, last_price, cents, drop_pct, observed_at)
+            )
+            self.counters['dropped'] += 1
+            change['drop_pct'] = drop_pct
+        return change
+
+    def record_many(self, observations):
+        """
+        批量记录一次运行中看到的价格，observations 为 (商品ID, 价格, 关键词, 标题[, 观测时间]) 元组；
+        返回价格发生变化的商品列表 [{product_id, old_price, new_price[, drop_pct]}]
+        """
+        now = int(time.time())
+        changes = []
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for product_id, price, keyword, title, *rest in observations:
+                    cents = _to_cents(price)
+                    if not product_id or cents is None:
+                        continue
+                    self.counters['observed'] += 1
+                    observed_at = int(rest[0]) if rest and rest[0] is not None else now
+                    change = self._record(conn, str(product_id), cents, keyword, title, observed_at)
+                    if change:
+                        changes.append(change)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return changes
+
+    def record(self, product_id, price, keyword=None, title=None, observed_at=None):
+        """记录一次价格观测，价格变化时返回变化信息，否则返回 None"""
+        changes = self.record_many([(product_id, price, keyword, title, observed_at)])
+        return changes[0] if changes else None
+
+    def seed_from_results(self, jsonl_dir):
+        """用结果目录中已保存的记录（含历史分段）初始化价格历史，返回处理的记录数（缺少爬取时间的记录按文件修改时间计）"""
+        processed = 0
+        for filename in sorted(list_result_files(jsonl_dir)):
+            keyword = filename[:-len(RESULT_FILE_SUFFIX)]
+            batch = []
+            for path in source_paths(jsonl_dir, filename):
+                # 旧结果文件的记录可能没有爬取时间（或格式不对），按文件修改时间计
+                try:
+                    fallback_time = os.path.getmtime(path)
+                except OSError:
+                    fallback_time = time.time()
+                with open_source(path) as f:
+                    for line in f:
+                        try:
+                            record = json.loads(line)
+                        except (json.JSONDecodeError, UnicodeDecodeError):
+                            continue
+                        try:
+                            observed_at = datetime.fromisoformat(record.get('爬取时间') or '').timestamp()
+                        except (ValueError, TypeError):
+                            observed_at = fallback_time
+                        product_info = record.get('商品信息') or {}
+                        product_id = extract_product_id(record)
+                        if product_id:
+                            batch.append((product_id, product_info.get('当前售价'), keyword,
+                                          product_info.get('商品标题'), observed_at))
+            # 按时间顺序追加，保证差分为正
+            batch.sort(key=lambda item: item[4])
+            self.record_many(batch)
+            processed += len(batch)
+        return processed
+
+    # ==================== 查询 ====================
+    def get_series(self, product_id):
+        """返回商品的价格曲线 {product_id, keyword, title, last_seen, points: [{time, price}]}，不存在时返回 None"""
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT keyword, title, first_time, first_price, last_seen, deltas FROM price_series WHERE product_id = ?",
+                (str(product_id),)
+            ).fetchone()
+        if row is None:
+            return None
+        keyword, title, timestamp, cents, last_seen, deltas = row
+        points = [(timestamp, cents)]
+        values = decode_deltas(deltas)
+        for dt, dp in zip(values[0::2], values[1::2]):
+            timestamp += dt
+            cents += dp
+            points.append((timestamp, cents))
+        return {
+            'product_id': str(product_id),
+            'keyword': keyword,
+            'title': title,
+            'last_seen': datetime.fromtimestamp(last_seen).isoformat(),
+            'points': [{'time': datetime.fromtimestamp(t).isoformat(), 'price': c / 100} for t, c in points],
+        }
+
+    def drops(self, min_pct=10, since=None, keyword=None, limit=100):
+        """
+        降价记录（最新的在前）
+
+        参数:
+        - min_pct: 最小降幅（百分比）
+        - since: 起始时间（datetime），默认最近24小时
+        - keyword: 只返回该关键词的商品
+        """
+        since = since or datetime.now() - timedelta(hours=24)
+        sql = ("SELECT product_id, keyword, title, old_price, new_price, drop_pct, detected_at FROM price_drops"
+               " WHERE detected_at >= ? AND drop_pct >= ?")
+        params = [int(since.timestamp()), min_pct]
+        if keyword:
+            sql += " AND keyword = ?"
+            params.append(keyword)
+        sql += " ORDER BY detected_at DESC, id DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._connect().execute(sql, params).fetchall()
+        return [{
+            'product_id': product_id,
+            'keyword': kw,
+            'title': title,
+            'old_price': old / 100,
+            'new_price': new / 100,
+            'drop_pct': pct,
+            'detected_at': datetime.fromtimestamp(detected_at).isoformat(),
+        } for product_id, kw, title, old, new, pct, detected_at in rows]
+
+    def summary(self):
+        c = self.counters
+        return f"价格记录 {c['observed']} 次（新商品 {c['new']}，价格变化 {c['changed']}，其中降价 {c['dropped']}）"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='商品价格历史工具')
+    parser.add_argument('command', choices=['seed', 'drops'], help='seed=从结果文件初始化, drops=查看降价商品')
+    parser.add_argument('--dir', type=str, help='结果目录（默认使用配置中的 JSONL_OUTPUT_DIR）')
+    parser.add_argument('--min-pct', type=float, default=10, help='drops: 最小降幅（百分比）')
+    parser.add_argument('--hours', type=float, default=24, help='drops: 最近多少小时')
+    args = parser.parse_args()
+
+    jsonl_dir = args.dir
+    if not jsonl_dir:
+        from src.config import JSONL_OUTPUT_DIR
+        jsonl_dir = JSONL_OUTPUT_DIR
+
+    history = PriceHistory.for_results_dir(jsonl_dir)
+    if args.command == 'seed':
+        print(f"已导入 {history.seed_from_results(jsonl_dir)} 条记录")
+    else:
+        for drop in history.drops(args.min_pct, datetime.now() - timedelta(hours=args.hours)):
+            print(f"{drop['detected_at']}  -{drop['drop_pct']}%  ¥{drop['old_price']} → ¥{drop['new_price']}  "
+                  f"{drop['title'] or drop['product_id']}")
+    history.close()
+
+
+if __name__ == '__main__':
+    main()
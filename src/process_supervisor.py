@@ -0,0 +1,239 @@
+"""
+子进程监管模块
+跟踪 Web 服务启动的爬虫子进程：定期回收已退出的进程（避免僵尸进程），
+关闭日志文件句柄，记录退出码和运行时长并回调更新任务状态。
+
+服务重启后，上一次启动的子进程不再是当前进程的子进程，无法 wait，
+只能按 pid 检查是否存活（"接管"），进程消失后同样回调，退出码记为 None。
+"""
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+try:
+    import psutil
+except ImportError:  # 可选依赖，未安装时使用系统命令判断进程是否存在
+    psutil = None
+
+
+def pid_alive(pid):
+    """判断 pid 对应的进程是否仍在运行"""
+    if not pid:
+        return False
+    if psutil is not None:
+        try:
+            return psutil.Process(pid).status() != psutil.STATUS_ZOMBIE
+        except psutil.Error:
+            return False
+    if sys.platform == 'win32':
+        # Windows 上 os.kill(pid, 0) 会终止进程，只能查询进程列表
+        result = subprocess.run(['tasklist', '/FI', f'PID eq {pid}', '/NH'],
+                                capture_output=True, text=True, timeout=5)
+        return str(pid) in result.stdout
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _cmdline(pid):
+    """返回进程的命令行参数列表，无法获取时返回 None"""
+    if psutil is not None:
+        try:
+            return psutil.Process(pid).cmdline()
+        except psutil.Error:
+            return None
+    try:
+        with open(f'/proc/{pid}/cmdline', 'rb') as f:
+            return [part.decode('utf-8', 'replace') for part in f.read().split(b'\0') if part]
+    except OSError:
+        return None
+
+
+def _create_time(pid):
+    """返回进程的创建时间戳，无法获取时返回 None"""
+    if psutil is not None:
+        try:
+            return psutil.Process(pid).create_time()
+        except psutil.Error:
+            return None
+    try:
+        # /proc/<pid>/stat 第22个字段为开机后的启动时刻（时钟滴答），进程名可能含空格，从最后一个 ')' 之后解析
+        with open(f'/proc/{pid}/stat', 'rb') as f:
+            fields = f.read().rsplit(b')', 1)[1].split()
+        with open('/proc/stat', 'rb') as f:
+            boot_time = next(int(line.split()[1]) for line in f if line.startswith(b'btime'))
+        return boot_time + int(fields[19]) / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError, StopIteration):
+        return None
+
+
+def is_task_process(pid, task_id, started_before=None):
+    """
+    判断 pid 是否仍是该任务启动的爬虫进程（重启或 pid 复用后可能已是无关进程）
+
+    命令行须包含 main.py 和 --task-id <task_id>；给出 started_before（任务的 last_run 时间戳）时，
+    进程创建时间不能晚于它。无法读取命令行（非 Linux 且未安装 psutil）时只按存活判断。
+    """
+    if not pid_alive(pid):
+        return False
+    args = _cmdline(pid)
+    if args is None:
+        return psutil is None and not os.path.exists('/proc')
+    if not any(os.path.basename(arg) == 'main.py' for arg in args):
+        return False
+    if not any(arg == '--task-id' and args[i + 1:i + 2] == [str(task_id)] for i, arg in enumerate(args)):
+        return False
+    if started_before is not None:
+        created = _create_time(pid)
+        # last_run 在进程启动后才写入，留 1 秒误差
+        if created is not None and created > started_before + 1:
+            return False
+    return True
+
+
+class _Child:
+    """一个被监管的任务进程"""
+
+    def __init__(self, task_id, pid, log_file, process=None, log_handle=None, started_at=None):
+        self.task_id = task_id
+        self.pid = pid
+        self.log_file = log_file
+        self.process = process
+        self.log_handle = log_handle
+        self.started_at = started_at or time.time()
+
+    def poll(self):
+        """进程已退出时返回 (True, 退出码)，否则返回 (False, None)"""
+        if self.process is not None:
+            code = self.process.poll()
+            return code is not None, code
+        return not pid_alive(self.pid), None
+
+
+class ProcessSupervisor:
+    """任务子进程监管器"""
+
+    def __init__(self, on_exit, interval=2.0):
+        """
+        参数:
+        - on_exit: 进程退出回调 on_exit(task_id, exit_code, duration, log_file)，
+          接管的进程退出码未知，为 None
+        - interval: 检查进程状态的间隔（秒）
+        """
+        self.on_exit = on_exit
+        self.interval = interval
+        self._children = {}
+        # 被同一任务的新进程替换下来、尚未回收的旧进程
+        self._retired = []
+        self._worker = None
+
+    # ==================== 登记 ====================
+    def _register(self, child):
+        """登记进程；同一任务已有登记的旧进程时移入待回收列表，照常回收并关闭其日志句柄"""
+        previous = self._children.get(child.task_id)
+        if previous is not None and previous.pid != child.pid:
+            self._retired.append(previous)
+        self._children[child.task_id] = child
+
+    def track(self, task_id, process, log_handle=None, log_file=None):
+        """登记本服务启动的子进程"""
+        self._register(_Child(task_id, process.pid, log_file, process, log_handle))
+
+    def adopt(self, task_id, pid, log_file=None, started_at=None):
+        """接管服务重启前启动、仍在运行的进程（只能按 pid 判断存活）"""
+        self._register(_Child(task_id, pid, log_file, started_at=started_at))
+
+    def is_running(self, task_id):
+        child = self._children.get(task_id)
+        if child is None:
+            return False
+        exited, _ = child.poll()
+        return not exited
+
+    def running_task_ids(self):
+        """返回仍在运行的任务ID（包括接管的进程）"""
+        return [task_id for task_id, child in list(self._children.items()) if not child.poll()[0]]
+
+    def get_pid(self, task_id):
+        child = self._children.get(task_id)
+        return child.pid if child else None
+
+    def wait(self, task_id, timeout):
+        """等待进程退出（阻塞，应在线程中调用），返回是否已退出"""
+        deadline = time.time() + timeout
+        while self.is_running(task_id):
+            if time.time() >= deadline:
+                return False
+            time.sleep(0.2)
+        return True
+
+    # ==================== 回收 ====================
+    def reap(self):
+        """回收所有已退出的进程并回调，返回本次回收的数量"""
+        reaped = 0
+        for child in list(self._children.values()) + list(self._retired):
+            task_id = child.task_id
+            exited, code = child.poll()
+            if not exited:
+                continue
+            # 任务可能已被重新启动，只移除当前这一个进程
+            if self._children.get(task_id) is child:
+                del self._children[task_id]
+            if child in self._retired:
+                self._retired.remove(child)
+            if child.log_handle is not None:
+                try:
+                    child.log_handle.close()
+                except OSError:
+                    pass
+            duration = round(time.time() - child.started_at, 1)
+            reaped += 1
+            try:
+                self.on_exit(task_id, code, duration, child.log_file)
+            except Exception as e:
+                print(f"[进程监管] 更新任务 {task_id} 状态失败: {e}")
+        return reaped
+
+    def start(self):
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+        # 关闭日志句柄（子进程本身不随服务退出）
+        for child in list(self._children.values()) + self._retired:
+            if child.log_handle is not None:
+                try:
+                    child.log_handle.close()
+                except OSError:
+                    pass
+
+    async def _run(self):
+        while True:
+            try:
+                self.reap()
+            except Exception as e:
+                print(f"[进程监管] 检查子进程失败: {e}")
+            await asyncio.sleep(self.interval)
+
+    def get_status(self):
+        now = time.time()
+        return {
+            'tracked': [
+                {
+                    'task_id': child.task_id,
+                    'pid': child.pid,
+                    'adopted': child.process is None,
+                    'running_seconds': int(now - child.started_at),
+                }
+                for child in self._children.values()
+            ]
+        }
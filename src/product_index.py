@@ -0,0 +1,321 @@
+"""
+商品索引模块
+维护 商品ID → (结果文件, 字节偏移) 的磁盘索引，推送商品时直接定位到对应行，
+不再逐个扫描所有 *_full_data.jsonl 文件。
+
+索引按文件记录已处理到的字节位置，每次查询前只增量处理新追加的内容，
+因此爬虫追加记录后无需任何额外操作即可被检索到。
+压缩的历史分段（segments/ 下）不会再变化，只在出现时索引一次，偏移为解压后的字节位置。
+
+命令行用法:
+    python -m src.product_index rebuild            # 重建现有结果文件的索引
+    python -m src.product_index bench              # 查询耗时基准测试
+"""
+import argparse
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from src.result_segments import SEGMENT_DIR, all_segments, open_source, skip_bytes
+
+# 索引数据库文件名（保存在结果目录下，不会被 *_full_data.jsonl 规则匹配）
+INDEX_FILENAME = '.product_index.db'
+RESULT_FILE_SUFFIX = '_full_data.jsonl'
+
+
+def extract_product_id(record):
+    """从一条结果记录中取出商品ID"""
+    product_info = record.get('商品信息') or {}
+    return str(product_info.get('商品ID') or '')
+
+
+class ProductIndex:
+    """基于 SQLite 的商品ID索引"""
+
+    def __init__(self, jsonl_dir, index_path=None):
+        self.jsonl_dir = jsonl_dir
+        self.index_path = index_path or os.path.join(jsonl_dir, INDEX_FILENAME)
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.index_path)), exist_ok=True)
+            conn = sqlite3.connect(self.index_path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS products ("
+                " product_id TEXT PRIMARY KEY,"
+                " filename TEXT NOT NULL,"
+                " offset INTEGER NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_products_filename ON products(filename)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                " filename TEXT PRIMARY KEY,"
+                " indexed_size INTEGER NOT NULL,"
+                " inode INTEGER)"
+            )
+            # 旧版本的索引库没有 inode 列
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(files)")}
+            if 'inode' not in columns:
+                conn.execute("ALTER TABLE files ADD COLUMN inode INTEGER")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    # ==================== 写入 ====================
+    def index_record(self, filename, offset, record):
+        """
+        记录一条刚追加的结果（供爬虫写入JSONL后调用）
+
+        参数:
+        - filename: 结果文件名（不含目录）
+        - offset: 该行在文件中的起始字节偏移
+        - record: 已写入的记录字典
+        """
+        product_id = extract_product_id(record)
+        if not product_id:
+            return
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO products (product_id, filename, offset) VALUES (?, ?, ?)",
+                (product_id, filename, offset)
+            )
+            conn.commit()
+
+    def _index_file(self, conn, filename, start, segment=False):
+        """从 start 字节开始索引文件中的完整行，返回新的已索引位置（历史分段整体索引一次）"""
+        filepath = os.path.join(self.jsonl_dir, filename)
+        rows = []
+        position = start
+        with (open_source(filepath) if segment else open(filepath, 'rb')) as f:
+            if start:
+                f.seek(start)
+            for line in f:
+                # 最后一行可能正在写入，留到下次同步
+                if not segment and not line.endswith(b'\n'):
+                    break
+                offset = position
+                position += len(line)
+                if not line.strip():
+                    continue
+                try:
+                    product_id = extract_product_id(json.loads(line))
+                except (json.JSONDecodeError, UnicodeDecodeError, AttributeError):
+                    continue
+                if product_id:
+                    rows.append((product_id, filename, offset))
+                if len(rows) >= 5000:
+                    conn.executemany("INSERT OR REPLACE INTO products VALUES (?, ?, ?)", rows)
+                    rows = []
+        if rows:
+            conn.executemany("INSERT OR REPLACE INTO products VALUES (?, ?, ?)", rows)
+        # 历史分段记录压缩文件大小，仅用于判断是否已索引
+        stat = os.stat(filepath)
+        marker = stat.st_size if segment else position
+        conn.execute("INSERT OR REPLACE INTO files (filename, indexed_size, inode) VALUES (?, ?, ?)",
+                     (filename, marker, stat.st_ino))
+        return position
+
+    def _drop_file(self, conn, filename):
+        conn.execute("DELETE FROM products WHERE filename = ?", (filename,))
+        conn.execute("DELETE FROM files WHERE filename = ?", (filename,))
+
+    def sync(self):
+        """增量同步：只处理各结果文件新追加的字节，返回本次新处理的字节数"""
+        if not os.path.exists(self.jsonl_dir):
+            return 0
+        processed = 0
+        with self._lock:
+            conn = self._connect()
+            indexed = {name: (size, inode) for name, size, inode in
+                       conn.execute("SELECT filename, indexed_size, inode FROM files")}
+            current = set()
+            # 先索引历史分段（由旧到新），活动分段中的较新记录随后覆盖
+            # 新出现历史分段说明对应的活动分段已滚动（新文件可能复用旧 inode），需要从头索引
+            rotated = set()
+            for base, names in all_segments(self.jsonl_dir).items():
+                for name in names:
+                    filename = f"{SEGMENT_DIR}/{name}"
+                    current.add(filename)
+                    if filename not in indexed:
+                        rotated.add(base)
+                    if indexed.get(filename, (None,))[0] == os.path.getsize(os.path.join(self.jsonl_dir, filename)):
+                        continue
+                    self._drop_file(conn, filename)
+                    processed += self._index_file(conn, filename, 0, segment=True)
+            for filename in os.listdir(self.jsonl_dir):
+                if not filename.endswith(RESULT_FILE_SUFFIX):
+                    continue
+                current.add(filename)
+                stat = os.stat(os.path.join(self.jsonl_dir, filename))
+                size = stat.st_size
+                start, inode = indexed.get(filename, (0, None))
+                if size < start or filename in rotated or (inode is not None and inode != stat.st_ino):
+                    # 文件被截断、重写或滚动为历史分段（新文件的 inode 不同），重新索引
+                    self._drop_file(conn, filename)
+                    start = 0
+                if size == start:
+                    continue
+                processed += self._index_file(conn, filename, start) - start
+            for filename in set(indexed) - current:
+                self._drop_file(conn, filename)
+            conn.commit()
+        return processed
+
+    def rebuild(self):
+        """清空索引并重新处理所有结果文件"""
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM products")
+            conn.execute("DELETE FROM files")
+            conn.commit()
+        return self.sync()
+
+    def remove_file(self, filename, include_segments=False):
+        """删除某个结果文件对应的全部索引（include_segments=True 时连同历史分段）"""
+        with self._lock:
+            conn = self._connect()
+            self._drop_file(conn, filename)
+            if include_segments:
+                for name in all_segments(self.jsonl_dir).get(filename, []):
+                    self._drop_file(conn, f"{SEGMENT_DIR}/{name}")
+            conn.commit()
+
+    # ==================== 查询 ====================
+    def lookup(self, product_ids):
+        """返回 {商品ID: (文件名, 偏移)}，未收录的ID不在结果中"""
+        ids = [str(pid) for pid in product_ids]
+        result = {}
+        with self._lock:
+            conn = self._connect()
+            # SQLite 单条语句参数数量有限，分批查询
+            for i in range(0, len(ids), 500):
+                batch = ids[i:i + 500]
+                placeholders = ','.join('?' * len(batch))
+                for product_id, filename, offset in conn.execute(
+                    f"SELECT product_id, filename, offset FROM products WHERE product_id IN ({placeholders})",
+                    batch
+                ):
+                    result[product_id] = (filename, offset)
+        return result
+
+    def fetch(self, product_ids):
+        """按商品ID读取完整记录，按传入顺序返回找到的商品"""
+        locations = self.lookup(product_ids)
+
+        by_file = {}
+        for product_id, (filename, offset) in locations.items():
+            by_file.setdefault(filename, []).append((offset, product_id))
+
+        found = {}
+        for filename, entries in by_file.items():
+            filepath = os.path.join(self.jsonl_dir, filename)
+            segment = filename.startswith(SEGMENT_DIR + '/')
+            try:
+                with (open_source(filepath) if segment else open(filepath, 'rb')) as f:
+                    position = 0
+                    for offset, product_id in sorted(entries):
+                        if segment:
+                            # 压缩流只能顺序向后读取
+                            skip_bytes(f, offset - position)
+                        else:
+                            f.seek(offset)
+                        line = f.readline()
+                        position = offset + len(line)
+                        try:
+                            record = json.loads(line)
+                        except (json.JSONDecodeError, UnicodeDecodeError):
+                            continue
+                        # 偏移已失效（文件被替换）时跳过，下次同步会修正
+                        if extract_product_id(record) == product_id:
+                            found[product_id] = record
+            except (OSError, EOFError, RuntimeError) as e:
+                print(f"读取文件 {filepath} 时出错: {e}")
+
+        return [found[str(pid)] for pid in product_ids if str(pid) in found]
+
+    def count(self):
+        with self._lock:
+            return self._connect().execute("SELECT COUNT(*) FROM products").fetchone()[0]
+
+
+# ==================== 命令行 ====================
+def _write_fake_results(jsonl_dir, total, per_file=50000):
+    """生成用于基准测试的模拟结果文件"""
+    seller_block = {'卖家昵称': '测试卖家', '卖家收到的评价列表': ['好评'] * 20}
+    written = 0
+    file_no = 0
+    while written < total:
+        path = os.path.join(jsonl_dir, f"bench{file_no}{RESULT_FILE_SUFFIX}")
+        with open(path, 'w', encoding='utf-8') as f:
+            for _ in range(min(per_file, total - written)):
+                record = {
+                    '商品信息': {'商品ID': str(written), '商品标题': f'测试商品 {written}', '当前售价': '¥100'},
+                    '卖家信息': seller_block,
+                }
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                written += 1
+        file_no += 1
+
+
+def run_benchmark(sizes=(10000, 100000, 500000), lookups=20, rounds=50):
+    """对比不同数据量下一次推送查询（默认20个商品）的耗时"""
+    print(f"{'记录数':>10} {'建索引(s)':>10} {'查询(ms)':>10}")
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            _write_fake_results(tmp, size)
+            index = ProductIndex(tmp)
+            start = time.perf_counter()
+            index.rebuild()
+            build_time = time.perf_counter() - start
+
+            step = max(size // lookups, 1)
+            ids = [str(i) for i in range(0, size, step)][:lookups]
+            start = time.perf_counter()
+            for _ in range(rounds):
+                index.sync()
+                records = index.fetch(ids)
+            query_ms = (time.perf_counter() - start) / rounds * 1000
+            assert len(records) == len(ids)
+            index.close()
+            print(f"{size:>10} {build_time:>10.2f} {query_ms:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='商品ID索引工具')
+    parser.add_argument('command', choices=['rebuild', 'sync', 'bench'], help='rebuild=重建索引, sync=增量同步, bench=基准测试')
+    parser.add_argument('--dir', type=str, help='结果目录（默认使用配置中的 JSONL_OUTPUT_DIR）')
+    parser.add_argument('--sizes', type=str, default='10000,100000,500000', help='基准测试的数据量，逗号分隔')
+    args = parser.parse_args()
+
+    if args.command == 'bench':
+        run_benchmark(sizes=[int(s) for s in args.sizes.split(',') if s])
+        return
+
+    jsonl_dir = args.dir
+    if not jsonl_dir:
+        from src.config import JSONL_OUTPUT_DIR
+        jsonl_dir = JSONL_OUTPUT_DIR
+
+    index = ProductIndex(jsonl_dir)
+    start = time.perf_counter()
+    processed = index.rebuild() if args.command == 'rebuild' else index.sync()
+    print(f"已处理 {processed} 字节，共索引 {index.count()} 个商品，耗时 {time.perf_counter() - start:.2f}s")
+    index.close()
+
+
+if __name__ == '__main__':
+    main()
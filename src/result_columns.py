@@ -0,0 +1,315 @@
+"""
+结果列式快照模块
+把 *_full_data.jsonl（含历史分段）中常用于统计的字段转换为按列存储的文件，
+查询价格分布、卖家分布时不再逐行解析嵌套的 商品信息/卖家信息 JSON。
+
+每个结果文件对应 .columns/<文件名>/ 目录:
+    product_id.txt    商品ID（每行一个）
+    seller.txt        卖家昵称（每行一个）
+    price.f64         当前售价（float64，无法解析为 NaN）
+    crawled_at.f64    爬取时间（Unix 时间戳，float64）
+    meta.json         已处理到的来源位置和各列文件大小
+
+活动分段追加时只转换新增的行；发生滚动或历史分段被清理时整体重建。
+安装了 numpy 时聚合计算使用向量化实现，否则退回纯 Python。
+"""
+import json
+import math
+import os
+import shutil
+import statistics
+import threading
+import time
+from array import array
+from datetime import datetime
+
+try:
+    import numpy as np
+except ImportError:  # 可选依赖
+    np = None
+
+from src.result_segments import list_segments, open_source, segment_dir
+from src.result_store import parse_price
+
+COLUMNS_DIR = '.columns'
+FLOAT_COLUMNS = ('price', 'crawled_at')
+TEXT_COLUMNS = ('product_id', 'seller')
+_COLUMN_FILES = {'price': 'price.f64', 'crawled_at': 'crawled_at.f64',
+                 'product_id': 'product_id.txt', 'seller': 'seller.txt'}
+
+
+def _to_timestamp(value):
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def extract_columns(record):
+    """从一条结果记录中取出列值 (product_id, seller, price, crawled_at)"""
+    product_info = record.get('商品信息') or {}
+    seller_info = record.get('卖家信息') or {}
+    price = parse_price(product_info.get('当前售价'))
+    seller = product_info.get('卖家昵称') or seller_info.get('卖家昵称') or ''
+    return (
+        str(product_info.get('商品ID') or ''),
+        str(seller).replace('\n', ' '),
+        math.nan if price is None else price,
+        _to_timestamp(record.get('爬取时间')),
+    )
+
+
+def _percentile(sorted_values, q):
+    """线性插值分位数（与 numpy.percentile 默认方式一致）"""
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * q / 100
+    low = math.floor(position)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (position - low)
+
+
+class ColumnStore:
+    """结果文件的列式快照（按文件增量维护，内存中缓存已加载的列）"""
+
+    def __init__(self, jsonl_dir):
+        self.jsonl_dir = jsonl_dir
+        self.root = os.path.join(jsonl_dir, COLUMNS_DIR)
+        self._lock = threading.Lock()
+        # filename -> (meta, columns)
+        self._loaded = {}
+
+    def _dir(self, filename):
+        return os.path.join(self.root, filename)
+
+    def _read_meta(self, filename):
+        try:
+            with open(os.path.join(self._dir(filename), 'meta.json'), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, filename, meta):
+        path = os.path.join(self._dir(filename), 'meta.json')
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(path + '.tmp', path)
+
+    # ==================== 转换 ====================
+    def _append_rows(self, filename, rows, sizes):
+        """把解析出的行追加到各列文件（先截断到 meta 记录的大小，丢弃中断写入的残留），返回新的文件大小"""
+        directory = self._dir(filename)
+        new_sizes = {}
+        for i, column in enumerate(TEXT_COLUMNS + FLOAT_COLUMNS):
+            path = os.path.join(directory, _COLUMN_FILES[column])
+            values = [row[i] for row in rows]
+            with open(path, 'ab') as f:
+                f.truncate(sizes.get(column, 0))
+                if column in TEXT_COLUMNS:
+                    f.write(''.join(value + '\n' for value in values).encode('utf-8'))
+                else:
+                    array('d', values).tofile(f)
+                new_sizes[column] = f.tell()
+        return new_sizes
+
+    @staticmethod
+    def _parse(lines):
+        rows = []
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                rows.append(extract_columns(json.loads(line)))
+            except (json.JSONDecodeError, UnicodeDecodeError, AttributeError):
+                continue
+        return rows
+
+    def refresh(self, filename):
+        """把结果文件同步到列式快照，返回本次新增的行数"""
+        with self._lock:
+            segments = list_segments(self.jsonl_dir, filename)
+            active = os.path.join(self.jsonl_dir, filename)
+            try:
+                stat = os.stat(active)
+                active_ino, active_size = stat.st_ino, stat.st_size
+            except OSError:
+                active_ino, active_size = None, 0
+
+            meta = self._read_meta(filename)
+            incremental = (
+                meta is not None and meta['segments'] == segments
+                and meta['active_ino'] == active_ino and meta['active_offset'] <= active_size
+            )
+            if not incremental:
+                # 首次转换或来源发生滚动/清理，整体重建
+                shutil.rmtree(self._dir(filename), ignore_errors=True)
+                os.makedirs(self._dir(filename), exist_ok=True)
+                meta = {'segments': segments, 'active_ino': active_ino, 'active_offset': 0, 'rows': 0,
+                        'sizes': self._append_rows(filename, [], {})}
+                for name in segments:
+                    with open_source(os.path.join(segment_dir(self.jsonl_dir), name)) as f:
+                        while True:
+                            lines = f.readlines(8 * 1024 * 1024)
+                            if not lines:
+                                break
+                            rows = self._parse(lines)
+                            meta['sizes'] = self._append_rows(filename, rows, meta['sizes'])
+                            meta['rows'] += len(rows)
+
+            added = 0
+            if active_ino is not None and active_size > meta['active_offset']:
+                with open(active, 'rb') as f:
+                    f.seek(meta['active_offset'])
+                    data = f.read(active_size - meta['active_offset'])
+                # 最后一行可能正在写入，留到下次处理
+                complete = data[:data.rfind(b'\n') + 1]
+                rows = self._parse(complete.splitlines())
+                meta['sizes'] = self._append_rows(filename, rows, meta['sizes'])
+                meta['active_offset'] += len(complete)
+                meta['rows'] += len(rows)
+                added = len(rows)
+
+            self._write_meta(filename, meta)
+            if not incremental:
+                added = meta['rows']
+            return added
+
+    def remove(self, filename):
+        with self._lock:
+            shutil.rmtree(self._dir(filename), ignore_errors=True)
+            self._loaded.pop(filename, None)
+
+    # ==================== 读取 ====================
+    def load(self, filename):
+        """读取列数据，返回 {列名: 数组}（有 numpy 时为 ndarray，否则为 array/list）"""
+        with self._lock:
+            meta = self._read_meta(filename)
+            if meta is None:
+                return None
+            cached = self._loaded.get(filename)
+            if cached and cached[0] == meta:
+                return cached[1]
+
+            directory = self._dir(filename)
+            rows = meta['rows']
+            columns = {}
+            for column in FLOAT_COLUMNS:
+                path = os.path.join(directory, _COLUMN_FILES[column])
+                if np is not None:
+                    columns[column] = np.fromfile(path, dtype=np.float64, count=rows)
+                else:
+                    values = array('d')
+                    with open(path, 'rb') as f:
+                        values.fromfile(f, rows)
+                    columns[column] = values
+            for column in TEXT_COLUMNS:
+                with open(os.path.join(directory, _COLUMN_FILES[column]), 'rb') as f:
+                    values = f.read().decode('utf-8').split('\n')[:rows]
+                columns[column] = np.array(values, dtype=object) if np is not None else values
+            self._loaded[filename] = (meta, columns)
+            return columns
+
+    # ==================== 聚合 ====================
+    def stats(self, filename, since=None, until=None, seller=None, percentiles=(10, 25, 75, 90), bins=20, top=10):
+        """
+        价格/卖家聚合统计
+
+        参数:
+        - since / until: 爬取时间窗口（datetime）
+        - seller: 卖家昵称（包含匹配）
+        - percentiles: 需要计算的价格分位数
+        - bins: 价格直方图的分箱数
+        - top: 返回记录数最多的前 N 个卖家
+        """
+        start = time.perf_counter()
+        self.refresh(filename)
+        columns = self.load(filename)
+        since_ts = since.timestamp() if since else None
+        until_ts = until.timestamp() if until else None
+        compute = self._stats_numpy if np is not None else self._stats_python
+        result = compute(columns, since_ts, until_ts, seller, percentiles, bins, top)
+        result['filename'] = filename
+        result['rows'] = len(columns['price'])
+        result['elapsed_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        return result
+
+    @staticmethod
+    def _summary(count, prices_sorted, percentiles, mean, histogram, sellers, crawled):
+        price = None
+        if prices_sorted is not None and len(prices_sorted):
+            price = {
+                'min': float(prices_sorted[0]),
+                'max': float(prices_sorted[-1]),
+                'mean': round(float(mean), 2),
+                'median': float(_percentile(prices_sorted, 50)),
+                'percentiles': {f"p{q}": float(_percentile(prices_sorted, q)) for q in percentiles},
+            }
+        return {
+            'matched': count,
+            'priced': 0 if prices_sorted is None else len(prices_sorted),
+            'price': price,
+            'histogram': histogram,
+            'top_sellers': sellers,
+            'first_crawled': datetime.fromtimestamp(crawled[0]).isoformat() if crawled else None,
+            'last_crawled': datetime.fromtimestamp(crawled[1]).isoformat() if crawled else None,
+        }
+
+    def _stats_numpy(self, columns, since_ts, until_ts, seller, percentiles, bins, top):
+        price = columns['price']
+        crawled_at = columns['crawled_at']
+        mask = np.ones(len(price), dtype=bool)
+        if since_ts is not None:
+            mask &= crawled_at >= since_ts
+        if until_ts is not None:
+            mask &= crawled_at <= until_ts
+        if seller:
+            mask &= np.fromiter((seller in name for name in columns['seller']), dtype=bool, count=len(price))
+
+        prices = np.sort(price[mask & ~np.isnan(price)])
+        histogram = None
+        if len(prices):
+            counts, edges = np.histogram(prices, bins=bins)
+            histogram = {'edges': [round(float(e), 2) for e in edges], 'counts': counts.tolist()}
+
+        names, counts = np.unique(columns['seller'][mask], return_counts=True)
+        order = np.argsort(-counts, kind='stable')[:top]
+        sellers = [{'seller': names[i], 'count': int(counts[i])} for i in order if names[i]]
+
+        times = crawled_at[mask & ~np.isnan(crawled_at)]
+        crawled = (float(times.min()), float(times.max())) if len(times) else None
+        return self._summary(int(mask.sum()), prices, percentiles, prices.mean() if len(prices) else 0,
+                             histogram, sellers, crawled)
+
+    def _stats_python(self, columns, since_ts, until_ts, seller, percentiles, bins, top):
+        selected = []
+        for i, crawled_at in enumerate(columns['crawled_at']):
+            if since_ts is not None and not crawled_at >= since_ts:
+                continue
+            if until_ts is not None and not crawled_at <= until_ts:
+                continue
+            if seller and seller not in columns['seller'][i]:
+                continue
+            selected.append(i)
+
+        prices = sorted(columns['price'][i] for i in selected if not math.isnan(columns['price'][i]))
+        histogram = None
+        if prices:
+            low, high = prices[0], prices[-1]
+            width = (high - low) / bins or 1
+            counts = [0] * bins
+            for value in prices:
+                counts[min(int((value - low) / width), bins - 1)] += 1
+            histogram = {'edges': [round(low + width * i, 2) for i in range(bins + 1)], 'counts': counts}
+
+        seller_counts = {}
+        for i in selected:
+            name = columns['seller'][i]
+            if name:
+                seller_counts[name] = seller_counts.get(name, 0) + 1
+        ranked = sorted(seller_counts.items(), key=lambda item: -item[1])[:top]
+        sellers = [{'seller': name, 'count': count} for name, count in ranked]
+
+        times = [columns['crawled_at'][i] for i in selected if not math.isnan(columns['crawled_at'][i])]
+        crawled = (min(times), max(times)) if times else None
+        return self._summary(len(selected), prices, percentiles, statistics.fmean(prices) if prices else 0,
+                             histogram, sellers, crawled)
@@ -0,0 +1,472 @@
+"""
+结果文件分段存储
+*_full_data.jsonl 超过大小（或时间）阈值后滚动为压缩分段，保存在结果目录的 segments/ 下:
+
+    jsonl/手机_full_data.jsonl                                  # 活动分段（爬虫追加写入）
+    jsonl/segments/手机_full_data.20261017-120000.jsonl.gz      # 已压缩的历史分段
+
+读取时按 历史分段（由旧到新）→ 活动分段 的顺序拼接，对调用方透明。
+历史分段可按保留天数或保留个数自动清理。
+
+ResultWriter 追加时持有该文件的追加锁（jsonl/.<文件名>.lock），后台维护只在拿到锁时滚动；
+不经过 ResultWriter 写入的进程无法感知，因此最近 RESULT_ROTATE_IDLE_SECONDS 秒内修改过的文件也不滚动。
+滚动中途退出留下的 .rotating 文件在下次维护时补完压缩。
+
+ResultWriter 每写入一条记录后调用当前运行的记录回调（set_current_record_hook，由 main.py 设置，
+如提醒规则引擎），在写入之后、不持有追加锁时调用。
+
+压缩格式默认 gzip；安装了 zstandard 且 RESULT_COMPRESSION=zstd 时使用 zstd。
+
+命令行用法:
+    python -m src.result_segments maintain       # 滚动超过阈值的文件并执行保留策略
+    python -m src.result_segments rotate --file 手机_full_data.jsonl
+"""
+import argparse
+import contextvars
+import gzip
+import io
+import json
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+if sys.platform == 'win32':
+    import msvcrt
+else:
+    import fcntl
+
+try:
+    import zstandard
+except ImportError:  # 可选依赖，未安装时只使用 gzip
+    zstandard = None
+
+RESULT_FILE_SUFFIX = '_full_data.jsonl'
+SEGMENT_DIR = 'segments'
+SEGMENT_EXTENSIONS = {'gzip': '.jsonl.gz', 'zstd': '.jsonl.zst'}
+_SEGMENT_PATTERN = re.compile(r'^(?P<base>.+_full_data)\.(?P<stamp>\d{8}-\d{6})(?:-\d+)?\.jsonl\.(?:gz|zst)$')
+_PENDING_PATTERN = re.compile(r'^\.(?P<name>.+)\.rotating$')
+
+# 当前这次爬取中每保存一条记录后调用的回调 hook(record)（由 main.py 在开始爬取前设置）
+_current_record_hook = contextvars.ContextVar('record_hook', default=None)
+
+
+def get_current_record_hook():
+    """返回当前爬取的记录回调，没有时返回 None"""
+    return _current_record_hook.get()
+
+
+def set_current_record_hook(hook):
+    _current_record_hook.set(hook)
+
+
+def rotation_settings():
+    """从环境变量读取分段滚动和保留配置"""
+    return {
+        'max_bytes': int(float(os.getenv('RESULT_ROTATE_MB', '64')) * 1024 * 1024),
+        'max_age_hours': float(os.getenv('RESULT_ROTATE_HOURS', '0')),
+        'compression': os.getenv('RESULT_COMPRESSION', 'gzip').strip().lower(),
+        'retention_days': float(os.getenv('RESULT_RETENTION_DAYS', '0')),
+        'retention_segments': int(os.getenv('RESULT_RETENTION_SEGMENTS', '0')),
+        'idle_seconds': float(os.getenv('RESULT_ROTATE_IDLE_SECONDS', '300')),
+    }
+
+
+class AppendLock:
+    """结果文件的跨进程追加锁（写入方追加时持有，后台滚动前非阻塞尝试）"""
+
+    def __init__(self, jsonl_dir, filename):
+        self.path = os.path.join(jsonl_dir, f".{filename}.lock")
+        self._handle = None
+
+    def acquire(self, blocking=True):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        handle = open(self.path, 'a+')
+        try:
+            if sys.platform == 'win32':
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+            else:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except OSError:
+            handle.close()
+            return False
+        self._handle = handle
+        return True
+
+    def release(self):
+        if self._handle is None:
+            return
+        try:
+            if sys.platform == 'win32':
+                self._handle.seek(0)
+                msvcrt.locking(self._handle.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(self._handle.fileno(), fcntl.LOCK_UN)
+        finally:
+            self._handle.close()
+            self._handle = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+# ==================== 分段列表 ====================
+def segment_dir(jsonl_dir):
+    return os.path.join(jsonl_dir, SEGMENT_DIR)
+
+
+def all_segments(jsonl_dir):
+    """返回 {结果文件名: [分段文件名（由旧到新）]}"""
+    directory = segment_dir(jsonl_dir)
+    if not os.path.isdir(directory):
+        return {}
+    groups = {}
+    for name in os.listdir(directory):
+        match = _SEGMENT_PATTERN.match(name)
+        if match:
+            groups.setdefault(match.group('base') + '.jsonl', []).append(name)
+    for names in groups.values():
+        names.sort()
+    return groups
+
+
+def list_segments(jsonl_dir, filename):
+    """返回某个结果文件的所有历史分段文件名（由旧到新）"""
+    return all_segments(jsonl_dir).get(filename, [])
+
+
+def list_segmented_files(jsonl_dir):
+    """返回拥有历史分段的结果文件名（活动分段可能尚不存在）"""
+    return list(all_segments(jsonl_dir))
+
+
+def active_generation(jsonl_dir, filename):
+    """
+    活动分段的代数标识（最新历史分段的文件名，没有分段时为空字符串）
+
+    每次滚动都会产生新的历史分段，标识随之变化。旧文件压缩后立即删除，新活动分段常会复用它的 inode，
+    因此按偏移缓存活动分段的存储应以 (inode, 代数) 判断文件是否被滚动，而不能只看 inode。
+    """
+    segments = list_segments(jsonl_dir, filename)
+    return segments[-1] if segments else ''
+
+
+def segment_time(name):
+    """分段文件名中的滚动时间"""
+    match = _SEGMENT_PATTERN.match(name)
+    return datetime.strptime(match.group('stamp'), '%Y%m%d-%H%M%S') if match else None
+
+
+def source_paths(jsonl_dir, filename):
+    """返回组成一个结果文件的所有物理文件路径（历史分段在前，活动分段在后）"""
+    paths = [os.path.join(segment_dir(jsonl_dir), name) for name in list_segments(jsonl_dir, filename)]
+    active = os.path.join(jsonl_dir, filename)
+    if os.path.exists(active):
+        paths.append(active)
+    return paths
+
+
+def is_segment_path(path):
+    return path.endswith('.gz') or path.endswith('.zst')
+
+
+def open_source(path):
+    """以二进制方式打开结果文件或压缩分段（支持 readline/迭代）"""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.zst'):
+        if zstandard is None:
+            raise RuntimeError(f"读取 {os.path.basename(path)} 需要安装 zstandard")
+        raw = open(path, 'rb')
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(raw, closefd=True))
+    return open(path, 'rb')
+
+
+def skip_bytes(f, count):
+    """在压缩流中向后跳过 count 字节（压缩流不支持随机定位）"""
+    while count > 0:
+        chunk = f.read(min(count, 1024 * 1024))
+        if not chunk:
+            break
+        count -= len(chunk)
+
+
+# 历史分段不会再变化，行数按 (路径, 大小, 修改时间) 缓存
+_line_counts = {}
+_line_counts_lock = threading.Lock()
+
+
+def segment_line_count(path):
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime)
+    with _line_counts_lock:
+        if key in _line_counts:
+            return _line_counts[key]
+    with open_source(path) as f:
+        count = sum(1 for _ in f)
+    with _line_counts_lock:
+        _line_counts[key] = count
+    return count
+
+
+def read_segment_lines(path, start, count):
+    """读取分段中第 start 行开始的至多 count 行"""
+    lines = []
+    if count <= 0:
+        return lines
+    with open_source(path) as f:
+        for line_no, line in enumerate(f):
+            if line_no < start:
+                continue
+            lines.append(line)
+            if len(lines) >= count:
+                break
+    return lines
+
+
+# ==================== 滚动 ====================
+def _first_record_time(path):
+    """读取文件第一条记录的爬取时间，无法读取时返回 None"""
+    try:
+        with open(path, 'rb') as f:
+            return datetime.fromisoformat(json.loads(f.readline()).get('爬取时间', ''))
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def should_rotate(path, max_bytes=0, max_age_hours=0):
+    """活动分段是否达到滚动条件（大小超过 max_bytes，或第一条记录早于 max_age_hours 小时）"""
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return False
+    if size == 0:
+        return False
+    if max_bytes and size >= max_bytes:
+        return True
+    if max_age_hours:
+        first = _first_record_time(path)
+        if first is not None and datetime.now() - first >= timedelta(hours=max_age_hours):
+            return True
+    return False
+
+
+def _compress(src, dest, compression):
+    tmp = dest + '.tmp'
+    with open(src, 'rb') as fin:
+        if compression == 'zstd':
+            with open(tmp, 'wb') as raw:
+                with zstandard.ZstdCompressor(level=10).stream_writer(raw) as fout:
+                    shutil.copyfileobj(fin, fout, 1024 * 1024)
+        else:
+            with gzip.open(tmp, 'wb', compresslevel=6) as fout:
+                shutil.copyfileobj(fin, fout, 1024 * 1024)
+    os.replace(tmp, dest)
+
+
+def rotate(jsonl_dir, filename, compression='gzip'):
+    """
+    把活动分段滚动为压缩的历史分段，返回新分段文件名（文件为空或不存在时返回 None）
+
+    调用方须持有该文件的追加锁（AppendLock），且没有其他进程正打开该文件追加。
+    商品索引等按偏移引用活动分段的存储通过新出现的历史分段发现滚动（见 active_generation），
+    调用方也可以在滚动后主动让其失效。
+    """
+    active = os.path.join(jsonl_dir, filename)
+    if not os.path.exists(active) or os.path.getsize(active) == 0:
+        return None
+    if compression == 'zstd' and zstandard is None:
+        print("[结果分段] 未安装 zstandard，使用 gzip 压缩")
+        compression = 'gzip'
+
+    directory = segment_dir(jsonl_dir)
+    os.makedirs(directory, exist_ok=True)
+    base = filename[:-len('.jsonl')]
+    stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+    name = f"{base}.{stamp}{SEGMENT_EXTENSIONS[compression]}"
+    suffix = 1
+    while os.path.exists(os.path.join(directory, name)):
+        name = f"{base}.{stamp}-{suffix}{SEGMENT_EXTENSIONS[compression]}"
+        suffix += 1
+
+    # 先移走活动分段，新的写入会创建新文件
+    pending = os.path.join(directory, f".{name}.rotating")
+    os.replace(active, pending)
+
+    _compress(pending, os.path.join(directory, name), compression)
+    os.remove(pending)
+    return name
+
+
+def recover_pending(jsonl_dir):
+    """补完中途失败的滚动：把残留的 .rotating 文件压缩为对应的历史分段，返回恢复的分段文件名"""
+    directory = segment_dir(jsonl_dir)
+    if not os.path.isdir(directory):
+        return []
+    recovered = []
+    for entry in sorted(os.listdir(directory)):
+        match = _PENDING_PATTERN.match(entry)
+        if not match or not _SEGMENT_PATTERN.match(match.group('name')):
+            continue
+        name = match.group('name')
+        pending = os.path.join(directory, entry)
+        target = os.path.join(directory, name)
+        compression = 'zstd' if name.endswith('.zst') else 'gzip'
+        try:
+            if not os.path.exists(target):
+                if compression == 'zstd' and zstandard is None:
+                    print(f"[结果分段] 恢复 {name} 需要安装 zstandard")
+                    continue
+                # 压缩结果先写入 .tmp 再改名，目标存在即说明压缩已完成
+                _compress(pending, target, compression)
+            os.remove(pending)
+            recovered.append(name)
+            print(f"[结果分段] 已恢复中断的滚动: {name}")
+        except OSError as e:
+            print(f"[结果分段] 恢复 {name} 失败: {e}")
+    return recovered
+
+
+def apply_retention(jsonl_dir, filename, retention_days=0, retention_segments=0):
+    """按保留天数/保留个数删除旧的历史分段，返回被删除的分段文件名"""
+    segments = list_segments(jsonl_dir, filename)
+    removed = []
+    if retention_days:
+        cutoff = datetime.now() - timedelta(days=retention_days)
+        removed += [name for name in segments if segment_time(name) < cutoff]
+    if retention_segments and len(segments) > retention_segments:
+        removed += segments[:len(segments) - retention_segments]
+    removed = sorted(set(removed))
+    for name in removed:
+        try:
+            os.remove(os.path.join(segment_dir(jsonl_dir), name))
+        except OSError as e:
+            print(f"[结果分段] 删除 {name} 失败: {e}")
+    return removed
+
+
+def remove_all_segments(jsonl_dir, filename):
+    """删除某个结果文件的全部历史分段"""
+    for name in list_segments(jsonl_dir, filename):
+        os.remove(os.path.join(segment_dir(jsonl_dir), name))
+
+
+def maintain(jsonl_dir, busy_files=(), settings=None):
+    """
+    滚动达到阈值的活动分段，并对所有结果文件执行保留策略
+
+    以下文件本轮不滚动：busy_files 中的文件、追加锁被占用的文件、最近 idle_seconds 秒内修改过的文件
+    （不经过 ResultWriter、长期打开文件追加的写入方无法用锁感知）。
+
+    返回 {'rotated': [新分段文件名], 'rotated_files': [被滚动的结果文件名], 'removed': [...], 'recovered': [...]}
+    """
+    settings = dict(rotation_settings(), **(settings or {}))
+    result = {'rotated': [], 'rotated_files': [], 'removed': [], 'recovered': []}
+    if not os.path.isdir(jsonl_dir):
+        return result
+    result['recovered'] = recover_pending(jsonl_dir)
+
+    filenames = {name for name in os.listdir(jsonl_dir) if name.endswith(RESULT_FILE_SUFFIX)}
+    for filename in sorted(filenames):
+        if filename in busy_files:
+            continue
+        path = os.path.join(jsonl_dir, filename)
+        if not should_rotate(path, settings['max_bytes'], settings['max_age_hours']):
+            continue
+        try:
+            if time.time() - os.path.getmtime(path) < settings['idle_seconds']:
+                continue
+        except OSError:
+            continue
+        lock = AppendLock(jsonl_dir, filename)
+        if not lock.acquire(blocking=False):
+            continue
+        try:
+            name = rotate(jsonl_dir, filename, settings['compression'])
+        finally:
+            lock.release()
+        if name:
+            result['rotated'].append(name)
+            result['rotated_files'].append(filename)
+            print(f"[结果分段] {filename} 已滚动为 {name}")
+
+    if settings['retention_days'] or settings['retention_segments']:
+        for filename in sorted(filenames | set(list_segmented_files(jsonl_dir))):
+            removed = apply_retention(jsonl_dir, filename, settings['retention_days'], settings['retention_segments'])
+            result['removed'] += removed
+            for name in removed:
+                print(f"[结果分段] 已按保留策略删除 {name}")
+    return result
+
+
+# ==================== 写入 ====================
+class ResultWriter:
+    """
+    结果写入器（供爬虫使用）：追加写入活动分段，达到阈值后自动滚动
+
+        writer = ResultWriter(JSONL_OUTPUT_DIR, keyword)
+        writer.append(record)
+    """
+
+    def __init__(self, jsonl_dir, keyword, settings=None):
+        self.jsonl_dir = jsonl_dir
+        self.filename = f"{keyword}{RESULT_FILE_SUFFIX}"
+        self.path = os.path.join(jsonl_dir, self.filename)
+        self.settings = dict(rotation_settings(), **(settings or {}))
+        self._lock = AppendLock(jsonl_dir, self.filename)
+
+    def append(self, record):
+        """追加一条记录并调用当前运行的记录回调，返回该行在活动分段中的起始字节偏移（追加和滚动期间持有追加锁）"""
+        line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+        os.makedirs(self.jsonl_dir, exist_ok=True)
+        with self._lock:
+            with open(self.path, 'ab') as f:
+                offset = f.tell()
+                f.write(line)
+            if should_rotate(self.path, self.settings['max_bytes'], self.settings['max_age_hours']):
+                name = rotate(self.jsonl_dir, self.filename, self.settings['compression'])
+                if name:
+                    print(f"[结果分段] {self.filename} 已滚动为 {name}")
+        hook = get_current_record_hook()
+        if hook is not None:
+            try:
+                hook(record)
+            except Exception as e:
+                # 回调失败不影响已写入的记录
+                print(f"[结果分段] 记录回调失败: {e}")
+        return offset
+
+
+def main():
+    parser = argparse.ArgumentParser(description='结果文件分段工具')
+    parser.add_argument('command', choices=['maintain', 'rotate'], help='maintain=按配置滚动并清理, rotate=立即滚动指定文件')
+    parser.add_argument('--dir', type=str, help='结果目录（默认使用配置中的 JSONL_OUTPUT_DIR）')
+    parser.add_argument('--file', type=str, help='rotate 时指定结果文件名')
+    args = parser.parse_args()
+
+    jsonl_dir = args.dir
+    if not jsonl_dir:
+        from src.config import JSONL_OUTPUT_DIR
+        jsonl_dir = JSONL_OUTPUT_DIR
+
+    if args.command == 'rotate':
+        if not args.file:
+            parser.error('rotate 需要 --file')
+        with AppendLock(jsonl_dir, args.file):
+            name = rotate(jsonl_dir, args.file, rotation_settings()['compression'])
+        print(f"已滚动为 {name}" if name else "文件为空或不存在，无需滚动")
+    else:
+        result = maintain(jsonl_dir)
+        print(f"滚动 {len(result['rotated'])} 个文件，删除 {len(result['removed'])} 个历史分段")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,557 @@
+"""
+结果文件读取模块
+为 Web 界面提供结果文件的统计信息缓存和分页读取，避免每次请求都重新读取整个文件。
+一个结果文件由若干压缩的历史分段和一个活动分段组成（见 result_segments），读取时透明拼接。
+"""
+import json
+import os
+import re
+import threading
+import zlib
+from datetime import datetime
+
+from src.result_segments import (active_generation, list_segmented_files, list_segments, open_source,
+                                 read_segment_lines, segment_dir, segment_line_count)
+
+RESULT_FILE_SUFFIX = '_full_data.jsonl'
+
+# 统计换行符时每次读取的块大小
+_READ_CHUNK = 1024 * 1024
+
+
+def list_result_files(jsonl_dir):
+    """返回结果目录下所有结果文件名（不读取文件内容），包括活动分段已被滚动走的文件"""
+    if not os.path.exists(jsonl_dir):
+        return []
+    names = [name for name in os.listdir(jsonl_dir) if name.endswith(RESULT_FILE_SUFFIX)]
+    return names + [name for name in list_segmented_files(jsonl_dir) if name not in names]
+
+
+def _count_newlines(f, start, end):
+    """统计文件 [start, end) 字节范围内的换行符数量"""
+    f.seek(start)
+    remaining = end - start
+    count = 0
+    while remaining > 0:
+        chunk = f.read(min(_READ_CHUNK, remaining))
+        if not chunk:
+            break
+        count += chunk.count(b'\n')
+        remaining -= len(chunk)
+    return count
+
+
+class ResultStatsCache:
+    """
+    结果文件统计缓存
+
+    以 (size, mtime) 判断活动分段是否变化：未变化直接返回缓存，
+    文件变大时只统计新追加的字节，变小（被重写）或被滚动（inode 或分段代数变化）时才完整重新统计。
+    历史分段不会再变化，行数由 result_segments 按文件缓存。
+    """
+
+    def __init__(self, jsonl_dir):
+        self.jsonl_dir = jsonl_dir
+        self._lock = threading.Lock()
+        # filename -> {'ino', 'generation', 'size', 'mtime', 'newlines', 'last_byte'}
+        self._cache = {}
+
+    def _refresh(self, filename, stat, generation):
+        cached = self._cache.get(filename)
+        same_file = cached and cached['ino'] == stat.st_ino and cached['generation'] == generation
+        if same_file and cached['size'] == stat.st_size and cached['mtime'] == stat.st_mtime:
+            return cached
+
+        start = 0
+        newlines = 0
+        # 只有同一个文件变大才视为追加；大小不变但 mtime 变化说明被重写，需要完整统计
+        if same_file and cached['size'] < stat.st_size:
+            start = cached['size']
+            newlines = cached['newlines']
+
+        filepath = os.path.join(self.jsonl_dir, filename)
+        last_byte = cached['last_byte'] if start else b''
+        with open(filepath, 'rb') as f:
+            newlines += _count_newlines(f, start, stat.st_size)
+            if stat.st_size > start:
+                f.seek(stat.st_size - 1)
+                last_byte = f.read(1)
+
+        entry = {
+            'ino': stat.st_ino,
+            'generation': generation,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'newlines': newlines,
+            'last_byte': last_byte,
+        }
+        self._cache[filename] = entry
+        return entry
+
+    def _segment_stats(self, filename):
+        """历史分段的 (记录数, 磁盘大小, 最后修改时间, 分段数)"""
+        count = size = segments = 0
+        mtime = 0
+        for name in list_segments(self.jsonl_dir, filename):
+            path = os.path.join(segment_dir(self.jsonl_dir), name)
+            try:
+                stat = os.stat(path)
+                count += segment_line_count(path)
+            except (OSError, EOFError, RuntimeError) as e:
+                print(f"[结果分段] 读取 {name} 失败: {e}")
+                continue
+            size += stat.st_size
+            mtime = max(mtime, stat.st_mtime)
+            segments += 1
+        return count, size, mtime, segments
+
+    def get_file_stats(self, filename):
+        """获取单个结果文件（含历史分段）的统计信息，文件不存在时返回 None"""
+        count, size, mtime, segments = self._segment_stats(filename)
+
+        filepath = os.path.join(self.jsonl_dir, filename)
+        entry = None
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            self.invalidate(filename)
+        else:
+            with self._lock:
+                try:
+                    entry = self._refresh(filename, stat, active_generation(self.jsonl_dir, filename))
+                except OSError:
+                    self._cache.pop(filename, None)
+
+        if entry is None and not segments:
+            return None
+        if entry is not None:
+            # 与逐行计数保持一致：末尾没有换行符的最后一行也算一条
+            count += entry['newlines']
+            if entry['size'] and entry['last_byte'] != b'\n':
+                count += 1
+            size += entry['size']
+            mtime = max(mtime, entry['mtime'])
+
+        return {
+            'filename': filename,
+            'keyword': filename.replace(RESULT_FILE_SUFFIX, ''),
+            'count': count,
+            'size': size,
+            'segments': segments,
+            'modified': datetime.fromtimestamp(mtime).strftime('%Y-%m-%d %H:%M:%S')
+        }
+
+    def list_stats(self):
+        """获取所有结果文件的统计信息，并清理已不存在文件的缓存"""
+        filenames = list_result_files(self.jsonl_dir)
+        with self._lock:
+            for stale in set(self._cache) - set(filenames):
+                del self._cache[stale]
+
+        results = []
+        for filename in filenames:
+            stats = self.get_file_stats(filename)
+            if stats:
+                results.append(stats)
+        return results
+
+    def invalidate(self, filename=None):
+        """使某个文件（或全部文件）的缓存失效"""
+        with self._lock:
+            if filename is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(filename, None)
+
+
+class LineOffsetIndex:
+    """
+    稀疏行偏移索引
+
+    每 step 行记录一次该行的起始字节偏移，定位第 N 行时先跳到最近的检查点，
+    再最多向后读取 step-1 行。索引在首次使用时建立，之后只处理新追加的内容。
+    """
+
+    def __init__(self, filepath, step=1000):
+        self.filepath = filepath
+        self.step = step
+        self.checkpoints = []
+        self.line_count = 0
+        self.indexed_size = 0
+        self.inode = None
+        self.generation = None
+
+    def update(self, generation=''):
+        """同步到文件当前大小，只索引以换行符结尾的完整行（generation 为活动分段代数，变化说明已滚动）"""
+        stat = os.stat(self.filepath)
+        size = stat.st_size
+        if size < self.indexed_size or stat.st_ino != self.inode or generation != self.generation:
+            # 文件被截断、重写或滚动，重新建立索引
+            self.checkpoints = []
+            self.line_count = 0
+            self.indexed_size = 0
+            self.inode = stat.st_ino
+            self.generation = generation
+        if size == self.indexed_size:
+            return
+
+        position = self.indexed_size
+        with open(self.filepath, 'rb') as f:
+            f.seek(position)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                if self.line_count % self.step == 0:
+                    self.checkpoints.append(position)
+                position += len(line)
+                self.line_count += 1
+        self.indexed_size = position
+
+    def locate(self, line_no):
+        """返回第 line_no 行（从0开始）的起始字节偏移"""
+        if line_no >= self.line_count:
+            return self.indexed_size
+        position = self.checkpoints[line_no // self.step]
+        skip = line_no % self.step
+        if skip:
+            with open(self.filepath, 'rb') as f:
+                f.seek(position)
+                for _ in range(skip):
+                    position += len(f.readline())
+        return position
+
+
+def _read_lines_forward(f, start, limit):
+    """从 start 开始向后读取至多 limit 行，返回 (行列表, 下一行起始偏移)"""
+    f.seek(start)
+    lines = []
+    position = start
+    while len(lines) < limit:
+        line = f.readline()
+        if not line:
+            break
+        lines.append(line)
+        position += len(line)
+    return lines, position
+
+
+def _read_lines_backward(f, end, limit):
+    """从 end 向前读取至多 limit 行，返回 (行列表（由新到旧）, 第一行起始偏移)"""
+    position = end
+    buf = b''
+    # 需要多读到一个换行符，才能确定最旧一行的起点
+    while position > 0 and buf.count(b'\n') <= limit:
+        size = min(64 * 1024, position)
+        position -= size
+        f.seek(position)
+        buf = f.read(size) + buf
+
+    trailing = 1 if buf.endswith(b'\n') else 0
+    parts = buf[:len(buf) - trailing].split(b'\n') if buf else []
+    selected = parts[-limit:] if limit else []
+    consumed = sum(len(p) for p in selected) + max(len(selected) - 1, 0) + trailing
+    return selected[::-1], end - consumed
+
+
+def _parse_lines(lines):
+    records = []
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            records.append(json.loads(line))
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            continue
+    return records
+
+
+class ResultPager:
+    """
+    结果文件分页读取
+
+    - 正序: 通过 offset（第几行）或 cursor 定位，从最旧的历史分段读到活动分段
+    - 倒序（tail）: 从活动分段末尾向前读取，读完后继续读历史分段，最新的记录在前
+    活动分段的 cursor 是字节偏移（整数），历史分段的 cursor 为 "分段文件名:行号"。
+    每页的 I/O 只与页大小有关；按 offset 跳页时使用按需建立的稀疏行索引
+    （压缩分段不支持随机定位，只能从分段开头顺序解压，I/O 受分段大小限制）。
+    """
+
+    def __init__(self, jsonl_dir, step=1000):
+        self.jsonl_dir = jsonl_dir
+        self.step = step
+        self._lock = threading.Lock()
+        self._indexes = {}
+
+    def _line_index(self, filename):
+        filepath = os.path.join(self.jsonl_dir, filename)
+        index = self._indexes.get(filename)
+        if index is None:
+            index = self._indexes[filename] = LineOffsetIndex(filepath, self.step)
+        index.update(active_generation(self.jsonl_dir, filename))
+        return index
+
+    def invalidate(self, filename=None):
+        with self._lock:
+            if filename is None:
+                self._indexes.clear()
+            else:
+                self._indexes.pop(filename, None)
+
+    def _sources(self, filename):
+        """返回 [(分段文件名 或 None, 路径)]，历史分段在前，活动分段（名称为 None）在最后"""
+        directory = segment_dir(self.jsonl_dir)
+        sources = [(name, os.path.join(directory, name)) for name in list_segments(self.jsonl_dir, filename)]
+        active = os.path.join(self.jsonl_dir, filename)
+        if os.path.exists(active):
+            sources.append((None, active))
+        if not sources:
+            raise FileNotFoundError(active)
+        return sources
+
+    def _parse_cursor(self, sources, cursor):
+        """把 cursor 转换为 (来源序号, 位置)"""
+        if isinstance(cursor, str) and ':' in cursor:
+            name, line = cursor.rsplit(':', 1)
+            for i, (segment, path) in enumerate(sources):
+                if segment == name and line.isdigit() and int(line) <= segment_line_count(path):
+                    return i, int(line)
+            raise ValueError(f"cursor 对应的历史分段不存在或已被清理: {cursor}")
+
+        segment, path = sources[-1]
+        try:
+            position = int(cursor)
+        except (TypeError, ValueError):
+            raise ValueError(f"无效的 cursor: {cursor}")
+        if segment is not None or not 0 <= position <= os.path.getsize(path):
+            raise ValueError(f"cursor 超出文件范围: {cursor}")
+        return len(sources) - 1, position
+
+    @staticmethod
+    def _encode_cursor(sources, position):
+        if position is None:
+            return None
+        i, pos = position
+        segment = sources[i][0]
+        return pos if segment is None else f"{segment}:{pos}"
+
+    def _locate(self, filename, sources, offset, reverse):
+        """按行号定位：正序返回起始位置，倒序返回结束位置（不含），超出范围返回 None"""
+        remaining = offset
+        order = range(len(sources) - 1, -1, -1) if reverse else range(len(sources))
+        for i in order:
+            segment, path = sources[i]
+            if segment is not None:
+                count = segment_line_count(path)
+                if remaining < count:
+                    return i, count - remaining if reverse else remaining
+                remaining -= count
+                continue
+            if reverse and remaining == 0:
+                return i, os.path.getsize(path)
+            with self._lock:
+                index = self._line_index(filename)
+                if reverse:
+                    if remaining < index.line_count:
+                        return i, index.locate(index.line_count - remaining)
+                    remaining -= index.line_count
+                else:
+                    return i, index.locate(remaining)
+        return None
+
+    @staticmethod
+    def _read_forward(sources, position, limit):
+        i, pos = position
+        lines = []
+        while i < len(sources) and len(lines) < limit:
+            segment, path = sources[i]
+            if segment is not None:
+                got = read_segment_lines(path, pos, limit - len(lines))
+                lines += got
+                pos += len(got)
+                if pos < segment_line_count(path):
+                    break
+            else:
+                with open(path, 'rb') as f:
+                    got, pos = _read_lines_forward(f, pos, limit - len(lines))
+                lines += got
+                if pos < os.path.getsize(path):
+                    break
+            i, pos = i + 1, 0
+        return lines, ((i, pos) if i < len(sources) else None)
+
+    @staticmethod
+    def _read_backward(sources, position, limit):
+        i, end = position
+        lines = []
+        while i >= 0 and len(lines) < limit:
+            segment, path = sources[i]
+            need = limit - len(lines)
+            if segment is not None:
+                first = max(end - need, 0)
+                lines += read_segment_lines(path, first, end - first)[::-1]
+                end = first
+            else:
+                with open(path, 'rb') as f:
+                    got, end = _read_lines_backward(f, end, need)
+                lines += got
+            if end > 0:
+                break
+            i -= 1
+            if i >= 0:
+                end = segment_line_count(sources[i][1])
+        return lines, ((i, end) if i >= 0 else None)
+
+    def read_page(self, filename, offset=0, limit=50, cursor=None, reverse=False):
+        """
+        读取一页记录
+
+        参数:
+        - offset: 跳过的行数（倒序时从末尾开始计算）
+        - limit: 每页行数
+        - cursor: 上一页返回的 next_cursor，指定后忽略 offset
+        - reverse: 是否从文件末尾向前读取
+
+        返回 (records, next_cursor)，没有更多数据时 next_cursor 为 None
+        """
+        sources = self._sources(filename)
+        offset = max(offset, 0)
+        limit = max(limit, 0)
+
+        if cursor is not None:
+            position = self._parse_cursor(sources, cursor)
+        else:
+            position = self._locate(filename, sources, offset, reverse)
+            if position is None:
+                return [], None
+
+        if reverse:
+            lines, next_position = self._read_backward(sources, position, limit)
+        else:
+            lines, next_position = self._read_forward(sources, position, limit)
+        return _parse_lines(lines), self._encode_cursor(sources, next_position)
+
+
+_PRICE_PATTERN = re.compile(r'\d+(?:\.\d+)?')
+
+
+def parse_price(value):
+    """把 '¥4500'、'1.2万'、'3,999' 之类的价格文本转换为浮点数，无法解析时返回 None"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).strip().replace('¥', '').replace('￥', '').replace(',', '')
+    multiplier = 1
+    if text.endswith('万'):
+        multiplier = 10000
+        text = text[:-1]
+    match = _PRICE_PATTERN.search(text)
+    if not match:
+        return None
+    return float(match.group()) * multiplier
+
+
+def _local_naive(value):
+    """把时间统一成不带时区的本地时间（爬取时间按本地时间写入，不带时区）"""
+    if value.tzinfo is not None:
+        return value.astimezone().replace(tzinfo=None)
+    return value
+
+
+class RecordFilter:
+    """结果记录过滤条件（价格区间、卖家、爬取时间窗口），条件在构造时解析一次"""
+
+    def __init__(self, min_price=None, max_price=None, seller=None, since=None, until=None):
+        self.min_price = min_price
+        self.max_price = max_price
+        self.seller = seller.strip() if seller else None
+        # 带时区的时间（如 2025-01-01T00:00:00Z）换算成本地时间，否则和爬取时间比较会抛 TypeError；
+        # 格式错误在这里抛 ValueError，由调用方在开始输出前返回 400
+        self.since = self._parse_time(since)
+        self.until = self._parse_time(until)
+
+    @staticmethod
+    def _parse_time(value):
+        if value is None:
+            return None
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        return _local_naive(value)
+
+    @property
+    def is_empty(self):
+        return all(v is None for v in (self.min_price, self.max_price, self.seller, self.since, self.until))
+
+    def match(self, record):
+        product_info = record.get('商品信息') or {}
+
+        if self.min_price is not None or self.max_price is not None:
+            price = parse_price(product_info.get('当前售价'))
+            if price is None:
+                return False
+            if self.min_price is not None and price < self.min_price:
+                return False
+            if self.max_price is not None and price > self.max_price:
+                return False
+
+        if self.seller:
+            seller_info = record.get('卖家信息') or {}
+            nickname = product_info.get('卖家昵称') or seller_info.get('卖家昵称') or ''
+            if self.seller not in nickname:
+                return False
+
+        if self.since is not None or self.until is not None:
+            try:
+                crawled_at = _local_naive(datetime.fromisoformat(record.get('爬取时间', '')))
+            except (TypeError, ValueError):
+                return False
+            if self.since is not None and crawled_at < self.since:
+                return False
+            if self.until is not None and crawled_at > self.until:
+                return False
+
+        return True
+
+
+def iter_export_chunks(filepaths, record_filter=None, compress=False, chunk_size=64 * 1024):
+    """
+    逐行读取结果文件（一个路径或按顺序排列的多个分段路径）并按条件过滤，输出 NDJSON 字节块（可选 gzip 压缩）
+
+    内存占用只与 chunk_size 有关，与文件大小无关；没有过滤条件时直接转发原始行，不做 JSON 解析。
+    """
+    if isinstance(filepaths, str):
+        filepaths = [filepaths]
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    buffer = []
+    buffered = 0
+
+    def emit(data):
+        return compressor.compress(data) if compressor else data
+
+    for filepath in filepaths:
+        with open_source(filepath) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                if record_filter is not None and not record_filter.is_empty:
+                    try:
+                        if not record_filter.match(json.loads(line)):
+                            continue
+                    except (json.JSONDecodeError, UnicodeDecodeError):
+                        continue
+                if not line.endswith(b'\n'):
+                    line += b'\n'
+                buffer.append(line)
+                buffered += len(line)
+                if buffered >= chunk_size:
+                    data = emit(b''.join(buffer))
+                    buffer = []
+                    buffered = 0
+                    if data:
+                        yield data
+
+    tail = emit(b''.join(buffer)) if buffer else b''
+    if compressor:
+        tail += compressor.flush()
+    if tail:
+        yield tail
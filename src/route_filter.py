@@ -0,0 +1,123 @@
+"""
+请求过滤模块
+爬虫只需要页面中被拦截的接口 JSON，图片、视频、字体和统计脚本都是无用的下载。
+RouteFilter 在浏览器上下文上注册路由，直接中止这些请求，同时放行 mtop 接口和
+滑块/风控校验相关的资源，避免影响接口调用和人机验证。
+
+通过 .env 中的 BLOCK_RESOURCES（与 RUN_HEADLESS 放在一起）开关，默认开启。
+每次运行统计被拦截的请求数、估算节省的流量和页面加载耗时。
+
+爬虫中的用法:
+    route_filter = get_current_route_filter()
+    if route_filter:
+        await route_filter.install(context)
+    await route_filter.goto(page, url)    # 记录页面加载耗时
+"""
+import contextvars
+import os
+import time
+
+# 当前这次爬取使用的过滤器（由 main.py 设置，浏览器池借出上下文时自动安装）
+_current_filter = contextvars.ContextVar('route_filter', default=None)
+
+# 默认拦截的资源类型（Playwright 的 request.resource_type）
+DEFAULT_BLOCK_TYPES = ('image', 'media', 'font')
+
+# 统计/埋点域名
+ANALYTICS_PATTERNS = (
+    'log.mmstat.com', 'gm.mmstat.com', 'wgo.mmstat.com', 'aplus', 'arms-retcode',
+    'alilog', 'hm.baidu.com', 'google-analytics.com', 'googletagmanager.com',
+)
+
+# 始终放行：接口请求和滑块/风控校验（被拦截会导致验证无法完成）
+ALWAYS_ALLOW_PATTERNS = ('mtop', 'punish', 'captcha', 'nocaptcha', 'baxia', 'umid', 'slide', '/_____tmd_____/')
+
+# 无法得知被中止请求的真实大小，按类型估算节省的流量（字节）
+ESTIMATED_SIZES = {'image': 40 * 1024, 'media': 500 * 1024, 'font': 60 * 1024, 'analytics': 20 * 1024}
+
+
+def get_current_route_filter():
+    """返回当前爬取使用的请求过滤器，未启用时返回 None"""
+    return _current_filter.get()
+
+
+def set_current_route_filter(route_filter):
+    _current_filter.set(route_filter)
+
+
+def create_route_filter():
+    """按环境变量创建过滤器，BLOCK_RESOURCES=false 时返回 None"""
+    if os.getenv('BLOCK_RESOURCES', 'true').lower() not in ['true', '1', 'yes']:
+        return None
+    types = os.getenv('BLOCK_RESOURCE_TYPES', ','.join(DEFAULT_BLOCK_TYPES))
+    block_analytics = os.getenv('BLOCK_ANALYTICS', 'true').lower() in ['true', '1', 'yes']
+    return RouteFilter([t.strip() for t in types.split(',') if t.strip()], block_analytics)
+
+
+class RouteFilter:
+    """浏览器请求过滤器"""
+
+    def __init__(self, block_types=DEFAULT_BLOCK_TYPES, block_analytics=True):
+        self.block_types = set(block_types)
+        self.block_analytics = block_analytics
+        self.blocked = {}
+        self.allowed = 0
+        self.page_loads = []
+
+    def classify(self, url, resource_type):
+        """返回请求被拦截的类别，放行时返回 None"""
+        lowered = url.lower()
+        if any(pattern in lowered for pattern in ALWAYS_ALLOW_PATTERNS):
+            return None
+        if self.block_analytics and any(pattern in lowered for pattern in ANALYTICS_PATTERNS):
+            return 'analytics'
+        if resource_type in self.block_types:
+            return resource_type
+        return None
+
+    async def _handle(self, route):
+        request = route.request
+        category = self.classify(request.url, request.resource_type)
+        if category is None:
+            self.allowed += 1
+            await route.continue_()
+        else:
+            self.blocked[category] = self.blocked.get(category, 0) + 1
+            await route.abort()
+
+    async def install(self, context):
+        """在浏览器上下文（或单个页面）上注册过滤路由"""
+        await context.route('**/*', self._handle)
+
+    async def goto(self, page, url, **kwargs):
+        """打开页面并记录加载耗时"""
+        start = time.perf_counter()
+        try:
+            return await page.goto(url, **kwargs)
+        finally:
+            self.page_loads.append(time.perf_counter() - start)
+
+    # ==================== 统计 ====================
+    @property
+    def estimated_bytes_saved(self):
+        return sum(ESTIMATED_SIZES.get(category, 0) * count for category, count in self.blocked.items())
+
+    def get_stats(self):
+        loads = self.page_loads
+        return {
+            'blocked': dict(self.blocked),
+            'blocked_total': sum(self.blocked.values()),
+            'allowed': self.allowed,
+            'estimated_bytes_saved': self.estimated_bytes_saved,
+            'page_loads': len(loads),
+            'avg_page_load_seconds': round(sum(loads) / len(loads), 2) if loads else None,
+        }
+
+    def summary(self):
+        stats = self.get_stats()
+        detail = '，'.join(f"{category} {count}" for category, count in sorted(stats['blocked'].items()))
+        text = (f"拦截请求 {stats['blocked_total']} 个（{detail or '无'}），"
+                f"约节省 {stats['estimated_bytes_saved'] / 1024 / 1024:.1f} MB")
+        if stats['avg_page_load_seconds'] is not None:
+            text += f"，{stats['page_loads']} 次页面加载平均 {stats['avg_page_load_seconds']} 秒"
+        return text
@@ -0,0 +1,140 @@
+"""
+任务调度器
+使用APScheduler按任务的 cron_expression 定时启动任务：
+- 同一任务上一次运行尚未结束时跳过本次触发，避免重叠运行
+- 触发时间加入随机抖动，避免大量任务在同一秒启动浏览器
+"""
+import re
+
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.cron import CronTrigger
+
+# crontab 星期字段: 0/7=周日, 1=周一 ... 6=周六；APScheduler: 0=周一 ... 6=周日
+_CRON_WEEKDAY_NAMES = {'sun': 0, 'mon': 1, 'tue': 2, 'wed': 3, 'thu': 4, 'fri': 5, 'sat': 6}
+
+
+def _convert_day_of_week(field):
+    """把 crontab 的星期字段转换为 APScheduler 的星期编号列表"""
+    if field in ('*', '?'):
+        return '*'
+
+    days = set()
+    for part in field.lower().split(','):
+        step = 1
+        if '/' in part:
+            part, step_text = part.split('/', 1)
+            step = int(step_text)
+        if part in ('*', ''):
+            start, end = 0, 6
+        elif '-' in part:
+            start_text, end_text = part.split('-', 1)
+            start = _CRON_WEEKDAY_NAMES.get(start_text, None)
+            start = int(start_text) if start is None else start
+            end = _CRON_WEEKDAY_NAMES.get(end_text, None)
+            end = int(end_text) if end is None else end
+        else:
+            start = _CRON_WEEKDAY_NAMES.get(part, None)
+            start = int(part) if start is None else start
+            end = start
+        if not (0 <= start <= 7 and 0 <= end <= 7 and start <= end and step > 0):
+            raise ValueError(f"无效的星期字段: {field}")
+        days.update(day % 7 for day in range(start, end + 1, step))
+
+    return ','.join(str((day - 1) % 7) for day in sorted(days))
+
+
+def parse_cron_expression(expression, jitter=None):
+    """解析5段式 crontab 表达式（分 时 日 月 周），返回 CronTrigger；格式错误时抛出 ValueError"""
+    fields = re.split(r'\s+', (expression or '').strip())
+    if len(fields) != 5:
+        raise ValueError(f"Cron表达式需要5个字段（分 时 日 月 周），当前为 {len(fields)} 个: '{expression}'")
+    minute, hour, day, month, day_of_week = fields
+    return CronTrigger(
+        minute=minute,
+        hour=hour,
+        day=day,
+        month=month,
+        day_of_week=_convert_day_of_week(day_of_week),
+        jitter=jitter or None,
+    )
+
+
+class TaskScheduler:
+    """基于 APScheduler 的任务定时器"""
+
+    def __init__(self, launch, is_running, jitter=30):
+        """
+        参数:
+        - launch: 启动任务的函数 launch(task_id)
+        - is_running: 判断任务是否仍在运行的函数 is_running(task_id)
+        - jitter: 触发时间的随机抖动上限（秒）
+        """
+        self.launch = launch
+        self.is_running = is_running
+        self.jitter = jitter
+        self.scheduler = AsyncIOScheduler()
+        self.errors = {}
+        self._expressions = {}
+
+    def start(self, tasks):
+        self.sync(tasks)
+        self.scheduler.start()
+        print(f"[调度] 调度器已启动，共 {len(self.scheduler.get_jobs())} 个定时任务")
+
+    def shutdown(self):
+        if self.scheduler.running:
+            self.scheduler.shutdown(wait=False)
+            print("[调度] 调度器已停止")
+
+    def sync(self, tasks):
+        """按最新的任务列表增删定时任务（任务创建/更新/删除后调用）"""
+        wanted = set()
+        self.errors = {}
+        for task in tasks:
+            task_id = task['id']
+            expression = task.get('cron_expression')
+            if not task.get('enabled', True) or not expression:
+                continue
+            try:
+                trigger = parse_cron_expression(expression, self.jitter)
+            except ValueError as e:
+                self.errors[task_id] = str(e)
+                print(f"[调度] 任务 '{task.get('task_name')}' 的Cron表达式无效: {e}")
+                continue
+
+            wanted.add(task_id)
+            if self.scheduler.get_job(task_id) is not None and self._expressions.get(task_id) == expression:
+                continue
+            self.scheduler.add_job(
+                self._fire,
+                trigger=trigger,
+                args=[task_id],
+                id=task_id,
+                name=task.get('task_name', task_id),
+                replace_existing=True,
+                max_instances=1,
+                coalesce=True,
+                misfire_grace_time=60,
+            )
+            self._expressions[task_id] = expression
+
+        for job in self.scheduler.get_jobs():
+            if job.id not in wanted:
+                job.remove()
+                self._expressions.pop(job.id, None)
+
+    def get_next_run(self, task_id):
+        """返回任务下一次触发时间（ISO格式），未调度时返回 None"""
+        job = self.scheduler.get_job(task_id)
+        if job is None or job.next_run_time is None:
+            return None
+        return job.next_run_time.isoformat()
+
+    async def _fire(self, task_id):
+        if self.is_running(task_id):
+            print(f"[调度] 任务 {task_id} 上一次运行尚未结束，跳过本次触发")
+            return
+        try:
+            self.launch(task_id)
+        except Exception as e:
+            print(f"[调度] 启动任务 {task_id} 失败: {e}")
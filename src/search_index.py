@@ -0,0 +1,358 @@
+"""
+商品全文检索
+对所有结果文件（含历史分段）中的商品标题和描述建立 SQLite FTS5 倒排索引，
+跨关键词文件按词检索，并可按价格区间、关键词过滤。
+
+中文没有空格分词，这里在写入索引前自行切词：连续的中文按单字和相邻双字（bigram）切分，
+字母数字串整体作为一个词（小写）。查询 "A7M4 快门数 低" 会被转换为
+a7m4* AND 快门 AND 门数 AND 低。
+
+与商品索引相同，按文件记录已处理到的字节位置，每次查询前只增量处理新追加的内容。
+
+命令行用法:
+    python -m src.search_index rebuild
+    python -m src.search_index query "A7M4 快门数 低" --max-price 12000
+    python -m src.search_index bench               # 检索耗时基准测试
+"""
+import argparse
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+
+from src.product_index import RESULT_FILE_SUFFIX, extract_product_id
+from src.result_segments import SEGMENT_DIR, all_segments, open_source
+from src.result_store import parse_price
+
+# 索引数据库文件名（保存在结果目录下）
+SEARCH_INDEX_FILENAME = '.search_index.db'
+
+# 参与检索的字段（商品信息中）
+TEXT_FIELDS = ('商品标题', '商品描述', '商品详情', '描述')
+
+_TOKEN_PATTERN = re.compile(r'[0-9a-z]+|[\u3400-\u4dbf\u4e00-\u9fff]+')
+
+
+def _is_cjk(run):
+    return not run[0].isascii()
+
+
+def tokenize(text):
+    """切词：中文按单字+双字，字母数字串整体小写"""
+    tokens = []
+    for run in _TOKEN_PATTERN.findall((text or '').lower()):
+        if not _is_cjk(run):
+            tokens.append(run)
+            continue
+        tokens.extend(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def build_match_query(query):
+    """把用户输入转换为 FTS5 MATCH 表达式，没有可检索的词时返回 None"""
+    terms = []
+    for run in _TOKEN_PATTERN.findall((query or '').lower()):
+        if not _is_cjk(run):
+            terms.append(f'"{run}"*')
+        elif len(run) == 1:
+            terms.append(f'"{run}"')
+        else:
+            terms.extend(f'"{run[i:i + 2]}"' for i in range(len(run) - 1))
+    return ' '.join(dict.fromkeys(terms)) or None
+
+
+def _keyword_of(filename):
+    """结果文件或历史分段对应的关键词"""
+    return os.path.basename(filename).rsplit('_full_data', 1)[0]
+
+
+def _document(record):
+    """从结果记录中取出 (商品ID, 标题, 价格, 检索文本)"""
+    product_info = record.get('商品信息') or {}
+    text = ' '.join(str(product_info[field]) for field in TEXT_FIELDS if product_info.get(field))
+    return (extract_product_id(record), product_info.get('商品标题') or '',
+            parse_price(product_info.get('当前售价')), text)
+
+
+class SearchIndex:
+    """基于 SQLite FTS5 的商品全文索引"""
+
+    def __init__(self, jsonl_dir, index_path=None):
+        self.jsonl_dir = jsonl_dir
+        self.index_path = index_path or os.path.join(jsonl_dir, SEARCH_INDEX_FILENAME)
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.index_path)), exist_ok=True)
+            conn = sqlite3.connect(self.index_path, check_same_thread=False, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS docs ("
+                " id INTEGER PRIMARY KEY,"
+                " product_id TEXT NOT NULL UNIQUE,"
+                " filename TEXT NOT NULL,"
+                " keyword TEXT,"
+                " title TEXT,"
+                " price REAL,"
+                " crawled_at TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_docs_filename ON docs(filename)")
+            # 只存放切好的词；detail=none 不记录词的位置，索引体积最小
+            conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS docs_fts USING fts5(tokens, detail=none)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                " filename TEXT PRIMARY KEY,"
+                " indexed_size INTEGER NOT NULL,"
+                " inode INTEGER)"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    # ==================== 写入 ====================
+    def _upsert(self, conn, filename, keyword, record):
+        product_id, title, price, text = _document(record)
+        if not product_id:
+            return
+        tokens = ' '.join(tokenize(text))
+        row = conn.execute("SELECT id FROM docs WHERE product_id = ?", (product_id,)).fetchone()
+        values = (filename, keyword, title, price, record.get('爬取时间'))
+        if row is None:
+            doc_id = conn.execute(
+                "INSERT INTO docs (product_id, filename, keyword, title, price, crawled_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (product_id, *values)
+            ).lastrowid
+            conn.execute("INSERT INTO docs_fts (rowid, tokens) VALUES (?, ?)", (doc_id, tokens))
+        else:
+            conn.execute(
+                "UPDATE docs SET filename = ?, keyword = ?, title = ?, price = ?, crawled_at = ? WHERE id = ?",
+                (*values, row[0])
+            )
+            conn.execute("UPDATE docs_fts SET tokens = ? WHERE rowid = ?", (tokens, row[0]))
+
+    def index_record(self, filename, record):
+        """索引一条刚追加的结果（供爬虫写入JSONL后调用，也可以等下次查询时自动同步）"""
+        keyword = _keyword_of(filename)
+        with self._lock:
+            conn = self._connect()
+            self._upsert(conn, filename, keyword, record)
+            conn.commit()
+
+    def _index_file(self, conn, filename, start, segment=False):
+        """从 start 字节开始索引完整行，返回新的已索引位置（历史分段整体索引一次）"""
+        filepath = os.path.join(self.jsonl_dir, filename)
+        keyword = _keyword_of(filename)
+        position = start
+        with (open_source(filepath) if segment else open(filepath, 'rb')) as f:
+            if start:
+                f.seek(start)
+            for line in f:
+                # 最后一行可能正在写入，留到下次同步
+                if not segment and not line.endswith(b'\n'):
+                    break
+                position += len(line)
+                if not line.strip():
+                    continue
+                try:
+                    self._upsert(conn, filename, keyword, json.loads(line))
+                except (json.JSONDecodeError, UnicodeDecodeError, AttributeError):
+                    continue
+        stat = os.stat(filepath)
+        marker = stat.st_size if segment else position
+        conn.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?)", (filename, marker, stat.st_ino))
+        return position
+
+    def _drop_file(self, conn, filename):
+        conn.execute("DELETE FROM docs_fts WHERE rowid IN (SELECT id FROM docs WHERE filename = ?)", (filename,))
+        conn.execute("DELETE FROM docs WHERE filename = ?", (filename,))
+        conn.execute("DELETE FROM files WHERE filename = ?", (filename,))
+
+    def sync(self):
+        """增量同步：历史分段出现时索引一次，活动分段只处理新追加的字节，返回本次处理的字节数"""
+        if not os.path.exists(self.jsonl_dir):
+            return 0
+        processed = 0
+        with self._lock:
+            conn = self._connect()
+            indexed = {name: (size, inode) for name, size, inode in conn.execute("SELECT * FROM files")}
+            current = set()
+            # 先索引历史分段（由旧到新），活动分段中的较新记录随后覆盖
+            # 新出现历史分段说明对应的活动分段已滚动（新文件可能复用旧 inode），需要从头索引
+            rotated = set()
+            for base, names in all_segments(self.jsonl_dir).items():
+                for name in names:
+                    filename = f"{SEGMENT_DIR}/{name}"
+                    current.add(filename)
+                    if filename not in indexed:
+                        rotated.add(base)
+                    if filename in indexed and indexed[filename][0] == os.path.getsize(os.path.join(self.jsonl_dir, filename)):
+                        continue
+                    self._drop_file(conn, filename)
+                    processed += self._index_file(conn, filename, 0, segment=True)
+            for filename in os.listdir(self.jsonl_dir):
+                if not filename.endswith(RESULT_FILE_SUFFIX):
+                    continue
+                current.add(filename)
+                stat = os.stat(os.path.join(self.jsonl_dir, filename))
+                start, inode = indexed.get(filename, (0, stat.st_ino))
+                if stat.st_size < start or filename in rotated or inode != stat.st_ino:
+                    # 文件被截断、重写或滚动，重新索引
+                    self._drop_file(conn, filename)
+                    start = 0
+                if stat.st_size == start:
+                    continue
+                processed += self._index_file(conn, filename, start) - start
+            for filename in set(indexed) - current:
+                self._drop_file(conn, filename)
+            conn.commit()
+        return processed
+
+    def rebuild(self):
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM docs_fts")
+            conn.execute("DELETE FROM docs")
+            conn.execute("DELETE FROM files")
+            conn.commit()
+        return self.sync()
+
+    def remove_file(self, filename, include_segments=False):
+        """删除某个结果文件对应的索引（include_segments=True 时连同历史分段）"""
+        with self._lock:
+            conn = self._connect()
+            self._drop_file(conn, filename)
+            if include_segments:
+                for name in all_segments(self.jsonl_dir).get(filename, []):
+                    self._drop_file(conn, f"{SEGMENT_DIR}/{name}")
+            conn.commit()
+
+    # ==================== 查询 ====================
+    def search(self, query, min_price=None, max_price=None, keyword=None, sort='newest', limit=20, offset=0):
+        """
+        全文检索
+
+        参数:
+        - query: 检索词，多个词之间为 AND
+        - min_price / max_price: 价格区间
+        - keyword: 只检索某个关键词的结果
+        - sort: newest=最近收录（默认，最快）, relevance=相关度, price_asc / price_desc=价格
+        返回 {'hits': [...], 'has_more': bool}
+        """
+        match = build_match_query(query)
+        if match is None:
+            return {'hits': [], 'has_more': False}
+
+        sql = ("SELECT d.product_id, d.keyword, d.title, d.price, d.crawled_at FROM docs_fts"
+               " JOIN docs d ON d.id = docs_fts.rowid WHERE docs_fts MATCH ?")
+        params = [match]
+        if min_price is not None:
+            sql += " AND d.price >= ?"
+            params.append(min_price)
+        if max_price is not None:
+            sql += " AND d.price <= ?"
+            params.append(max_price)
+        if keyword:
+            sql += " AND d.keyword = ?"
+            params.append(keyword)
+        # newest 按收录顺序倒序，FTS5 可以直接倒序遍历并在凑满一页后停止；其余排序需要读取全部匹配
+        sql += {
+            'relevance': " ORDER BY docs_fts.rank",
+            'price_asc': " ORDER BY d.price IS NULL, d.price ASC",
+            'price_desc': " ORDER BY d.price DESC",
+        }.get(sort, " ORDER BY docs_fts.rowid DESC")
+        sql += " LIMIT ? OFFSET ?"
+        params += [limit + 1, offset]
+
+        with self._lock:
+            rows = self._connect().execute(sql, params).fetchall()
+        hits = [{
+            'product_id': product_id,
+            'keyword': kw,
+            'title': title,
+            'price': price,
+            'crawled_at': crawled_at,
+        } for product_id, kw, title, price, crawled_at in rows[:limit]]
+        return {'hits': hits, 'has_more': len(rows) > limit}
+
+    def count(self):
+        with self._lock:
+            return self._connect().execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+
+# ==================== 命令行 ====================
+def run_benchmark(sizes=(100000, 1000000), rounds=20):
+    """生成模拟数据，测量建索引和检索耗时"""
+    brands = ['索尼A7M4', '佳能R6', '尼康Z6', 'iPhone15', '富士XT5']
+    notes = ['快门数低', '成色很新', '有磕碰', '国行', '带原装电池', '送镜头', '自用出']
+    queries = ['A7M4 快门数 低', '佳能 国行', 'iphone15 成色', '送镜头']
+    print(f"{'记录数':>10} {'建索引(s)':>10} {'最近收录(ms)':>14} {'相关度(ms)':>14}")
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(os.path.join(tmp, f"bench{RESULT_FILE_SUFFIX}"), 'w', encoding='utf-8') as f:
+                for i in range(size):
+                    title = f"{brands[i % len(brands)]} {notes[i % 7]} {notes[(i // 7) % 7]} 编号{i}"
+                    f.write(json.dumps({'商品信息': {'商品ID': str(i), '商品标题': title, '当前售价': f'¥{1000 + i % 9000}'}},
+                                       ensure_ascii=False) + '\n')
+            index = SearchIndex(tmp)
+            start = time.perf_counter()
+            index.rebuild()
+            build_time = time.perf_counter() - start
+
+            timings = []
+            for sort in ('newest', 'relevance'):
+                start = time.perf_counter()
+                for i in range(rounds):
+                    index.search(queries[i % len(queries)], max_price=8000, sort=sort)
+                timings.append((time.perf_counter() - start) / rounds * 1000)
+            index.close()
+            print(f"{size:>10} {build_time:>10.1f} {timings[0]:>14.2f} {timings[1]:>14.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='商品全文检索工具')
+    parser.add_argument('command', choices=['rebuild', 'sync', 'query', 'bench'])
+    parser.add_argument('text', nargs='?', help='query: 检索词')
+    parser.add_argument('--dir', type=str, help='结果目录（默认使用配置中的 JSONL_OUTPUT_DIR）')
+    parser.add_argument('--min-price', type=float)
+    parser.add_argument('--max-price', type=float)
+    parser.add_argument('--sizes', type=str, default='100000,1000000', help='基准测试的数据量，逗号分隔')
+    args = parser.parse_args()
+
+    if args.command == 'bench':
+        run_benchmark(sizes=[int(s) for s in args.sizes.split(',') if s])
+        return
+
+    jsonl_dir = args.dir
+    if not jsonl_dir:
+        from src.config import JSONL_OUTPUT_DIR
+        jsonl_dir = JSONL_OUTPUT_DIR
+
+    index = SearchIndex(jsonl_dir)
+    start = time.perf_counter()
+    if args.command == 'query':
+        index.sync()
+        result = index.search(args.text, min_price=args.min_price, max_price=args.max_price)
+        for hit in result['hits']:
+            print(f"{hit['product_id']}  ¥{hit['price']}  [{hit['keyword']}] {hit['title']}")
+    else:
+        processed = index.rebuild() if args.command == 'rebuild' else index.sync()
+        print(f"已处理 {processed} 字节，共索引 {index.count()} 个商品")
+    print(f"耗时 {time.perf_counter() - start:.2f}s")
+    index.close()
+
+
+if __name__ == '__main__':
+    main()
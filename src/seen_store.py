@@ -0,0 +1,295 @@
+"""
+已见商品库
+跨任务、跨运行共享的 商品ID → (首次发现时间, 最近价格, 最近发现时间) 持久化集合，
+爬虫在打开详情页之前先查询，已见过的商品直接跳过，不同关键词搜到同一商品也只抓取一次。
+
+查询先经过内存中的布隆过滤器：过滤器判定"未见过"的商品（绝大多数新商品）无需访问数据库，
+判定"可能见过"时再由数据库确认，因此不会因误判而漏抓新商品。
+其他进程（并发运行的任务）新写入的商品会定期增量加载到过滤器中。
+
+爬虫中的用法:
+    store = SeenStore.for_results_dir(JSONL_OUTPUT_DIR)
+    if store.is_seen(item_id):
+        continue                       # 跳过详情页
+    ...                                # 抓取详情并保存
+    store.mark_seen(item_id, price=price, keyword=keyword)
+
+命令行用法:
+    python -m src.seen_store seed      # 用现有结果文件初始化已见商品库
+    python -m src.seen_store stats
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from src.product_index import RESULT_FILE_SUFFIX, extract_product_id
+from src.result_segments import open_source, source_paths
+from src.result_store import list_result_files
+
+# 数据库文件名（保存在结果目录下，与商品索引相同）
+SEEN_STORE_FILENAME = '.seen_items.db'
+
+
+class BloomFilter:
+    """定长布隆过滤器（双重哈希）"""
+
+    def __init__(self, capacity=100000, error_rate=0.01):
+        self.capacity = max(int(capacity), 1)
+        self.error_rate = error_rate
+        self.num_bits = max(int(-self.capacity * math.log(error_rate) / (math.log(2) ** 2)), 8)
+        self.num_hashes = max(int(round(self.num_bits / self.capacity * math.log(2))), 1)
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+    @property
+    def is_full(self):
+        return self.count > self.capacity
+
+
+class SeenStore:
+    """基于 SQLite + 布隆过滤器的已见商品库"""
+
+    def __init__(self, db_path, capacity=100000, refresh_interval=30):
+        """
+        参数:
+        - db_path: 数据库路径
+        - capacity: 布隆过滤器初始容量，商品数超过后自动按2倍重建
+        - refresh_interval: 从数据库增量加载其他进程写入的商品的间隔（秒）
+        """
+        self.db_path = db_path
+        self.capacity = capacity
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._conn = None
+        self._bloom = None
+        self._loaded_rowid = 0
+        self._refreshed_at = 0
+        self.stats = {'bloom_negative': 0, 'db_checked': 0, 'seen': 0, 'marked': 0}
+
+    @classmethod
+    def for_results_dir(cls, jsonl_dir, **kwargs):
+        return cls(os.path.join(jsonl_dir, SEEN_STORE_FILENAME), **kwargs)
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS seen_items ("
+                " product_id TEXT PRIMARY KEY,"
+                " first_seen TEXT NOT NULL,"
+                " last_seen TEXT NOT NULL,"
+                " last_price TEXT,"
+                " keyword TEXT)"
+            )
+            # 列表接口指纹和最近一次抓取详情的时间（用于判断是否需要重新抓取详情）
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(seen_items)")}
+            if 'fingerprint' not in columns:
+                conn.execute("ALTER TABLE seen_items ADD COLUMN fingerprint TEXT")
+                conn.execute("ALTER TABLE seen_items ADD COLUMN detail_fetched_at REAL")
+            self._conn = conn
+        return self._conn
+
+    # ==================== 布隆过滤器 ====================
+    def _rebuild_bloom(self):
+        conn = self._connect()
+        total = conn.execute("SELECT COUNT(*) FROM seen_items").fetchone()[0]
+        self._bloom = BloomFilter(max(self.capacity, total * 2))
+        self._loaded_rowid = 0
+        self._load_new_rows()
+
+    def _load_new_rows(self):
+        """加载 rowid 大于上次加载位置的商品（本进程和其他进程新写入的）"""
+        rows = self._conn.execute(
+            "SELECT rowid, product_id FROM seen_items WHERE rowid > ? ORDER BY rowid",
+            (self._loaded_rowid,)
+        ).fetchall()
+        for rowid, product_id in rows:
+            self._bloom.add(product_id)
+            self._loaded_rowid = rowid
+        self._refreshed_at = time.time()
+        if self._bloom.is_full:
+            self._rebuild_bloom()
+
+    def _ensure_bloom(self):
+        if self._bloom is None:
+            self._rebuild_bloom()
+        elif time.time() - self._refreshed_at >= self.refresh_interval:
+            self._load_new_rows()
+
+    # ==================== 查询 ====================
+    def is_seen(self, product_id):
+        """商品是否已被抓取过"""
+        product_id = str(product_id)
+        with self._lock:
+            self._ensure_bloom()
+            if product_id not in self._bloom:
+                self.stats['bloom_negative'] += 1
+                return False
+            self.stats['db_checked'] += 1
+            found = self._conn.execute(
+                "SELECT 1 FROM seen_items WHERE product_id = ?", (product_id,)
+            ).fetchone() is not None
+            if found:
+                self.stats['seen'] += 1
+            return found
+
+    def get(self, product_id):
+        """
+        返回商品的记录 {product_id, first_seen, last_seen, last_price, keyword,
+        fingerprint, detail_fetched_at}，不存在时返回 None
+        """
+        fields = ('product_id', 'first_seen', 'last_seen', 'last_price', 'keyword', 'fingerprint', 'detail_fetched_at')
+        with self._lock:
+            row = self._connect().execute(
+                f"SELECT {', '.join(fields)} FROM seen_items WHERE product_id = ?",
+                (str(product_id),)
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(fields, row))
+
+    def filter_unseen(self, product_ids):
+        """从一批商品ID中筛选出未见过的（保持原顺序）"""
+        return [pid for pid in product_ids if not self.is_seen(pid)]
+
+    def count(self):
+        with self._lock:
+            return self._connect().execute("SELECT COUNT(*) FROM seen_items").fetchone()[0]
+
+    # ==================== 写入 ====================
+    def mark_many(self, items):
+        """
+        批量记录商品，items 为 (商品ID, 价格, 关键词) 元组；
+        已存在的商品只更新最近价格和最近发现时间
+        """
+        now = datetime.now().isoformat()
+        rows = [(str(pid), now, now, None if price is None else str(price), keyword) for pid, price, keyword in items]
+        if not rows:
+            return
+        with self._lock:
+            self._ensure_bloom()
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT INTO seen_items (product_id, first_seen, last_seen, last_price, keyword) "
+                    "VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT(product_id) DO UPDATE SET "
+                    " last_seen = excluded.last_seen,"
+                    " last_price = COALESCE(excluded.last_price, seen_items.last_price)",
+                    rows
+                )
+            for row in rows:
+                self._bloom.add(row[0])
+            self.stats['marked'] += len(rows)
+            if self._bloom.is_full:
+                self._rebuild_bloom()
+
+    def mark_seen(self, product_id, price=None, keyword=None):
+        self.mark_many([(product_id, price, keyword)])
+
+    def record_detail(self, product_id, fingerprint, price=None, keyword=None):
+        """记录已抓取详情的商品及其列表指纹"""
+        self.mark_seen(product_id, price=price, keyword=keyword)
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    "UPDATE seen_items SET fingerprint = ?, detail_fetched_at = ? WHERE product_id = ?",
+                    (fingerprint, time.time(), str(product_id))
+                )
+
+    def adopt_fingerprint(self, product_id, fingerprint):
+        """
+        为已见但没有指纹的商品记下列表指纹（详情已在结果文件中，不重新抓取）
+
+        抓取时间按首次发现时间计，详情有效期从那时算起；已有指纹的商品不受影响。
+        """
+        self.mark_seen(product_id)
+        with self._lock:
+            with self._conn:
+                row = self._conn.execute(
+                    "SELECT first_seen FROM seen_items WHERE product_id = ?", (str(product_id),)
+                ).fetchone()
+                try:
+                    fetched_at = datetime.fromisoformat(row[0]).timestamp()
+                except (TypeError, ValueError):
+                    fetched_at = time.time()
+                self._conn.execute(
+                    "UPDATE seen_items SET fingerprint = ?, detail_fetched_at = ?"
+                    " WHERE product_id = ? AND detail_fetched_at IS NULL",
+                    (fingerprint, fetched_at, str(product_id))
+                )
+
+    def seed_from_results(self, jsonl_dir):
+        """用结果目录中已保存的商品（含历史分段）初始化（升级后首次运行也能跳过已抓取的商品），返回处理的记录数"""
+        processed = 0
+        for filename in sorted(list_result_files(jsonl_dir)):
+            keyword = filename[:-len(RESULT_FILE_SUFFIX)]
+            batch = []
+            # 按分段时间顺序读取，同一商品最后写入的是最近价格
+            for path in source_paths(jsonl_dir, filename):
+                with open_source(path) as f:
+                    for line in f:
+                        try:
+                            record = json.loads(line)
+                        except (json.JSONDecodeError, UnicodeDecodeError):
+                            continue
+                        product_id = extract_product_id(record)
+                        if product_id:
+                            price = (record.get('商品信息') or {}).get('当前售价')
+                            batch.append((product_id, price, keyword))
+            self.mark_many(batch)
+            processed += len(batch)
+        return processed
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+                self._bloom = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='已见商品库工具')
+    parser.add_argument('command', choices=['seed', 'stats'], help='seed=从结果文件初始化, stats=查看数量')
+    parser.add_argument('--dir', type=str, help='结果目录（默认使用配置中的 JSONL_OUTPUT_DIR）')
+    args = parser.parse_args()
+
+    jsonl_dir = args.dir
+    if not jsonl_dir:
+        from src.config import JSONL_OUTPUT_DIR
+        jsonl_dir = JSONL_OUTPUT_DIR
+
+    store = SeenStore.for_results_dir(jsonl_dir)
+    if args.command == 'seed':
+        start = time.perf_counter()
+        processed = store.seed_from_results(jsonl_dir)
+        print(f"已处理 {processed} 条记录，耗时 {time.perf_counter() - start:.2f}s")
+    print(f"已见商品数: {store.count()}")
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
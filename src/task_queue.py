@@ -0,0 +1,185 @@
+"""
+任务准入队列
+所有任务启动请求（手动启动、定时触发、批量重启）先进入优先级队列，
+由一个后台协程在运行数低于上限时按 优先级 → 提交顺序 依次放行，
+避免同时启动大量浏览器导致机器过载。
+
+空闲名额按实际运行中的任务计算：没有经过队列启动的运行（服务重启后接管的进程等）
+也通过 list_active 登记进来，同样占用名额。
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+
+
+class TaskAdmissionQueue:
+    """带并发上限的任务优先级队列"""
+
+    def __init__(self, launch, is_active, max_concurrent=2, poll_interval=1.0, default_duration=600,
+                 list_active=None):
+        """
+        参数:
+        - launch: 放行任务时调用 launch(task_id)，返回 False 表示任务已不存在/无需启动
+        - is_active: 判断已放行任务是否仍在运行 is_active(task_id)
+        - list_active: 返回当前所有运行中任务ID的函数（包括没有经过队列启动的运行），
+          这些运行同样计入并发上限；不指定时只统计队列放行的任务
+        - max_concurrent: 同时运行的任务数上限（<=0 表示不限制）
+        - poll_interval: 检查运行中任务是否结束的间隔（秒）
+        - default_duration: 没有历史数据时估计的单次运行时长（秒）
+        """
+        self.launch = launch
+        self.is_active = is_active
+        self.max_concurrent = max_concurrent
+        self.poll_interval = poll_interval
+        self.default_duration = default_duration
+        self.list_active = list_active
+
+        self._heap = []
+        self._entries = {}
+        self._counter = itertools.count()
+        self._running = {}
+        self._durations = {}
+        self._recent = deque(maxlen=50)
+        self._wakeup = None
+        self._worker = None
+
+    # ==================== 提交 / 取消 ====================
+    def submit(self, task_id, priority=0):
+        """
+        提交启动请求，返回排队位置（从1开始）
+
+        任务已在运行时抛出 RuntimeError；已在排队时只更新优先级。
+        """
+        self._reap()
+        if task_id in self._running:
+            raise RuntimeError(f"任务 {task_id} 正在运行")
+        if task_id in self._entries:
+            self.cancel(task_id)
+        entry = [-int(priority or 0), next(self._counter), task_id, time.time()]
+        self._entries[task_id] = entry
+        heapq.heappush(self._heap, entry)
+        self._wake()
+        return self.get_position(task_id)
+
+    def cancel(self, task_id):
+        """从队列中移除尚未放行的任务，返回是否找到"""
+        entry = self._entries.pop(task_id, None)
+        if entry is None:
+            return False
+        # 懒删除：标记后在出队时跳过
+        entry[2] = None
+        return True
+
+    def is_queued(self, task_id):
+        return task_id in self._entries
+
+    def is_running(self, task_id):
+        return task_id in self._running
+
+    # ==================== 后台放行 ====================
+    def start(self):
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+
+    def _wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _has_free_slot(self):
+        return self.max_concurrent <= 0 or len(self._running) < self.max_concurrent
+
+    def _reap(self):
+        """移除已结束的运行（记录运行时长用于估算等待时间），并登记队列外启动的运行"""
+        now = time.time()
+        for task_id, started_at in list(self._running.items()):
+            if not self.is_active(task_id):
+                del self._running[task_id]
+                duration = now - started_at
+                self._durations[task_id] = duration
+                self._recent.append(duration)
+        if self.list_active is not None:
+            for task_id in self.list_active():
+                if task_id not in self._running:
+                    # 开始时间未知，从发现时算起（只影响等待时间估算）
+                    self._running[task_id] = now
+
+    def _admit(self):
+        while self._heap and self._has_free_slot():
+            entry = heapq.heappop(self._heap)
+            task_id = entry[2]
+            if task_id is None:
+                continue
+            del self._entries[task_id]
+            try:
+                if self.launch(task_id) is False:
+                    continue
+            except Exception as e:
+                print(f"[任务队列] 启动任务 {task_id} 失败: {e}")
+                continue
+            self._running[task_id] = time.time()
+
+    async def _run(self):
+        while True:
+            try:
+                self._reap()
+                self._admit()
+            except Exception as e:
+                print(f"[任务队列] 调度失败: {e}")
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    # ==================== 查询 ====================
+    def _expected_duration(self, task_id):
+        if task_id in self._durations:
+            return self._durations[task_id]
+        if self._recent:
+            return sum(self._recent) / len(self._recent)
+        return self.default_duration
+
+    def _ordered(self):
+        return [entry[2] for entry in sorted(self._heap) if entry[2] is not None]
+
+    def get_position(self, task_id):
+        """返回任务在队列中的位置（从1开始），不在队列中时返回 None"""
+        if task_id not in self._entries:
+            return None
+        return self._ordered().index(task_id) + 1
+
+    def estimate_waits(self):
+        """估算每个排队任务还需等待的秒数 {task_id: seconds}"""
+        now = time.time()
+        slots = self.max_concurrent if self.max_concurrent > 0 else len(self._running) + len(self._entries)
+        free_at = sorted(
+            max(self._expected_duration(t) - (now - started), 0) for t, started in self._running.items()
+        )
+        free_at += [0] * max(slots - len(free_at), 0)
+        heapq.heapify(free_at)
+
+        waits = {}
+        for task_id in self._ordered():
+            start_at = heapq.heappop(free_at) if free_at else 0
+            waits[task_id] = int(start_at)
+            heapq.heappush(free_at, start_at + self._expected_duration(task_id))
+        return waits
+
+    def get_status(self):
+        waits = self.estimate_waits()
+        return {
+            'max_concurrent': self.max_concurrent,
+            'running': sorted(self._running),
+            'queued': [
+                {'task_id': task_id, 'position': i + 1, 'eta_seconds': waits.get(task_id)}
+                for i, task_id in enumerate(self._ordered())
+            ],
+        }
@@ -0,0 +1,136 @@
+"""
+进程内任务执行器
+在 Web 服务进程中以 asyncio 任务的形式执行爬虫，省去每次运行都要启动解释器、
+导入 playwright 等模块的开销。并发数受信号量限制，停止任务即取消对应的协程，
+每个任务的 print 输出通过 contextvars 写入各自的日志文件。
+"""
+import asyncio
+import contextvars
+import io
+import sys
+import traceback
+
+# 当前协程对应的日志文件句柄
+_current_log = contextvars.ContextVar('task_log', default=None)
+
+
+class _TaskOutput(io.TextIOBase):
+    """替换 sys.stdout/sys.stderr：在任务协程内写日志文件，其他地方照常输出到控制台"""
+
+    def __init__(self, fallback):
+        self._fallback = fallback
+
+    @property
+    def encoding(self):
+        return getattr(self._fallback, 'encoding', 'utf-8')
+
+    def write(self, text):
+        handle = _current_log.get()
+        if handle is not None:
+            return handle.write(text)
+        return self._fallback.write(text)
+
+    def flush(self):
+        handle = _current_log.get()
+        if handle is not None:
+            handle.flush()
+        else:
+            self._fallback.flush()
+
+    def isatty(self):
+        return False
+
+    def fileno(self):
+        return self._fallback.fileno()
+
+
+def install_output_capture():
+    """安装按任务分流的标准输出（重复调用无副作用）"""
+    if not isinstance(sys.stdout, _TaskOutput):
+        sys.stdout = _TaskOutput(sys.stdout)
+    if not isinstance(sys.stderr, _TaskOutput):
+        sys.stderr = _TaskOutput(sys.stderr)
+
+
+class InProcessTaskRunner:
+    """以 asyncio 任务执行爬虫的执行器"""
+
+    def __init__(self, run_task, max_concurrency=3, on_finish=None):
+        """
+        参数:
+        - run_task: async 函数，接收 task_id 并执行一次爬取
+        - max_concurrency: 同时执行的任务数上限，超出的任务排队等待
+        - on_finish: 任务结束回调 on_finish(task_id, status, log_path)，
+          status 为 finished / failed / stopped
+        """
+        self.run_task = run_task
+        self.max_concurrency = max_concurrency
+        self.on_finish = on_finish
+        self._semaphore = None
+        self._tasks = {}
+        self._active = set()
+
+    def is_running(self, task_id):
+        return task_id in self._tasks
+
+    def running_task_ids(self):
+        """返回已提交且尚未结束的任务ID（包括等待执行名额的）"""
+        return list(self._tasks)
+
+    def start(self, task_id, log_path):
+        """提交一个任务；任务已在执行时抛出 RuntimeError"""
+        if task_id in self._tasks:
+            raise RuntimeError(f"任务 {task_id} 正在执行")
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        install_output_capture()
+        self._tasks[task_id] = asyncio.create_task(self._run(task_id, log_path))
+        return self._tasks[task_id]
+
+    def stop(self, task_id):
+        """取消任务，返回是否找到了该任务"""
+        task = self._tasks.get(task_id)
+        if task is None:
+            return False
+        task.cancel()
+        return True
+
+    async def wait_stopped(self, task_id, timeout=10):
+        """等待任务真正结束（取消后浏览器关闭等清理需要时间）"""
+        task = self._tasks.get(task_id)
+        if task is not None:
+            await asyncio.wait([task], timeout=timeout)
+
+    def get_status(self):
+        return {
+            'max_concurrency': self.max_concurrency,
+            'running': sorted(self._active),
+            'waiting': sorted(set(self._tasks) - self._active),
+        }
+
+    async def _run(self, task_id, log_path):
+        status = 'failed'
+        handle = open(log_path, 'w', encoding='utf-8', buffering=1)
+        token = _current_log.set(handle)
+        try:
+            if self._semaphore.locked():
+                print(f"[进程内执行] 并发数已达上限 {self.max_concurrency}，等待空闲...")
+            async with self._semaphore:
+                self._active.add(task_id)
+                await self.run_task(task_id)
+            status = 'finished'
+        except asyncio.CancelledError:
+            status = 'stopped'
+            print("\n[进程内执行] 任务已被停止")
+        except Exception:
+            traceback.print_exc()
+        finally:
+            self._active.discard(task_id)
+            self._tasks.pop(task_id, None)
+            _current_log.reset(token)
+            handle.close()
+            if self.on_finish:
+                try:
+                    self.on_finish(task_id, status, log_path)
+                except Exception as e:
+                    print(f"[进程内执行] 更新任务状态失败: {e}")
@@ -0,0 +1,228 @@
+"""
+任务存储模块
+用 SQLite（WAL 模式）保存任务列表，替代每次整体重写 tasks.json：
+- 按行更新，并发的启动/停止/更新请求不会互相覆盖对方写入的字段
+- 支持带前置条件的原子更新（如只有状态仍为 queued 时才改为 running）
+- 读取走内存缓存，其他连接（进程）写入后通过 data_version 自动失效
+- 首次使用时自动从旧的 tasks.json 导入
+"""
+import copy
+import json
+import os
+import sqlite3
+import threading
+
+
+def task_db_path(tasks_file):
+    """根据 tasks.json 的路径得到任务数据库路径（可用环境变量 TASKS_DB_FILE 覆盖）"""
+    return os.getenv('TASKS_DB_FILE') or os.path.splitext(tasks_file)[0] + '.db'
+
+
+class TaskStore:
+    """基于 SQLite 的任务存储"""
+
+    def __init__(self, db_path, legacy_json_path=None):
+        self.db_path = db_path
+        self.legacy_json_path = legacy_json_path
+        self._lock = threading.RLock()
+        self._conn = None
+        self._cache = None
+        self._cache_version = None
+
+    # ==================== 连接与迁移 ====================
+    def _connect(self):
+        if self._conn is None:
+            db_dir = os.path.dirname(os.path.abspath(self.db_path))
+            os.makedirs(db_dir, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS tasks ("
+                " id TEXT PRIMARY KEY,"
+                " position INTEGER NOT NULL,"
+                " data TEXT NOT NULL)"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self._conn = conn
+            self._migrate_legacy_json()
+        return self._conn
+
+    def _migrate_legacy_json(self):
+        """首次使用时导入 tasks.json（原文件保留作为备份）"""
+        conn = self._conn
+        if conn.execute("SELECT 1 FROM meta WHERE key = 'legacy_migrated'").fetchone():
+            return
+        tasks = []
+        if self.legacy_json_path and os.path.exists(self.legacy_json_path):
+            try:
+                with open(self.legacy_json_path, 'r', encoding='utf-8') as f:
+                    tasks = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"[任务存储] 读取 {self.legacy_json_path} 失败，跳过导入: {e}")
+                tasks = []
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # 另一个进程可能已经完成了导入
+            if not conn.execute("SELECT 1 FROM meta WHERE key = 'legacy_migrated'").fetchone():
+                for position, task in enumerate(tasks):
+                    conn.execute(
+                        "INSERT OR IGNORE INTO tasks (id, position, data) VALUES (?, ?, ?)",
+                        (str(task['id']), position, json.dumps(task, ensure_ascii=False))
+                    )
+                conn.execute("INSERT INTO meta (key, value) VALUES ('legacy_migrated', '1')")
+                if tasks:
+                    print(f"[任务存储] 已从 {self.legacy_json_path} 导入 {len(tasks)} 个任务")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+                self._cache = None
+
+    # ==================== 读取 ====================
+    def _data_version(self):
+        return self._connect().execute("PRAGMA data_version").fetchone()[0]
+
+    def _load_cached(self):
+        version = self._data_version()
+        if self._cache is None or version != self._cache_version:
+            rows = self._conn.execute("SELECT data FROM tasks ORDER BY position, id").fetchall()
+            self._cache = [json.loads(row[0]) for row in rows]
+            self._cache_version = version
+        return self._cache
+
+    def load_all(self):
+        """返回所有任务（副本，修改不会影响缓存）"""
+        with self._lock:
+            return copy.deepcopy(self._load_cached())
+
+    def get(self, task_id):
+        with self._lock:
+            for task in self._load_cached():
+                if task['id'] == str(task_id):
+                    return copy.deepcopy(task)
+        return None
+
+    # ==================== 写入 ====================
+    def _transaction(self, func):
+        """在写事务中执行 func(conn)，写入后使缓存失效"""
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(conn)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            finally:
+                # 本连接自己的写入不会改变 data_version，需要手动失效
+                self._cache = None
+            return result
+
+    def _next_id(self, conn):
+        """
+        分配下一个数字ID
+
+        计数器保存在 meta 表的 next_id 中，只增不减：删除编号最大的任务后
+        不会把它的ID再分配给新任务（日志、结果、运行记录都按ID关联）。
+        计数器不存在（旧数据库）时从现有最大数字ID开始。
+        """
+        row = conn.execute("SELECT value FROM meta WHERE key = 'next_id'").fetchone()
+        ids = [r[0] for r in conn.execute("SELECT id FROM tasks")]
+        numeric = [int(i) for i in ids if i.isdigit()]
+        next_id = max(int(row[0]) if row else 1, max(numeric, default=0) + 1)
+        return next_id
+
+    def _bump_counter(self, conn, task_id):
+        """数字ID被占用后把计数器推进到它之后"""
+        if not str(task_id).isdigit():
+            return
+        row = conn.execute("SELECT value FROM meta WHERE key = 'next_id'").fetchone()
+        next_id = max(int(row[0]) if row else 1, int(task_id) + 1)
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('next_id', ?)", (str(next_id),))
+
+    def insert(self, task):
+        """新增任务，未指定 id 时从只增不减的计数器分配数字ID，返回写入的任务"""
+        def run(conn):
+            new_task = dict(task)
+            if not new_task.get('id'):
+                new_task['id'] = str(self._next_id(conn))
+            self._bump_counter(conn, new_task['id'])
+            position = conn.execute("SELECT COALESCE(MAX(position), -1) + 1 FROM tasks").fetchone()[0]
+            conn.execute(
+                "INSERT INTO tasks (id, position, data) VALUES (?, ?, ?)",
+                (new_task['id'], position, json.dumps(new_task, ensure_ascii=False))
+            )
+            return new_task
+        return self._transaction(run)
+
+    def update(self, task_id, fields, expect=None):
+        """
+        按行更新任务字段
+
+        参数:
+        - fields: 要写入的字段
+        - expect: 前置条件 {字段: 期望值}，期望值为 tuple/list/set 时表示任一即可；
+          条件不满足时不写入
+        返回更新后的任务；任务不存在或条件不满足时返回 None
+        """
+        def run(conn):
+            row = conn.execute("SELECT data FROM tasks WHERE id = ?", (str(task_id),)).fetchone()
+            if row is None:
+                return None
+            task = json.loads(row[0])
+            for key, expected in (expect or {}).items():
+                if isinstance(expected, (tuple, list, set)):
+                    if task.get(key) not in expected:
+                        return None
+                elif task.get(key) != expected:
+                    return None
+            task.update(fields)
+            task['id'] = str(task_id)
+            conn.execute(
+                "UPDATE tasks SET data = ? WHERE id = ?",
+                (json.dumps(task, ensure_ascii=False), str(task_id))
+            )
+            return task
+        return self._transaction(run)
+
+    def delete(self, task_id):
+        """删除任务，返回被删除的任务（不存在时返回 None）"""
+        def run(conn):
+            row = conn.execute("SELECT data FROM tasks WHERE id = ?", (str(task_id),)).fetchone()
+            if row is None:
+                return None
+            conn.execute("DELETE FROM tasks WHERE id = ?", (str(task_id),))
+            return json.loads(row[0])
+        return self._transaction(run)
+
+    def save_all(self, tasks):
+        """
+        兼容旧接口：保存整个任务列表
+
+        只写入内容有变化的行，并删除列表中已不存在的任务。
+        """
+        def run(conn):
+            existing = {row[0]: row[1] for row in conn.execute("SELECT id, data FROM tasks")}
+            keep = set()
+            for position, task in enumerate(tasks):
+                task_id = str(task['id'])
+                keep.add(task_id)
+                data = json.dumps(task, ensure_ascii=False)
+                if task_id not in existing:
+                    self._bump_counter(conn, task_id)
+                if existing.get(task_id) != data:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO tasks (id, position, data) VALUES (?, ?, ?)",
+                        (task_id, position, data)
+                    )
+            for task_id in set(existing) - keep:
+                conn.execute("DELETE FROM tasks WHERE id = ?", (task_id,))
+        self._transaction(run)
@@ -157,6 +157,375 @@ def test_check_playwright():
         return False
 
 
+def test_product_index():
+    """测试商品ID索引"""
+    print("="*60)
+    print("测试 6: 商品ID索引")
+    print("="*60)
+
+    import json
+    import os
+    import tempfile
+
+    try:
+        from src.product_index import ProductIndex
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "测试_full_data.jsonl")
+            with open(path, 'w', encoding='utf-8') as f:
+                for i in range(3):
+                    f.write(json.dumps({"商品信息": {"商品ID": str(i)}}, ensure_ascii=False) + "\n")
+
+            index = ProductIndex(tmp)
+            index.rebuild()
+            assert [r["商品信息"]["商品ID"] for r in index.fetch(["2", "0", "9"])] == ["2", "0"]
+
+            # 追加记录后增量同步即可查到
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({"商品信息": {"商品ID": "9"}}, ensure_ascii=False) + "\n")
+            index.sync()
+            assert len(index.fetch(["9"])) == 1
+            index.close()
+
+        print("[OK] 索引建立、增量同步和查询正常")
+        print("\n商品索引测试通过！\n")
+        return True
+    except Exception as e:
+        print(f"\n[ERROR] 商品索引测试失败: {e}\n")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_cron_expression():
+    """测试Cron表达式解析"""
+    print("="*60)
+    print("测试 7: Cron表达式解析")
+    print("="*60)
+
+    try:
+        from datetime import datetime
+        from src.scheduler import parse_cron_expression
+
+        # crontab 中 1 表示周一（2026-10-17 为周六）
+        trigger = parse_cron_expression("0 9 * * 1")
+        now = datetime(2026, 10, 17).astimezone()
+        next_time = trigger.get_next_fire_time(None, now)
+        assert (next_time.day, next_time.hour) == (19, 9)
+        print(f"[OK] '0 9 * * 1' 下一次触发: {next_time}")
+
+        try:
+            parse_cron_expression("* * * *")
+            raise AssertionError("4段表达式应当报错")
+        except ValueError:
+            print("[OK] 无效表达式被拒绝")
+
+        print("\nCron表达式测试通过！\n")
+        return True
+    except Exception as e:
+        print(f"\n[ERROR] Cron表达式测试失败: {e}\n")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_task_store():
+    """测试任务存储"""
+    print("="*60)
+    print("测试 8: 任务存储")
+    print("="*60)
+
+    import json
+    import os
+    import tempfile
+
+    try:
+        from src.task_store import TaskStore
+
+        with tempfile.TemporaryDirectory() as tmp:
+            legacy = os.path.join(tmp, "tasks.json")
+            with open(legacy, 'w', encoding='utf-8') as f:
+                json.dump([{"id": "1", "task_name": "旧任务", "status": "idle"}], f, ensure_ascii=False)
+
+            store = TaskStore(os.path.join(tmp, "tasks.db"), legacy)
+            assert [t["task_name"] for t in store.load_all()] == ["旧任务"]
+            print("[OK] 已从 tasks.json 导入")
+
+            created = store.insert({"task_name": "新任务", "status": "idle"})
+            assert created["id"] == "2"
+
+            # 删除编号最大的任务后不会复用它的ID
+            temp = store.insert({"task_name": "临时任务", "status": "idle"})
+            store.delete(temp["id"])
+            assert store.insert({"task_name": "再建任务", "status": "idle"})["id"] == "4"
+            store.delete("4")
+
+            # 前置条件不满足时不写入
+            assert store.update("1", {"status": "running"}, expect={"status": "queued"}) is None
+            assert store.update("1", {"status": "running"}, expect={"status": ("idle", "stopped")})["status"] == "running"
+
+            # 另一个连接写入后缓存自动刷新
+            other = TaskStore(os.path.join(tmp, "tasks.db"), legacy)
+            other.update("2", {"status": "queued"})
+            assert store.get("2")["status"] == "queued"
+            other.close()
+            store.close()
+            print("[OK] 按行更新、条件更新和缓存刷新正常")
+
+        print("\n任务存储测试通过！\n")
+        return True
+    except Exception as e:
+        print(f"\n[ERROR] 任务存储测试失败: {e}\n")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_mtop_client():
+    """测试mtop直连客户端（使用本地模拟服务）"""
+    print("="*60)
+    print("测试 9: mtop直连客户端")
+    print("="*60)
+
+    import asyncio
+
+    try:
+        from src.mtop_client import MtopClient, SEARCH_API, DETAIL_API, RiskControlError
+        from src.mtop_stub import MtopStubServer
+
+        stub = MtopStubServer({
+            SEARCH_API: {"ret": ["SUCCESS::调用成功"], "data": {"resultList": [{"id": 1}]}},
+            DETAIL_API: {"ret": ["RGV587_ERROR::SM::哎哟喂,被挤爆啦"], "data": {}},
+        }).start()
+        client = MtopClient({"_m_h5_tk": "expired_0"}, base_url=stub.base_url)
+
+        async def run():
+            # 旧令牌过期后自动换新令牌重试
+            data = await client.search("测试")
+            assert data["resultList"] == [{"id": 1}]
+            assert client.stats["token_refreshes"] == 1
+            print("[OK] 签名校验通过，令牌过期自动刷新")
+
+            try:
+                await client.detail("123")
+                raise AssertionError("风控响应应当抛出 RiskControlError")
+            except RiskControlError:
+                print("[OK] 风控响应被识别")
+
+        try:
+            asyncio.run(run())
+        finally:
+            client.close()
+            stub.stop()
+
+        print("\nmtop直连客户端测试通过！\n")
+        return True
+    except Exception as e:
+        print(f"\n[ERROR] mtop直连客户端测试失败: {e}\n")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_result_segments():
+    """测试结果文件分段存储"""
+    print("="*60)
+    print("测试 10: 结果分段存储")
+    print("="*60)
+
+    import tempfile
+
+    try:
+        from src.product_index import ProductIndex
+        from src.result_columns import ColumnStore
+        from src.result_segments import ResultWriter, list_segments, rotate
+        from src.result_store import ResultPager, ResultStatsCache
+
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = "测试_full_data.jsonl"
+            writer = ResultWriter(tmp, "测试", settings={'max_bytes': 0, 'max_age_hours': 0, 'compression': 'gzip'})
+            for i in range(6):
+                writer.append({"商品信息": {"商品ID": str(i), "当前售价": f"¥{100 + i}"}})
+                if i == 2:
+                    rotate(tmp, filename)
+            assert len(list_segments(tmp, filename)) == 1
+
+            # 统计、分页和按ID读取都跨越历史分段
+            assert ResultStatsCache(tmp).get_file_stats(filename)["count"] == 6
+            pager = ResultPager(tmp)
+            ids, cursor = [], None
+            while True:
+                records, cursor = pager.read_page(filename, limit=4, cursor=cursor, reverse=True)
+                ids += [r["商品信息"]["商品ID"] for r in records]
+                if cursor is None:
+                    break
+            assert ids == ["5", "4", "3", "2", "1", "0"]
+            index = ProductIndex(tmp)
+            index.sync()
+            assert len(index.fetch(["0", "5"])) == 2
+            index.close()
+            print("[OK] 滚动后统计、分页和商品查询正常")
+
+            stats = ColumnStore(tmp).stats(filename)
+            assert stats["price"]["min"] == 100 and stats["price"]["median"] == 102.5
+            print("[OK] 列式快照统计正常")
+
+        print("\n结果分段存储测试通过！\n")
+        return True
+    except Exception as e:
+        print(f"\n[ERROR] 结果分段存储测试失败: {e}\n")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_notify_dispatcher():
+    """测试通知分发（使用本地模拟 Webhook 服务）"""
+    print("="*60)
+    print("测试 11: 通知分发")
+    print("="*60)
+
+    import asyncio
+
+    try:
+        from src.notify_dispatcher import NotificationDispatcher
+        from src.notify_stub import WebhookStubServer
+
+        stub = WebhookStubServer(fail_paths={"/feishu"}).start()
+        dispatcher = NotificationDispatcher(rate_limits={"wx": 20, "dingtalk": 20, "feishu": 20})
+        config = {
+            "wx_bot_url": f"{stub.base_url}/wx",
+            "dingtalk_bot_url": f"{stub.base_url}/dingtalk",
+            "feishu_bot_url": f"{stub.base_url}/feishu",
+        }
+        records = [{"商品信息": {"商品ID": str(i), "商品标题": f"商品{i}", "当前售价": f"¥{i}"}} for i in range(12)]
+
+        try:
+            result = asyncio.run(dispatcher.send(records, "批量推送", config))
+        finally:
+            dispatcher.close()
+            stub.stop()
+
+        # 企业微信图文消息每条最多 8 个商品，钉钉 markdown 每条最多 10 个
+        assert [len(c["body"]["news"]["articles"]) for c in stub.calls_to("/wx")] == [8, 4]
+        assert len(stub.calls_to("/dingtalk")) == 2
+        print("[OK] 多个商品合并为一条消息")
+
+        assert len(result["channels"]["feishu"]["failed"]) == 12
+        assert len(result["delivered"]) == 12
+        print("[OK] 单个渠道失败不影响其他渠道")
+
+        print("\n通知分发测试通过！\n")
+        return True
+    except Exception as e:
+        print(f"\n[ERROR] 通知分发测试失败: {e}\n")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_notify_outbox():
+    """测试通知发件箱（重试和去重）"""
+    print("="*60)
+    print("测试 12: 通知发件箱")
+    print("="*60)
+
+    import asyncio
+    import tempfile
+
+    try:
+        from src.notify_dispatcher import NotificationDispatcher
+        from src.notify_outbox import NotifyOutbox, OutboxWorker
+        from src.notify_stub import WebhookStubServer
+
+        stub = WebhookStubServer(fail_paths={"/feishu"}).start()
+        dispatcher = NotificationDispatcher()
+        config = {"wx_bot_url": f"{stub.base_url}/wx", "feishu_bot_url": f"{stub.base_url}/feishu"}
+        records = [{"商品信息": {"商品ID": str(i), "商品标题": f"商品{i}", "当前售价": f"¥{i}"}} for i in range(3)]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            outbox = NotifyOutbox.for_results_dir(tmp)
+            worker = OutboxWorker(outbox, dispatcher, lambda: config,
+                                  settings={"max_attempts": 3, "base_delay": 60, "max_delay": 60})
+            try:
+                assert outbox.enqueue(records, "测试推送", ["wx", "feishu"])["queued"] == 6
+                # 同一商品在同一渠道只入队一次
+                assert outbox.enqueue(records, "测试推送", ["wx", "feishu"])["duplicates"] == 6
+                print("[OK] 按 (商品ID, 渠道) 去重")
+
+                assert asyncio.run(worker.flush(10)) == 6
+                status = outbox.status()
+                assert status["channels"]["wx"]["sent"] == 3 and status["latency"]["count"] == 3
+                # 失败的推送按退避时间重新排队，未到期前不会再次取出
+                assert status["channels"]["feishu"]["queued"] == 3 and not outbox.claim()
+                assert len(stub.calls_to("/wx")) == 1
+                print("[OK] 送达记录延迟，失败推送退避重试")
+
+                # 发送中途被打断（flush 超时、停止）时立即归还租约，不会卡在发送中
+                stub.delay = 1
+                outbox.enqueue([{"商品信息": {"商品ID": "9", "商品标题": "商品9"}}], "测试推送", ["wx"])
+                asyncio.run(worker.flush(0.2))
+                assert outbox.status()["channels"]["wx"]["sending"] == 0 and len(outbox.claim()) == 1
+                print("[OK] 中断的发送归还租约")
+            finally:
+                outbox.close()
+                dispatcher.close()
+                stub.stop()
+
+        print("\n通知发件箱测试通过！\n")
+        return True
+    except Exception as e:
+        print(f"\n[ERROR] 通知发件箱测试失败: {e}\n")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_alert_rules():
+    """测试提醒规则（通过结果写入回调实时求值）"""
+    print("="*60)
+    print("测试 13: 提醒规则")
+    print("="*60)
+
+    import asyncio
+    import tempfile
+
+    try:
+        from src.alert_rules import AlertEngine, compile_rules
+        from src.result_segments import ResultWriter, set_current_record_hook
+
+        async def run(tmp):
+            alerts = []
+
+            async def notify(record, rule_names):
+                alerts.append((record["商品信息"]["商品ID"], rule_names))
+
+            engine = AlertEngine(compile_rules([{"name": "低价", "max_price": 100, "title_exclude": "配件"}]), notify)
+            set_current_record_hook(engine.submit)
+            writer = ResultWriter(tmp, "测试", settings={'max_bytes': 0, 'max_age_hours': 0})
+            writer.append({"商品信息": {"商品ID": "1", "商品标题": "相机", "当前售价": "¥80"}})
+            writer.append({"商品信息": {"商品ID": "2", "商品标题": "相机配件", "当前售价": "¥50"}})
+            # 在其他线程中写入的记录同样会推送
+            await asyncio.to_thread(writer.append, {"商品信息": {"商品ID": "3", "商品标题": "镜头", "当前售价": "¥90"}})
+            writer.append({"商品信息": {"商品ID": "1", "商品标题": "相机", "当前售价": "¥80"}})
+            await engine.drain()
+            return engine, alerts
+
+        with tempfile.TemporaryDirectory() as tmp:
+            engine, alerts = asyncio.run(run(tmp))
+        assert sorted(alerts) == [("1", ["低价"]), ("3", ["低价"])]
+        assert engine.counters["evaluated"] == 4 and engine.counters["sent"] == 2
+        print("[OK] 保存记录时实时求值，同一商品只推送一次")
+
+        print("\n提醒规则测试通过！\n")
+        return True
+    except Exception as e:
+        print(f"\n[ERROR] 提醒规则测试失败: {e}\n")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
 def main():
     """运行所有测试"""
     print("\n" + "="*60)
@@ -171,6 +540,14 @@ def main():
     results.append(("工具函数", test_utils()))
     results.append(("登录状态", test_check_login_state()))
     results.append(("Playwright", test_check_playwright()))
+    results.append(("商品索引", test_product_index()))
+    results.append(("Cron表达式", test_cron_expression()))
+    results.append(("任务存储", test_task_store()))
+    results.append(("mtop直连", test_mtop_client()))
+    results.append(("结果分段", test_result_segments()))
+    results.append(("通知分发", test_notify_dispatcher()))
+    results.append(("通知发件箱", test_notify_outbox()))
+    results.append(("提醒规则", test_alert_rules()))
 
     # 输出测试结果
     print("="*60)
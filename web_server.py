@@ -11,9 +11,11 @@ from datetime import datetime, timedelta
 from pathlib import Path
 from typing import List, Dict
 import secrets
+import time
+import uuid
 
 from fastapi import FastAPI, HTTPException, Depends, status, Request
-from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from starlette.middleware.sessions import SessionMiddleware
@@ -29,6 +31,35 @@ from src.config import (
     TASKS_FILE,
     get_notification_config,
 )
+from src.adaptive_limiter import get_shared_limiter
+from src.alert_rules import compile_rules
+from src.notify_dispatcher import NotificationDispatcher
+from src.notify_outbox import NotifyOutbox, OutboxWorker
+from src.browser_pool import BrowserPool, set_current_pool
+from src.live_events import LiveEventHub
+from src.log_reader import LogReader
+from src.process_supervisor import ProcessSupervisor, is_task_process, pid_alive
+from src.price_history import PriceHistory
+from src.product_index import ProductIndex
+from src.result_columns import ColumnStore
+from src.result_segments import maintain as maintain_result_segments
+from src.result_segments import remove_all_segments, source_paths
+from src.search_index import SearchIndex
+from src.task_queue import TaskAdmissionQueue
+from src.task_runner import InProcessTaskRunner
+from src.task_store import TaskStore, task_db_path
+
+try:
+    from src.scheduler import TaskScheduler
+except ImportError:  # 未安装 APScheduler 时定时任务不可用
+    TaskScheduler = None
+from src.result_store import (
+    RecordFilter,
+    ResultPager,
+    ResultStatsCache,
+    iter_export_chunks,
+    list_result_files,
+)
 
 # ==================== FastAPI应用 ====================
 app = FastAPI(title="闲鱼爬虫管理系统", version="1.0.0")
@@ -45,6 +76,37 @@ app.add_middleware(
 # Basic认证（保留用于API兼容）
 security = HTTPBasic()
 
+# 任务存储（SQLite，首次启动时自动导入 tasks.json）
+task_store = TaskStore(task_db_path(TASKS_FILE), TASKS_FILE)
+
+# 商品ID索引（推送商品时按ID直接定位记录）
+product_index = ProductIndex(JSONL_OUTPUT_DIR)
+
+# 结果文件统计缓存（按 size/mtime 增量统计记录数）
+result_stats = ResultStatsCache(JSONL_OUTPUT_DIR)
+
+# 结果分页读取（按需建立稀疏行偏移索引）
+result_pager = ResultPager(JSONL_OUTPUT_DIR)
+
+# 结果列式快照（价格/卖家统计）
+column_store = ColumnStore(JSONL_OUTPUT_DIR)
+
+# 商品全文检索（标题/描述，查询前增量同步新追加的记录）
+search_index = SearchIndex(JSONL_OUTPUT_DIR)
+
+# 商品价格历史和降价记录（由爬虫写入）
+price_history = PriceHistory.for_results_dir(JSONL_OUTPUT_DIR)
+
+# 通知分发（共用连接池，各渠道独立限速，多个商品合并成一条消息）
+notify_dispatcher = NotificationDispatcher()
+
+# 通知发件箱（推送先写入本地库，由后台按指数退避重试发送；任务子进程写入的推送也由这里继续发送）
+notify_outbox = NotifyOutbox.for_results_dir(JSONL_OUTPUT_DIR)
+outbox_worker = OutboxWorker(notify_outbox, notify_dispatcher, get_notification_config)
+
+# 任务日志读取（编码按文件缓存）
+log_reader = LogReader()
+
 # ==================== 数据模型 ====================
 class TaskCreate(BaseModel):
     task_name: str
@@ -56,6 +118,9 @@ class TaskCreate(BaseModel):
     cron_expression: str = None
     enabled: bool = True
     auto_push: bool = False  # 默认不开启自动推送
+    priority: int = 0  # 排队时的优先级，数值越大越先启动
+    detail_concurrency: int = 1  # 同时抓取详情的页面数（1=串行）
+    alert_rules: list = None  # 提醒规则，爬取时命中的商品立即推送（见 src/alert_rules.py）
 
 
 class TaskUpdate(BaseModel):
@@ -68,6 +133,9 @@ class TaskUpdate(BaseModel):
     cron_expression: str = None
     enabled: bool = None
     auto_push: bool = None  # 支持更新自动推送设置
+    priority: int = None
+    detail_concurrency: int = None
+    alert_rules: list = None
 
 
 class LoginRequest(BaseModel):
@@ -101,70 +169,463 @@ def verify_session(request: Request):
 
 
 def load_tasks():
-    """从文件加载任务列表"""
-    if os.path.exists(TASKS_FILE):
-        try:
-            with open(TASKS_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except:
-            return []
-    return []
+    """加载任务列表（读取内存缓存，任务数据变化后自动刷新）"""
+    return task_store.load_all()
 
 
 def save_tasks(tasks):
-    """保存任务列表到文件"""
-    with open(TASKS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(tasks, f, ensure_ascii=False, indent=2)
+    """保存整个任务列表（只写入有变化的任务）"""
+    task_store.save_all(tasks)
+
+
+def update_task_fields(task_id, fields, expect=None):
+    """按行更新单个任务的字段，expect 为前置条件，不满足时不写入并返回 None"""
+    return task_store.update(task_id, fields, expect=expect)
+
+
+# 实时事件推送（所有订阅者共用一个日志/状态监视器）
+live_events = LiveEventHub(load_tasks, LOG_DIR, log_reader)
+
+
+# ==================== 任务执行 ====================
+# 任务执行方式：subprocess=每次运行启动独立进程（默认），inprocess=在Web服务进程内以协程执行
+TASK_EXECUTION_MODE = os.getenv('TASK_EXECUTION_MODE', 'subprocess').strip().lower()
+# 进程内执行时同时运行的任务数上限
+INPROCESS_MAX_CONCURRENCY = int(os.getenv('INPROCESS_MAX_CONCURRENCY', '3'))
+
+# 进程内执行时的共享浏览器池大小（0=不使用浏览器池，每次运行自行启动浏览器）
+BROWSER_POOL_SIZE = int(os.getenv('BROWSER_POOL_SIZE', '0'))
+
+WORK_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 同时运行的任务数上限（手动启动、定时触发、批量重启都会排队等待空闲名额，0=不限制）
+MAX_CONCURRENT_RUNS = int(os.getenv('MAX_CONCURRENT_RUNS', '2'))
+
+# 停止任务时等待子进程响应 SIGTERM 的时间（秒），超时后强制结束
+TASK_STOP_TIMEOUT_SECONDS = int(os.getenv('TASK_STOP_TIMEOUT_SECONDS', '10'))
+
+# 结果文件维护间隔（秒）：滚动/清理历史分段并更新列式快照
+RESULT_MAINTENANCE_INTERVAL = int(os.getenv('RESULT_MAINTENANCE_INTERVAL', '600'))
+
+# 是否启用内置定时调度，以及触发时间的随机抖动上限（秒）
+SCHEDULER_ENABLED = os.getenv('SCHEDULER_ENABLED', 'true').lower() in ['true', '1', 'yes']
+SCHEDULER_JITTER_SECONDS = int(os.getenv('SCHEDULER_JITTER_SECONDS', '30'))
+
+# 共享浏览器池（仅进程内执行模式下启用）
+browser_pool = None
+
+# 结果文件维护的后台任务
+result_maintenance_task = None
+
+
+def _on_task_process_exit(task_id, exit_code, duration, log_file):
+    """
+    子进程退出后记录退出码和运行时长，并把状态改为 finished/failed（已手动停止的不覆盖）
+
+    接管的进程（服务重启前启动）无法获取退出码，不能断定成功，状态记为 unknown。
+    """
+    update_task_fields(task_id, {
+        'exit_code': exit_code,
+        'last_duration': duration,
+        'finished_at': datetime.now().isoformat(),
+    }, expect={'log_file': log_file})
+    if exit_code is None:
+        status = 'unknown'
+    else:
+        status = 'failed' if exit_code else 'finished'
+    if update_task_fields(task_id, {'status': status, 'pid': None}, expect={'status': 'running', 'log_file': log_file}):
+        print(f"[进程监管] 任务 {task_id} 已结束: {status}（退出码 {exit_code}，耗时 {duration} 秒）")
+
+
+# 子进程监管（回收退出的子进程、关闭日志句柄、更新任务状态）
+process_supervisor = ProcessSupervisor(_on_task_process_exit)
+
+
+async def _run_task_inprocess(task_id):
+    """在当前进程内执行一次任务（首次调用时才导入爬虫模块）"""
+    from main import run_task_by_id
+    # 爬虫通过 get_current_pool() 从池中借用浏览器上下文
+    set_current_pool(browser_pool)
+    await run_task_by_id(task_id)
+
+
+def _on_inprocess_task_finish(task_id, status, log_path):
+    """进程内任务结束后更新任务状态（任务已被重新启动时不覆盖）"""
+    update_task_fields(task_id, {'status': status}, expect={'log_file': os.path.basename(log_path)})
+
+
+task_runner = InProcessTaskRunner(_run_task_inprocess, INPROCESS_MAX_CONCURRENCY, _on_inprocess_task_finish)
+
+
+def launch_task(task):
+    """启动一次任务运行并保存任务的运行信息，返回子进程 pid（进程内执行时为 None）"""
+    task_id = task['id']
+    log_file = os.path.join(WORK_DIR, LOG_DIR, f"task_{task_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log")
+
+    if TASK_EXECUTION_MODE == 'inprocess':
+        task_runner.start(task_id, log_file)
+        pid = None
+    else:
+        # 启动独立进程运行爬虫，使用--task-id参数
+        # 添加 -u 参数禁用Python输出缓冲，确保日志实时写入
+        cmd = [sys.executable, "-u", "main.py", "--task-id", task_id]
+
+        # 打开日志文件以记录输出，使用行缓冲
+        log_handle = open(log_file, 'w', encoding='utf-8', buffering=1)
+
+        try:
+            process = subprocess.Popen(
+                cmd,
+                cwd=WORK_DIR,
+                stdout=log_handle,
+                stderr=subprocess.STDOUT,
+                creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == 'win32' else 0
+            )
+        except Exception:
+            log_handle.close()
+            raise
+        pid = process.pid
+        process_supervisor.track(task_id, process, log_handle, os.path.basename(log_file))
+
+    task.update(update_task_fields(task_id, {
+        'status': 'running',
+        'last_run': datetime.now().isoformat(),
+        'pid': pid,
+        'log_file': os.path.basename(log_file),
+    }) or {})
+    return pid
+
+
+def _send_stop_signal(pid, force=False):
+    """向子进程发送停止信号：默认 SIGTERM，force=True 时 SIGKILL"""
+    if sys.platform == 'win32':
+        # Windows系统使用taskkill命令（控制台进程无法优雅关闭，始终强制结束）
+        subprocess.run(['taskkill', '/F', '/PID', str(pid)],
+                       capture_output=True,
+                       timeout=5)
+    else:
+        # Linux/Mac系统使用os.kill
+        import signal
+        try:
+            os.kill(pid, signal.SIGKILL if force else signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+
+def terminate_task(task):
+    """停止任务的当前运行（取消进程内协程或向子进程发送 SIGTERM），不等待结束"""
+    if task_runner.stop(task['id']):
+        return
+
+    pid = task.get('pid')
+    if not pid:
+        return
+    _send_stop_signal(pid)
+
+
+def _wait_process_exit(task_id, pid, timeout):
+    """等待子进程退出（阻塞），返回是否已退出"""
+    if process_supervisor.get_pid(task_id) == pid:
+        return process_supervisor.wait(task_id, timeout)
+    deadline = time.time() + timeout
+    while pid_alive(pid):
+        if time.time() >= deadline:
+            return False
+        time.sleep(0.2)
+    return True
+
+
+def stop_process_gracefully(task_id, pid, timeout):
+    """SIGTERM → 等待退出 → 超时后 SIGKILL（阻塞，应在线程中调用），返回 terminated / killed"""
+    _send_stop_signal(pid)
+    if _wait_process_exit(task_id, pid, timeout):
+        return 'terminated'
+    print(f"[任务停止] 任务 {task_id} 的进程 {pid} 在 {timeout} 秒内未退出，强制结束")
+    _send_stop_signal(pid, force=True)
+    _wait_process_exit(task_id, pid, 5)
+    return 'killed'
+
+
+def is_task_active(task_id):
+    """判断任务的上一次运行是否仍在进行"""
+    if task_runner.is_running(task_id):
+        return True
+    return process_supervisor.is_running(task_id)
+
+
+def list_active_tasks():
+    """返回所有运行中的任务ID：子进程（含接管的进程）和进程内执行的任务"""
+    return set(process_supervisor.running_task_ids()) | set(task_runner.running_task_ids())
+
+
+def reconcile_running_tasks():
+    """服务启动时核对标记为运行中的任务：该任务的爬虫进程仍存在则接管监管，否则改为 stopped"""
+    for task in load_tasks():
+        if task.get('status') != 'running':
+            continue
+        pid = task.get('pid')
+        started_at = None
+        if task.get('last_run'):
+            started_at = datetime.fromisoformat(task['last_run']).timestamp()
+        # 机器重启或 pid 复用后，同一个 pid 可能属于无关进程，接管前确认是该任务的爬虫进程
+        if pid and is_task_process(pid, task['id'], started_at):
+            process_supervisor.adopt(task['id'], pid, task.get('log_file'), started_at)
+            print(f"[进程监管] 任务 '{task['task_name']}' 仍在运行（PID {pid}），已接管")
+        else:
+            update_task_fields(task['id'], {'status': 'stopped', 'pid': None},
+                               expect={'status': 'running', 'log_file': task.get('log_file')})
+            print(f"[进程监管] 任务 '{task['task_name']}' 的进程已不存在（或 PID {pid} 已不是该任务的进程），状态改为 stopped")
+
+
+def admit_task(task_id):
+    """任务队列放行时真正启动任务，任务已被删除或启动失败时返回 False"""
+    task = task_store.get(task_id)
+    if task is None:
+        return False
+    try:
+        launch_task(task)
+    except Exception as e:
+        # 启动失败时不能停留在 queued（队列已移除该任务，不会再放行）
+        print(f"[任务队列] 启动任务 '{task.get('task_name', task_id)}' 失败: {e}")
+        update_task_fields(task_id, {'status': 'failed', 'pid': None}, expect={'status': 'queued'})
+        return False
+    return True
+
+
+# 任务准入队列（限制同时运行的任务数，按优先级放行）
+# 不经过队列的运行（服务重启后接管的进程等）通过 list_active_tasks 同样计入名额
+task_queue = TaskAdmissionQueue(admit_task, is_task_active, max_concurrent=MAX_CONCURRENT_RUNS,
+                                list_active=list_active_tasks)
+
+
+def enqueue_task(task):
+    """把任务加入启动队列并标记为排队中，返回排队位置"""
+    position = task_queue.submit(task['id'], task.get('priority', 0))
+    update_task_fields(task['id'], {'status': 'queued'})
+    task['status'] = 'queued'
+    return position
+
+
+def run_scheduled_task(task_id):
+    """定时触发：把任务加入启动队列"""
+    task = task_store.get(task_id)
+    if task is None or not task.get('enabled', True):
+        return
+    position = enqueue_task(task)
+    print(f"[调度] 任务 '{task['task_name']}' 已加入启动队列（第 {position} 位）")
+
+
+# 内置定时调度器（按 cron_expression 启动任务）
+task_scheduler = None
+if SCHEDULER_ENABLED and TaskScheduler is not None:
+    task_scheduler = TaskScheduler(
+        run_scheduled_task,
+        lambda task_id: is_task_active(task_id) or task_queue.is_queued(task_id),
+        jitter=SCHEDULER_JITTER_SECONDS
+    )
+
+
+async def stop_task_and_wait(task, timeout=None):
+    """停止任务并等待其真正结束（子进程的等待在线程中进行，不阻塞事件循环），返回停止方式"""
+    timeout = timeout or TASK_STOP_TIMEOUT_SECONDS
+    if task_runner.stop(task['id']):
+        await task_runner.wait_stopped(task['id'], timeout)
+        return 'cancelled'
+    pid = task.get('pid')
+    if not pid:
+        return 'not_running'
+    return await asyncio.to_thread(stop_process_gracefully, task['id'], pid, timeout)
+
+
+# ==================== 批量重启 ====================
+# 最近的重启作业 job_id -> 作业信息（只保留最近 RESTART_JOBS_KEEP 个）
+restart_jobs = {}
+RESTART_JOBS_KEEP = 20
+
+
+async def _restart_one(job, entry, task):
+    """重启单个任务：停止并等待结束后重新加入启动队列"""
+    try:
+        entry['state'] = 'stopping'
+        entry['stop_method'] = await stop_task_and_wait(task)
+        entry['queue_position'] = enqueue_task(task)
+        entry['state'] = 'queued'
+        print(f"[{job['source']}] 任务 '{task['task_name']}' 已重新加入启动队列（第 {entry['queue_position']} 位）")
+    except Exception as e:
+        entry['state'] = 'failed'
+        entry['error'] = str(e)
+        print(f"[{job['source']}] 任务 '{task['task_name']}' 重启失败: {e}")
+
+
+async def _run_restart_job(job, tasks):
+    await asyncio.gather(*[_restart_one(job, entry, task) for entry, task in zip(job['tasks'], tasks)])
+    job['status'] = 'completed'
+    job['finished_at'] = datetime.now().isoformat()
+    job['restarted_count'] = sum(1 for entry in job['tasks'] if entry['state'] == 'queued')
+    job['failed_count'] = sum(1 for entry in job['tasks'] if entry['state'] == 'failed')
+
+
+def start_restart_job(tasks, source):
+    """在后台并发重启一组任务，立即返回作业信息（可通过作业ID查询进度）"""
+    job = {
+        'job_id': uuid.uuid4().hex[:12],
+        'source': source,
+        'status': 'running',
+        'created_at': datetime.now().isoformat(),
+        'finished_at': None,
+        'tasks': [
+            {'task_id': task['id'], 'task_name': task['task_name'], 'state': 'pending'}
+            for task in tasks
+        ],
+    }
+    restart_jobs[job['job_id']] = job
+    while len(restart_jobs) > RESTART_JOBS_KEEP:
+        restart_jobs.pop(next(iter(restart_jobs)))
+    job['_worker'] = asyncio.create_task(_run_restart_job(job, tasks))
+    return job
+
+
+def public_job(job):
+    return {key: value for key, value in job.items() if not key.startswith('_')}
 
 
 def get_results_list():
-    """获取所有结果文件列表"""
-    results = []
-    if os.path.exists(JSONL_OUTPUT_DIR):
-        for filename in os.listdir(JSONL_OUTPUT_DIR):
-            if filename.endswith('_full_data.jsonl'):
-                filepath = os.path.join(JSONL_OUTPUT_DIR, filename)
-                # 获取文件信息
-                stat = os.stat(filepath)
-                keyword = filename.replace('_full_data.jsonl', '')
-
-                # 统计记录数
-                count = 0
-                try:
-                    with open(filepath, 'r', encoding='utf-8') as f:
-                        count = sum(1 for _ in f)
-                except:
-                    pass
-
-                results.append({
-                    'filename': filename,
-                    'keyword': keyword,
-                    'count': count,
-                    'size': stat.st_size,
-                    'modified': datetime.fromtimestamp(stat.st_mtime).strftime('%Y-%m-%d %H:%M:%S')
-                })
+    """获取所有结果文件列表（记录数来自增量统计缓存）"""
+    results = result_stats.list_stats()
     # 按修改时间倒序排列
     results.sort(key=lambda x: x['modified'], reverse=True)
     return results
 
 
-def read_jsonl_file(filename, limit=50):
-    """读取JSONL文件的内容"""
-    filepath = os.path.join(JSONL_OUTPUT_DIR, filename)
-    records = []
+def read_jsonl_file(filename, limit=50, offset=0, cursor=None, reverse=False):
+    """分页读取JSONL文件的内容，返回 (记录列表, 下一页游标)"""
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            for line in f:
-                if line.strip():
-                    try:
-                        records.append(json.loads(line))
-                    except:
-                        continue
-                if len(records) >= limit:
-                    break
+        return result_pager.read_page(filename, offset=offset, limit=limit, cursor=cursor, reverse=reverse)
+    except ValueError:
+        raise
     except Exception as e:
-        print(f"Error reading file {filepath}: {e}")
-    return records
+        print(f"Error reading file {os.path.join(JSONL_OUTPUT_DIR, filename)}: {e}")
+    return [], None
+
+
+def maintain_results():
+    """滚动/清理结果文件的历史分段（跳过正在运行的任务写入的文件），并更新列式快照和全文索引"""
+    busy = {f"{task.get('keyword')}_full_data.jsonl" for task in load_tasks() if task.get('status') == 'running'}
+    result = maintain_result_segments(JSONL_OUTPUT_DIR, busy)
+    # 滚动后原活动分段的偏移已失效（记录会随新分段重新索引）
+    for filename in result['rotated_files']:
+        product_index.remove_file(filename)
+    for filename in list_result_files(JSONL_OUTPUT_DIR):
+        column_store.refresh(filename)
+    search_index.sync()
+
+
+async def _result_maintenance_loop():
+    while True:
+        try:
+            await asyncio.to_thread(maintain_results)
+        except Exception as e:
+            print(f"[结果分段] 维护失败: {e}")
+        await asyncio.sleep(RESULT_MAINTENANCE_INTERVAL)
+
+
+# ==================== 生命周期 ====================
+@app.on_event("startup")
+async def start_browser_pool():
+    """进程内执行模式下启动共享浏览器池"""
+    global browser_pool
+    if TASK_EXECUTION_MODE != 'inprocess' or BROWSER_POOL_SIZE <= 0:
+        return
+    recycle_memory_mb = int(os.getenv('BROWSER_POOL_RECYCLE_MEMORY_MB', '0'))
+    pool = BrowserPool(
+        size=BROWSER_POOL_SIZE,
+        headless=os.getenv('RUN_HEADLESS', 'true').lower() in ['true', '1', 'yes'],
+        use_edge=os.getenv('LOGIN_IS_EDGE', 'false').lower() in ['true', '1', 'yes'],
+        state_file=STATE_FILE,
+        max_contexts_per_browser=int(os.getenv('BROWSER_POOL_MAX_CONTEXTS', '4')),
+        recycle_after_pages=int(os.getenv('BROWSER_POOL_RECYCLE_PAGES', '200')),
+        recycle_memory_mb=recycle_memory_mb or None,
+    )
+    try:
+        await pool.start()
+        browser_pool = pool
+    except Exception as e:
+        print(f"[浏览器池] 启动失败，任务将自行启动浏览器: {e}")
+
+
+@app.on_event("startup")
+async def start_process_supervisor():
+    """核对服务重启前的运行中任务，并启动子进程监管"""
+    reconcile_running_tasks()
+    process_supervisor.start()
+
+
+@app.on_event("shutdown")
+async def stop_process_supervisor():
+    await process_supervisor.stop()
+
+
+@app.on_event("startup")
+async def start_task_queue():
+    """启动任务队列，并恢复服务重启前仍在排队的任务"""
+    task_queue.start()
+    tasks = load_tasks()
+    queued = [task for task in tasks if task.get('status') == 'queued']
+    for task in queued:
+        enqueue_task(task)
+    if queued:
+        print(f"[任务队列] 已恢复 {len(queued)} 个排队中的任务")
+
+
+@app.on_event("shutdown")
+async def stop_task_queue():
+    await task_queue.stop()
+
+
+@app.on_event("startup")
+async def start_task_scheduler():
+    """启动内置定时调度器"""
+    if task_scheduler is not None:
+        task_scheduler.start(load_tasks())
+    elif SCHEDULER_ENABLED:
+        print("[调度] 未安装 APScheduler，定时任务不可用（pip install apscheduler）")
+
+
+@app.on_event("shutdown")
+async def stop_task_scheduler():
+    if task_scheduler is not None:
+        task_scheduler.shutdown()
+
+
+@app.on_event("startup")
+async def start_result_maintenance():
+    global result_maintenance_task
+    if RESULT_MAINTENANCE_INTERVAL > 0:
+        result_maintenance_task = asyncio.create_task(_result_maintenance_loop())
+
+
+@app.on_event("shutdown")
+async def stop_result_maintenance():
+    if result_maintenance_task is not None:
+        result_maintenance_task.cancel()
+
+
+@app.on_event("shutdown")
+async def stop_browser_pool():
+    if browser_pool is not None:
+        await browser_pool.stop()
+
+
+@app.on_event("startup")
+async def start_outbox_worker():
+    outbox_worker.start()
+
+
+@app.on_event("shutdown")
+async def close_notify_dispatcher():
+    await outbox_worker.stop()
+    notify_dispatcher.close()
+    notify_outbox.close()
 
 
 # ==================== 认证路由 ====================
@@ -238,9 +699,34 @@ async def health_check():
 
 @app.get("/api/tasks")
 async def get_tasks(credentials: HTTPBasicCredentials = Depends(verify_credentials)):
-    """获取所有任务"""
+    """获取所有任务（附带下一次定时运行时间）"""
     tasks = load_tasks()
-    return {"tasks": tasks}
+    for task in tasks:
+        if task_scheduler is not None:
+            task['next_run'] = task_scheduler.get_next_run(task['id'])
+            if task['id'] in task_scheduler.errors:
+                task['schedule_error'] = task_scheduler.errors[task['id']]
+        else:
+            task['next_run'] = None
+
+    # 排队中的任务附带排队位置和预计等待时间
+    queue_status = task_queue.get_status()
+    queued = {item['task_id']: item for item in queue_status['queued']}
+    for task in tasks:
+        if task['id'] in queued:
+            task['queue_position'] = queued[task['id']]['position']
+            task['queue_eta_seconds'] = queued[task['id']]['eta_seconds']
+    return {"tasks": tasks, "queue": queue_status}
+
+
+def validate_alert_rules(rules):
+    """提醒规则在保存时先编译一次，无效的正则或字段直接返回 400"""
+    if not rules:
+        return
+    try:
+        compile_rules(rules)
+    except (ValueError, AttributeError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"提醒规则无效: {e}")
 
 
 @app.post("/api/tasks")
@@ -253,9 +739,10 @@ async def create_task(task: TaskCreate, credentials: HTTPBasicCredentials = Depe
         if existing_task['task_name'] == task.task_name:
             raise HTTPException(status_code=400, detail=f"任务名 '{task.task_name}' 已存在")
 
-    # 创建新任务
+    validate_alert_rules(task.alert_rules)
+
+    # 创建新任务（ID 由任务存储在事务内分配，删除任务后也不会重复）
     new_task = {
-        "id": str(len(tasks) + 1),
         "task_name": task.task_name,
         "keyword": task.keyword,
         "max_pages": task.max_pages,
@@ -265,152 +752,106 @@ async def create_task(task: TaskCreate, credentials: HTTPBasicCredentials = Depe
         "cron_expression": task.cron_expression,
         "enabled": task.enabled,
         "auto_push": task.auto_push,  # 添加自动推送设置
+        "priority": task.priority,
+        "detail_concurrency": task.detail_concurrency,
+        "alert_rules": task.alert_rules or [],
         "created_at": datetime.now().isoformat(),
         "last_run": None,
         "status": "idle"
     }
 
-    tasks.append(new_task)
-    save_tasks(tasks)
+    new_task = task_store.insert(new_task)
+    if task_scheduler is not None:
+        task_scheduler.sync(load_tasks())
 
     return {"message": "任务创建成功", "task": new_task}
 
 
 @app.put("/api/tasks/{task_id}")
 async def update_task(task_id: str, task: TaskUpdate, credentials: HTTPBasicCredentials = Depends(verify_credentials)):
-    """更新任务"""
-    tasks = load_tasks()
-
-    for existing_task in tasks:
-        if existing_task['id'] == task_id:
-            # 更新字段
-            if task.task_name is not None:
-                existing_task['task_name'] = task.task_name
-            if task.keyword is not None:
-                existing_task['keyword'] = task.keyword
-            if task.max_pages is not None:
-                existing_task['max_pages'] = task.max_pages
-            if task.personal_only is not None:
-                existing_task['personal_only'] = task.personal_only
-            if task.min_price is not None:
-                existing_task['min_price'] = task.min_price
-            if task.max_price is not None:
-                existing_task['max_price'] = task.max_price
-            if task.cron_expression is not None:
-                existing_task['cron_expression'] = task.cron_expression
-            if task.enabled is not None:
-                existing_task['enabled'] = task.enabled
-            if task.auto_push is not None:
-                existing_task['auto_push'] = task.auto_push
-
-            save_tasks(tasks)
-            return {"message": "任务更新成功", "task": existing_task}
+    """更新任务（只写入请求中提供的字段）"""
+    fields = task.dict(exclude_none=True)
+    validate_alert_rules(fields.get('alert_rules'))
+    updated_task = update_task_fields(task_id, fields)
+    if updated_task is None:
+        raise HTTPException(status_code=404, detail="任务未找到")
 
-    raise HTTPException(status_code=404, detail="任务未找到")
+    if task_scheduler is not None:
+        task_scheduler.sync(load_tasks())
+    return {"message": "任务更新成功", "task": updated_task}
 
 
 @app.delete("/api/tasks/{task_id}")
 async def delete_task(task_id: str, credentials: HTTPBasicCredentials = Depends(verify_credentials)):
     """删除任务"""
-    tasks = load_tasks()
-
-    for i, task in enumerate(tasks):
-        if task['id'] == task_id:
-            deleted_task = tasks.pop(i)
-            save_tasks(tasks)
-            return {"message": "任务删除成功", "task": deleted_task}
+    deleted_task = task_store.delete(task_id)
+    if deleted_task is None:
+        raise HTTPException(status_code=404, detail="任务未找到")
 
-    raise HTTPException(status_code=404, detail="任务未找到")
+    task_queue.cancel(task_id)
+    if task_scheduler is not None:
+        task_scheduler.sync(load_tasks())
+    return {"message": "任务删除成功", "task": deleted_task}
 
 
 @app.post("/api/tasks/{task_id}/start")
 async def start_task(task_id: str, credentials: HTTPBasicCredentials = Depends(verify_credentials)):
     """手动启动任务"""
-    tasks = load_tasks()
+    task = task_store.get(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="任务未找到")
 
-    for task in tasks:
-        if task['id'] == task_id:
-            # 在后台启动爬虫任务
-            try:
-                # 启动独立进程运行爬虫，使用--task-id参数
-                # 添加 -u 参数禁用Python输出缓冲，确保日志实时写入
-                cmd = [sys.executable, "-u", "main.py", "--task-id", task_id]
-
-                # 设置工作目录和创建日志文件
-                work_dir = os.path.dirname(os.path.abspath(__file__))
-                log_file = os.path.join(work_dir, LOG_DIR, f"task_{task_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log")
-
-                # 打开日志文件以记录输出，使用行缓冲
-                log_handle = open(log_file, 'w', encoding='utf-8', buffering=1)
-
-                # 启动进程
-                process = subprocess.Popen(
-                    cmd,
-                    cwd=work_dir,
-                    stdout=log_handle,
-                    stderr=subprocess.STDOUT,
-                    creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == 'win32' else 0
-                )
-
-                task['status'] = 'running'
-                task['last_run'] = datetime.now().isoformat()
-                task['pid'] = process.pid
-                task['log_file'] = os.path.basename(log_file)
-                save_tasks(tasks)
+    if is_task_active(task_id):
+        raise HTTPException(status_code=400, detail=f"任务 '{task['task_name']}' 正在运行")
 
-                return {
-                    "message": f"任务 '{task['task_name']}' 已启动",
-                    "task_id": task_id,
-                    "log_file": task['log_file']
-                }
-            except Exception as e:
-                raise HTTPException(status_code=500, detail=f"启动任务失败: {str(e)}")
+    # 加入启动队列，由队列在有空闲名额时启动
+    try:
+        position = enqueue_task(task)
 
-    raise HTTPException(status_code=404, detail="任务未找到")
+        return {
+            "message": f"任务 '{task['task_name']}' 已加入启动队列",
+            "task_id": task_id,
+            "queue_position": position
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"启动任务失败: {str(e)}")
 
 
 @app.post("/api/tasks/{task_id}/stop")
 async def stop_task(task_id: str, credentials: HTTPBasicCredentials = Depends(verify_credentials)):
     """手动停止任务"""
-    tasks = load_tasks()
+    task = task_store.get(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="任务未找到")
 
-    for task in tasks:
-        if task['id'] == task_id:
-            # 检查任务是否正在运行
-            if task.get('status') != 'running':
-                raise HTTPException(status_code=400, detail=f"任务 '{task['task_name']}' 当前未在运行")
+    # 排队中的任务直接移出队列
+    if task_queue.cancel(task_id):
+        update_task_fields(task_id, {'status': 'stopped'}, expect={'status': 'queued'})
+        return {"message": f"任务 '{task['task_name']}' 已取消排队", "task_id": task_id}
 
-            # 获取进程ID
-            pid = task.get('pid')
-            if not pid:
-                raise HTTPException(status_code=400, detail="任务进程ID不存在，无法停止")
+    # 检查任务是否正在运行
+    if task.get('status') != 'running':
+        raise HTTPException(status_code=400, detail=f"任务 '{task['task_name']}' 当前未在运行")
 
-            try:
-                # 尝试终止进程
-                if sys.platform == 'win32':
-                    # Windows系统使用taskkill命令
-                    import subprocess
-                    subprocess.run(['taskkill', '/F', '/PID', str(pid)],
-                                 capture_output=True,
-                                 timeout=5)
-                else:
-                    # Linux/Mac系统使用os.kill
-                    import signal
-                    os.kill(pid, signal.SIGTERM)
+    # 获取进程ID（进程内执行的任务没有独立进程）
+    pid = task.get('pid')
+    if not pid and not task_runner.is_running(task_id):
+        raise HTTPException(status_code=400, detail="任务进程ID不存在，无法停止")
 
-                # 更新任务状态
-                task['status'] = 'stopped'
-                save_tasks(tasks)
+    try:
+        # 尝试终止进程
+        terminate_task(task)
 
-                return {
-                    "message": f"任务 '{task['task_name']}' 已停止",
-                    "task_id": task_id,
-                    "pid": pid
-                }
-            except Exception as e:
-                raise HTTPException(status_code=500, detail=f"停止任务失败: {str(e)}")
+        # 更新任务状态（只针对本次停止的这一次运行）
+        update_task_fields(task_id, {'status': 'stopped'}, expect={'status': 'running', 'log_file': task.get('log_file')})
 
-    raise HTTPException(status_code=404, detail="任务未找到")
+        return {
+            "message": f"任务 '{task['task_name']}' 已停止",
+            "task_id": task_id,
+            "pid": pid
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"停止任务失败: {str(e)}")
 
 
 @app.post("/api/tasks/restart-all-running")
@@ -426,90 +867,233 @@ async def restart_all_running_tasks(credentials: HTTPBasicCredentials = Depends(
             "restarted_count": 0
         }
 
-    restarted_tasks = []
-    failed_tasks = []
+    # 在后台并发停止并重新排队，接口立即返回作业ID
+    job = start_restart_job(running_tasks, "批量重启")
 
-    for task in running_tasks:
-        task_id = task['id']
-        task_name = task['task_name']
-        pid = task.get('pid')
+    return {
+        "success": True,
+        "message": f"正在重启 {len(running_tasks)} 个任务",
+        "job_id": job['job_id'],
+        "restarted_count": len(running_tasks),
+        "job": public_job(job)
+    }
 
-        try:
-            # 1. 停止任务
-            if pid:
-                if sys.platform == 'win32':
-                    subprocess.run(['taskkill', '/F', '/PID', str(pid)],
-                                 capture_output=True, timeout=5)
-                else:
-                    import signal
-                    os.kill(pid, signal.SIGTERM)
 
-            # 等待进程结束
-            import time
-            time.sleep(1)
+@app.get("/api/tasks/restart-jobs/{job_id}")
+async def get_restart_job(job_id: str, credentials: HTTPBasicCredentials = Depends(verify_credentials)):
+    """查询重启作业的进度"""
+    job = restart_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="重启作业不存在或已过期")
+    return public_job(job)
 
-            # 2. 重新启动任务
-            cmd = [sys.executable, "-u", "main.py", "--task-id", task_id]
-            work_dir = os.path.dirname(os.path.abspath(__file__))
-            log_file = os.path.join(work_dir, LOG_DIR, f"task_{task_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log")
-            log_handle = open(log_file, 'w', encoding='utf-8', buffering=1)
 
-            process = subprocess.Popen(
-                cmd,
-                cwd=work_dir,
-                stdout=log_handle,
-                stderr=subprocess.STDOUT,
-                creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == 'win32' else 0
-            )
+@app.get("/api/results")
+async def get_results(credentials: HTTPBasicCredentials = Depends(verify_credentials)):
+    """获取所有结果文件列表"""
+    results = get_results_list()
+    return {"results": results}
 
-            # 更新任务信息
-            task['status'] = 'running'
-            task['last_run'] = datetime.now().isoformat()
-            task['pid'] = process.pid
-            task['log_file'] = os.path.basename(log_file)
 
-            restarted_tasks.append({
-                'task_id': task_id,
-                'task_name': task_name,
-                'new_pid': process.pid
-            })
+@app.get("/api/results/{filename}")
+async def get_result_detail(
+    filename: str,
+    limit: int = 50,
+    offset: int = 0,
+    cursor: str = None,
+    order: str = "asc",
+    credentials: HTTPBasicCredentials = Depends(verify_credentials)
+):
+    """
+    获取特定结果的详细数据（分页）
 
-        except Exception as e:
-            failed_tasks.append({
-                'task_id': task_id,
-                'task_name': task_name,
-                'error': str(e)
-            })
+    参数:
+    - limit: 每页记录数
+    - offset: 跳过的记录数（order=desc 时从最新的记录开始计算）
+    - cursor: 上一页返回的 next_cursor，用于连续翻页（跨历史分段时为 "分段文件名:行号"）
+    - order: asc=从最早的记录开始, desc=从最新的记录开始（tail）
+    """
+    # 安全检查：确保文件名合法
+    if not filename.endswith('_full_data.jsonl'):
+        raise HTTPException(status_code=400, detail="无效的文件名")
 
-    # 保存更新后的任务列表
-    save_tasks(tasks)
+    if order not in ('asc', 'desc'):
+        raise HTTPException(status_code=400, detail="order 只能为 asc 或 desc")
+
+    stats = result_stats.get_file_stats(filename)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="文件不存在")
+
+    try:
+        records, next_cursor = await asyncio.to_thread(
+            read_jsonl_file, filename, limit, offset, cursor, order == 'desc'
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
     return {
-        "success": True,
-        "message": f"已重启 {len(restarted_tasks)} 个任务",
-        "restarted_count": len(restarted_tasks),
-        "failed_count": len(failed_tasks),
-        "restarted_tasks": restarted_tasks,
-        "failed_tasks": failed_tasks
+        "filename": filename,
+        "count": len(records),
+        "total": stats['count'],
+        "offset": offset,
+        "order": order,
+        "next_cursor": next_cursor,
+        "records": records
     }
 
 
-@app.get("/api/results")
-async def get_results(credentials: HTTPBasicCredentials = Depends(verify_credentials)):
-    """获取所有结果文件列表"""
-    results = get_results_list()
-    return {"results": results}
+@app.get("/api/results/{filename}/stats")
+async def get_result_stats(
+    filename: str,
+    since: str = None,
+    until: str = None,
+    seller: str = None,
+    percentiles: str = "10,25,75,90",
+    bins: int = 20,
+    credentials: HTTPBasicCredentials = Depends(verify_credentials)
+):
+    """
+    结果文件的价格/卖家统计（基于列式快照）
 
+    参数:
+    - since / until: 爬取时间窗口（ISO格式）
+    - seller: 卖家昵称（包含匹配）
+    - percentiles: 价格分位数，逗号分隔
+    - bins: 价格直方图分箱数
+    """
+    # 安全检查：确保文件名合法
+    if not filename.endswith('_full_data.jsonl'):
+        raise HTTPException(status_code=400, detail="无效的文件名")
 
-@app.get("/api/results/{filename}")
-async def get_result_detail(filename: str, limit: int = 50, credentials: HTTPBasicCredentials = Depends(verify_credentials)):
-    """获取特定结果的详细数据"""
+    if result_stats.get_file_stats(filename) is None:
+        raise HTTPException(status_code=404, detail="文件不存在")
+
+    try:
+        since_time = datetime.fromisoformat(since) if since else None
+        until_time = datetime.fromisoformat(until) if until else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="时间格式无效，请使用ISO格式")
+    try:
+        quantiles = [float(q) for q in percentiles.split(',') if q.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="percentiles 格式无效")
+    if any(not 0 <= q <= 100 for q in quantiles) or not 1 <= bins <= 200:
+        raise HTTPException(status_code=400, detail="percentiles 须在 0~100 之间，bins 须在 1~200 之间")
+
+    return await asyncio.to_thread(
+        column_store.stats, filename, since=since_time, until=until_time,
+        seller=seller, percentiles=quantiles, bins=bins
+    )
+
+
+@app.get("/api/results/{filename}/export")
+async def export_result(
+    filename: str,
+    min_price: float = None,
+    max_price: float = None,
+    seller: str = None,
+    since: str = None,
+    until: str = None,
+    gzip: bool = False,
+    credentials: HTTPBasicCredentials = Depends(verify_credentials)
+):
+    """
+    流式导出结果文件（NDJSON，每行一条记录）
+
+    参数:
+    - min_price / max_price: 价格区间
+    - seller: 卖家昵称（包含匹配）
+    - since / until: 爬取时间窗口（ISO格式，如 2025-12-01T00:00:00）
+    - gzip: 是否以 gzip 压缩输出
+    """
     # 安全检查：确保文件名合法
     if not filename.endswith('_full_data.jsonl'):
         raise HTTPException(status_code=400, detail="无效的文件名")
 
-    records = read_jsonl_file(filename, limit)
-    return {"filename": filename, "count": len(records), "records": records}
+    filepaths = source_paths(JSONL_OUTPUT_DIR, filename)
+    if not filepaths:
+        raise HTTPException(status_code=404, detail="文件不存在")
+
+    try:
+        record_filter = RecordFilter(min_price=min_price, max_price=max_price, seller=seller, since=since, until=until)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="时间格式无效，请使用ISO格式")
+
+    # 响应头中的文件名需要URL编码（关键词通常为中文）
+    from urllib.parse import quote
+    download_name = filename + ('.gz' if gzip else '')
+
+    return StreamingResponse(
+        iter_export_chunks(filepaths, record_filter, compress=gzip),
+        media_type="application/gzip" if gzip else "application/x-ndjson",
+        headers={"Content-Disposition": f"attachment; filename*=UTF-8''{quote(download_name)}"}
+    )
+
+
+@app.get("/api/search")
+async def search_products(
+    q: str,
+    min_price: float = None,
+    max_price: float = None,
+    keyword: str = None,
+    sort: str = "newest",
+    limit: int = 20,
+    offset: int = 0,
+    credentials: HTTPBasicCredentials = Depends(verify_credentials)
+):
+    """
+    跨所有结果文件检索商品标题和描述
+
+    参数:
+    - q: 检索词，多个词之间为 AND（如 "A7M4 快门数 低"）
+    - min_price / max_price: 价格区间
+    - keyword: 只检索某个关键词的结果
+    - sort: newest=最近收录, relevance=相关度, price_asc / price_desc=价格
+    """
+    if sort not in ('newest', 'relevance', 'price_asc', 'price_desc'):
+        raise HTTPException(status_code=400, detail="sort 只能为 newest/relevance/price_asc/price_desc")
+    limit = min(max(limit, 1), 100)
+
+    def run():
+        search_index.sync()
+        start = time.perf_counter()
+        result = search_index.search(q, min_price=min_price, max_price=max_price, keyword=keyword,
+                                     sort=sort, limit=limit, offset=max(offset, 0))
+        result['elapsed_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        return result
+
+    result = await asyncio.to_thread(run)
+    return {"query": q, "offset": offset, **result}
+
+
+@app.get("/api/price-history/{product_id}")
+async def get_price_history(product_id: str, credentials: HTTPBasicCredentials = Depends(verify_credentials)):
+    """获取商品的价格曲线（只包含价格变化的点）"""
+    series = await asyncio.to_thread(price_history.get_series, product_id)
+    if series is None:
+        raise HTTPException(status_code=404, detail="没有该商品的价格记录")
+    return series
+
+
+@app.get("/api/price-drops")
+async def get_price_drops(
+    min_pct: float = 10,
+    hours: float = 24,
+    keyword: str = None,
+    limit: int = 100,
+    credentials: HTTPBasicCredentials = Depends(verify_credentials)
+):
+    """
+    降价商品列表（最新的在前）
+
+    参数:
+    - min_pct: 最小降幅（百分比）
+    - hours: 最近多少小时内的降价
+    - keyword: 只看某个关键词
+    """
+    since = datetime.now() - timedelta(hours=hours)
+    drops = await asyncio.to_thread(price_history.drops, min_pct, since, keyword, min(max(limit, 1), 1000))
+    return {"drops": drops, "count": len(drops)}
 
 
 @app.delete("/api/results/{filename}")
@@ -522,13 +1106,20 @@ async def delete_result(filename: str, credentials: HTTPBasicCredentials = Depen
     # 构建文件路径
     filepath = os.path.join(JSONL_OUTPUT_DIR, filename)
 
-    # 检查文件是否存在
-    if not os.path.exists(filepath):
+    # 检查文件是否存在（活动分段可能已被滚动，只剩历史分段）
+    if not source_paths(JSONL_OUTPUT_DIR, filename):
         raise HTTPException(status_code=404, detail="文件不存在")
 
     try:
-        # 删除文件
-        os.remove(filepath)
+        # 删除文件、历史分段及其索引
+        product_index.remove_file(filename, include_segments=True)
+        search_index.remove_file(filename, include_segments=True)
+        if os.path.exists(filepath):
+            os.remove(filepath)
+        remove_all_segments(JSONL_OUTPUT_DIR, filename)
+        column_store.remove(filename)
+        result_stats.invalidate(filename)
+        result_pager.invalidate(filename)
         return {"message": f"文件 '{filename}' 已成功删除"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"删除文件失败: {str(e)}")
@@ -558,19 +1149,36 @@ async def get_system_status(credentials: HTTPBasicCredentials = Depends(verify_c
 
     status = {
         "login_state_exists": os.path.exists(STATE_FILE),
-        "tasks_file_exists": os.path.exists(TASKS_FILE),
+        "tasks_file_exists": os.path.exists(task_store.db_path),
         "output_dir_exists": os.path.exists(JSONL_OUTPUT_DIR),
-        "results_count": len(get_results_list()),
+        "results_count": len(list_result_files(JSONL_OUTPUT_DIR)),
         "tasks_count": len(load_tasks()),
         "notification_configured": bool(get_notification_config().get('wx_bot_url') or
                                        get_notification_config().get('dingtalk_bot_url') or
                                        get_notification_config().get('feishu_bot_url')),
+        "task_execution_mode": TASK_EXECUTION_MODE,
+        "inprocess_runner": task_runner.get_status(),
+        "processes": process_supervisor.get_status(),
         "cookie_configured": bool(current_cookie),
         "cookie_preview": current_cookie[:50] + "..." if len(current_cookie) > 50 else current_cookie if current_cookie else ""
     }
     return status
 
 
+@app.get("/api/system/browser-pool")
+async def get_browser_pool_metrics(credentials: HTTPBasicCredentials = Depends(verify_credentials)):
+    """获取共享浏览器池的使用情况"""
+    if browser_pool is None:
+        return {"enabled": False}
+    return {"enabled": True, **browser_pool.get_metrics()}
+
+
+@app.get("/api/system/rate-limit")
+async def get_rate_limit_stats(minutes: int = 60, credentials: HTTPBasicCredentials = Depends(verify_credentials)):
+    """获取所有任务共享的请求限速状态，以及最近 N 分钟每分钟的请求数/错误数/风控次数"""
+    return await asyncio.to_thread(get_shared_limiter().get_stats, minutes)
+
+
 @app.post("/api/system/cookie")
 async def update_cookie(request: dict, credentials: HTTPBasicCredentials = Depends(verify_credentials)):
     """更新 Cookie 配置"""
@@ -691,70 +1299,15 @@ async def update_browser_mode(request: dict, credentials: HTTPBasicCredentials =
             if running_tasks:
                 print(f"[浏览器模式] 检测到 {len(running_tasks)} 个正在运行的任务，准备自动重启...")
 
-                restarted_tasks = []
-                for task in running_tasks:
-                    task_id = task['id']
-                    task_name = task['task_name']
-                    pid = task.get('pid')
-
-                    try:
-                        # 1. 停止任务
-                        if pid:
-                            if sys.platform == 'win32':
-                                subprocess.run(['taskkill', '/F', '/PID', str(pid)],
-                                             capture_output=True, timeout=5)
-                            else:
-                                import signal
-                                os.kill(pid, signal.SIGTERM)
-
-                        # 等待进程结束
-                        import time
-                        time.sleep(1)
-
-                        # 2. 重新启动任务
-                        cmd = [sys.executable, "-u", "main.py", "--task-id", task_id]
-                        work_dir = os.path.dirname(os.path.abspath(__file__))
-                        log_file = os.path.join(work_dir, LOG_DIR, f"task_{task_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log")
-                        log_handle = open(log_file, 'w', encoding='utf-8', buffering=1)
-
-                        process = subprocess.Popen(
-                            cmd,
-                            cwd=work_dir,
-                            stdout=log_handle,
-                            stderr=subprocess.STDOUT,
-                            creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == 'win32' else 0
-                        )
-
-                        # 更新任务信息
-                        task['status'] = 'running'
-                        task['last_run'] = datetime.now().isoformat()
-                        task['pid'] = process.pid
-                        task['log_file'] = os.path.basename(log_file)
-
-                        restarted_tasks.append({
-                            'task_id': task_id,
-                            'task_name': task_name,
-                            'new_pid': process.pid
-                        })
-
-                        print(f"[浏览器模式] 任务 '{task_name}' 已重启 (PID: {process.pid})")
-
-                    except Exception as e:
-                        print(f"[浏览器模式] 任务 '{task_name}' 重启失败: {e}")
-
-                # 保存更新后的任务列表
-                save_tasks(tasks)
-
-                if restarted_tasks:
-                    result["auto_restarted"] = True
-                    result["restarted_info"] = {
-                        "count": len(restarted_tasks),
-                        "tasks": restarted_tasks
-                    }
-
-                    message = f"浏览器模式已设置为: {'无头模式' if headless else '有头模式'}，已自动重启 {len(restarted_tasks)} 个任务"
-                else:
-                    message = f"浏览器模式已设置为: {'无头模式' if headless else '有头模式'}，但重启任务失败"
+                job = start_restart_job(running_tasks, "浏览器模式")
+                result["auto_restarted"] = True
+                result["restarted_info"] = {
+                    "count": len(running_tasks),
+                    "job_id": job['job_id'],
+                    "tasks": job['tasks']
+                }
+
+                message = f"浏览器模式已设置为: {'无头模式' if headless else '有头模式'}，正在后台重启 {len(running_tasks)} 个任务"
             else:
                 message = f"浏览器模式已设置为: {'无头模式' if headless else '有头模式'}，当前没有运行中的任务"
 
@@ -765,8 +1318,22 @@ async def update_browser_mode(request: dict, credentials: HTTPBasicCredentials =
 
 
 @app.get("/api/tasks/{task_id}/logs")
-async def get_task_logs(task_id: str, credentials: HTTPBasicCredentials = Depends(verify_credentials)):
-    """获取任务日志"""
+async def get_task_logs(
+    task_id: str,
+    since: int = None,
+    tail: int = None,
+    max_bytes: int = 1024 * 1024,
+    credentials: HTTPBasicCredentials = Depends(verify_credentials)
+):
+    """
+    获取任务日志
+
+    参数:
+    - since: 上次返回的 next_offset，只返回之后新增的内容
+    - tail: 只返回最后 N 行（从文件末尾向前读取）
+    - max_bytes: since 模式下单次最多返回的字节数
+    两者都不指定时返回完整日志
+    """
     tasks = load_tasks()
 
     for task in tasks:
@@ -780,24 +1347,22 @@ async def get_task_logs(task_id: str, credentials: HTTPBasicCredentials = Depend
                 return {"error": "日志文件不存在"}
 
             try:
-                # 尝试多种编码方式读取日志文件
-                log_content = None
-                for encoding in ['utf-8', 'gbk', 'gb2312', 'latin-1']:
-                    try:
-                        with open(log_path, 'r', encoding=encoding) as f:
-                            log_content = f.read()
-                        break
-                    except UnicodeDecodeError:
-                        continue
-
-                if log_content is None:
-                    return {"error": "无法读取日志文件（编码问题）"}
+                if since is not None:
+                    result = await asyncio.to_thread(log_reader.read_since, log_path, since, max(max_bytes, 1))
+                elif tail is not None:
+                    result = await asyncio.to_thread(log_reader.read_tail, log_path, max(tail, 0))
+                else:
+                    result = await asyncio.to_thread(log_reader.read_all, log_path)
 
                 return {
                     "task_id": task_id,
                     "log_file": log_file,
-                    "log_content": log_content,
-                    "log_lines": len(log_content.split('\n'))
+                    "log_content": result['content'],
+                    "log_lines": result['content'].count('\n') + (1 if result['content'] and not result['content'].endswith('\n') else 0),
+                    "next_offset": result['next_offset'],
+                    "size": result['size'],
+                    "reset": result['reset'],
+                    "encoding": result['encoding']
                 }
             except Exception as e:
                 return {"error": f"读取日志文件失败: {str(e)}"}
@@ -805,6 +1370,51 @@ async def get_task_logs(task_id: str, credentials: HTTPBasicCredentials = Depend
     raise HTTPException(status_code=404, detail="任务未找到")
 
 
+@app.get("/api/events")
+async def stream_events(request: Request, task_id: str = None, credentials: HTTPBasicCredentials = Depends(verify_credentials)):
+    """
+    实时事件流（Server-Sent Events）
+
+    事件类型:
+    - snapshot: 连接后的第一条事件，包含所有任务的状态和日志当前偏移
+    - status: 任务状态变化
+    - log: 日志新增内容（含 next_offset，可与 /api/tasks/{task_id}/logs?since= 衔接）
+    - resync: 客户端处理过慢丢失了事件，需要重新拉取
+
+    参数:
+    - task_id: 只接收指定任务的事件
+    """
+    queue = live_events.subscribe()
+
+    async def event_stream():
+        try:
+            while True:
+                if await request.is_disconnected():
+                    break
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    # 心跳，防止代理断开空闲连接
+                    yield ": keep-alive\n\n"
+                    continue
+
+                if task_id:
+                    if event['type'] == 'snapshot':
+                        event = {**event, 'tasks': [t for t in event['tasks'] if t['task_id'] == task_id]}
+                    elif event.get('task_id') not in (None, task_id):
+                        continue
+
+                yield f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+        finally:
+            live_events.unsubscribe(queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @app.get("/api/system/notification")
 async def get_notification_config_api(request: Request):
     """获取通知配置"""
@@ -907,11 +1517,12 @@ async def update_notification_config(request_req: Request, request: dict):
 @app.post("/api/notify-products")
 async def notify_products(request: Request, product_ids: list = None, message: str = None):
     """
-    批量推送指定商品到通知渠道
+    批量推送指定商品到通知渠道（写入发件箱后立即返回，由后台发送）
 
     参数:
     - product_ids: 商品ID列表
     - message: 推送消息（可选）
+    - resend: 已推送过的商品也重新推送（默认同一商品在同一渠道只推送一次）
     """
     try:
         # 解析请求体
@@ -919,6 +1530,7 @@ async def notify_products(request: Request, product_ids: list = None, message: s
         body = await request.json()
         product_ids = body.get('product_ids', [])
         message = body.get('message', '批量推送商品')
+        resend = bool(body.get('resend', False))
         print(f"[DEBUG] 请求参数: product_ids数量={len(product_ids)}, message={message}")
         if product_ids:
             print(f"[DEBUG] 前3个商品ID: {product_ids[:3]}")
@@ -932,121 +1544,37 @@ async def notify_products(request: Request, product_ids: list = None, message: s
 
         # 检查通知配置
         notify_config = get_notification_config()
-        has_notification = any([
-            notify_config.get('ntfy_topic_url'),
-            notify_config.get('gotify_url'),
-            notify_config.get('bark_url'),
-            notify_config.get('wx_bot_url'),
-            notify_config.get('dingtalk_bot_url'),
-            notify_config.get('feishu_bot_url'),
-            notify_config.get('telegram_bot_token'),
-            notify_config.get('webhook_url')
-        ])
-
-        if not has_notification:
+        channels = NotificationDispatcher.configured_channels(notify_config)
+
+        if not channels:
             raise HTTPException(status_code=400, detail="未配置任何通知渠道，请先在系统设置中配置通知渠道")
 
-        # 在所有JSONL文件中查找指定商品
-        found_products = []
+        # 通过商品索引定位指定商品（先增量同步新追加的记录）
         jsonl_dir = Path(JSONL_OUTPUT_DIR)
 
         if not jsonl_dir.exists():
             raise HTTPException(status_code=404, detail="数据目录不存在")
 
-        print(f"[DEBUG] 开始在JSONL文件中查找商品...")
-        # 遍历所有_full_data.jsonl文件
-        for jsonl_file in jsonl_dir.glob("*_full_data.jsonl"):
-            print(f"[DEBUG] 检查文件: {jsonl_file.name}")
-            try:
-                with open(jsonl_file, 'r', encoding='utf-8', errors='replace') as f:
-                    line_count = 0
-                    for line in f:
-                        if not line.strip():
-                            continue
-                        line_count += 1
-                        try:
-                            product = json.loads(line)
-                            # 商品ID在"商品信息"字段内
-                            product_id = product.get('商品信息', {}).get('商品ID', '')
-
-                            if product_id in product_ids:
-                                found_products.append(product)
-                                print(f"[DEBUG] 找到商品: {product_id}")
-                                # 如果找到了所有商品，可以提前退出
-                                if len(found_products) == len(product_ids):
-                                    break
-                        except json.JSONDecodeError:
-                            continue
-                    print(f"[DEBUG] 文件 {jsonl_file.name} 处理了 {line_count} 行")
-            except Exception as e:
-                print(f"读取文件 {jsonl_file} 时出错: {e}")
-                continue
-
-        print(f"[DEBUG] 查找完成: 共找到 {len(found_products)} 个商品")
+        await asyncio.to_thread(product_index.sync)
+        found_products = await asyncio.to_thread(product_index.fetch, product_ids)
+        print(f"[推送] 通过商品索引找到 {len(found_products)}/{len(product_ids)} 个商品")
 
-        # 发送通知
-        print(f"[DEBUG] 开始导入 send_notification...")
-        try:
-            from src.notification import send_notification
-            print(f"[DEBUG] 导入 send_notification 成功")
-        except Exception as import_error:
-            print(f"[ERROR] 导入 send_notification 失败: {import_error}")
-            import traceback
-            traceback.print_exc()
-            raise
-
-        print(f"[DEBUG] 准备发送 {len(found_products)} 个商品的通知...")
-        sent_count = 0
-        for idx, product in enumerate(found_products):
-            try:
-                # 从商品信息中提取数据
-                product_info = product.get('商品信息', {})
-                seller_info = product.get('卖家信息', {})
-
-                print(f"[DEBUG] 正在处理第 {idx+1}/{len(found_products)} 个商品: {product_info.get('商品ID', 'unknown')}")
-
-                # 构建扁平化的商品数据，用于send_notification
-                flat_product_data = {
-                    '商品标题': product_info.get('商品标题', '未知商品'),
-                    '当前售价': product_info.get('当前售价', 'N/A'),
-                    '商品链接': product_info.get('商品链接', '#'),
-                    '商品主图链接': product_info.get('商品主图链接', ''),
-                    '商品图片列表': product_info.get('商品图片列表', []),
-                    '商品ID': product_info.get('商品ID', ''),
-                    '卖家昵称': product_info.get('卖家昵称', seller_info.get('卖家昵称', '未知'))
-                }
-
-                # 构建通知消息（精简以符合企业微信4096字节限制）
-                title = product_info.get('商品标题', '未知商品')
-                price = product_info.get('当前售价', '未知')
-                link = product_info.get('商品链接', '#')
-                seller = product_info.get('卖家昵称', seller_info.get('卖家昵称', '未知'))
-
-                # 限制标题长度，避免消息过长
-                if len(title) > 50:
-                    title = title[:50] + '...'
-
-                content = f"{message}\n\n商品: {title}\n价格: {price}\n卖家: {seller}\n链接: {link}"
-
-                print(f"[DEBUG] 调用 send_notification 函数...")
-                # 发送通知 - 注意参数顺序：(product_data, reason, notification_config)
-                await send_notification(flat_product_data, content, notify_config)
-                sent_count += 1
-                print(f"[DEBUG] 成功发送商品 {product_info.get('商品ID', 'unknown')} 的通知")
-            except Exception as e:
-                print(f"[ERROR] 发送商品 {product.get('商品信息', {}).get('商品ID', 'unknown')} 通知失败: {e}")
-                import traceback
-                traceback.print_exc()
-                continue
-
-        print(f"[DEBUG] 推送完成: 成功发送 {sent_count}/{len(found_products)} 个商品")
+        # 写入发件箱：后台各渠道并发发送，同一渠道内多个商品合并成一条消息并按渠道限速，失败自动重试
+        queued = await asyncio.to_thread(notify_outbox.enqueue, found_products, message, channels, resend)
+        outbox_worker.wake()
 
         return {
-            "message": f"推送完成",
-            "sent_count": sent_count,
+            "message": "已加入推送队列",
+            # 推送改为后台发送后，这里只能返回加入队列的商品数，送达情况见 /api/notify-outbox/status；
+            # sent_count 与 queued_count 相同，仅为兼容旧客户端保留
+            "queued_count": queued['products'],
+            "sent_count": queued['products'],
+            "queued": queued['queued'],
+            "duplicates": queued['duplicates'],
+            "channels": channels,
             "total_requested": len(product_ids),
             "total_found": len(found_products),
-            "not_found_count": len(product_ids) - len(found_products)
+            "not_found_count": len(product_ids) - len(found_products),
         }
 
     except HTTPException:
@@ -1057,6 +1585,28 @@ async def notify_products(request: Request, product_ids: list = None, message: s
         raise HTTPException(status_code=500, detail=f"推送商品时发生错误: {str(e)}")
 
 
+@app.get("/api/notify-outbox/status")
+async def get_notify_outbox_status(
+    hours: float = 24,
+    credentials: HTTPBasicCredentials = Depends(verify_credentials)
+):
+    """
+    通知发件箱状态：待发送/发送中/已送达/已放弃数量（总计和按渠道）、送达延迟和最近的失败
+
+    参数:
+    - hours: 统计最近多少小时内送达的推送的延迟
+    """
+    return await asyncio.to_thread(notify_outbox.status, hours)
+
+
+@app.post("/api/notify-outbox/retry")
+async def retry_notify_outbox(channel: str = None, credentials: HTTPBasicCredentials = Depends(verify_credentials)):
+    """把已放弃（超过重试次数）的推送重新排队"""
+    count = await asyncio.to_thread(notify_outbox.retry_failed, channel)
+    outbox_worker.wake()
+    return {"message": f"已重新排队 {count} 条推送", "count": count}
+
+
 # ==================== 主程序入口 ====================
 if __name__ == "__main__":
     import uvicorn